@@ -0,0 +1,223 @@
+import json
+import logging
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress
+from pathlib import Path
+from typing import List, NamedTuple
+
+from PIL import Image, ImageSequence
+
+from mapping import load_mapping_profile, tile_plane
+from model import NMSObject, ObjectTable
+from object_index import ObjectIndex
+from pipeline import (
+    GenerationJob,
+    SpriteImage,
+    color_matcher,
+    job_tag,
+    load_base,
+    map_image,
+    warm_caches,
+)
+from preview import rasterize, save_preview
+from serialization import encode_objects, open_output, write_base_document
+from sharding import manifest_path, sibling_path
+from validation import IncompatibleImageError, validate_pixel_input_data
+from voxels import EMPTY, layer_keys
+
+logger = logging.getLogger(__name__)
+
+# Byte planes turned into 0/1 planes: any nonzero byte, every key but EMPTY, and NOT
+_NONZERO = bytes([0]) + bytes([1]) * 255
+_NOT_EMPTY = bytes([1]) * EMPTY + bytes([0]) * (256 - EMPTY)
+_INVERT = bytes([1, 0]) + bytes(254)
+
+
+class FrameDiff(NamedTuple):
+    """What changes from one frame to the next. changed is a 0/1 plane of the pixels
+    whose part differs (including appearing or disappearing), added the changed pixels
+    that place an object in the new frame. The counts split the changed pixels into
+    objects added, removed and swapped for another part."""
+
+    changed: bytes
+    added: bytes
+    appeared: int
+    disappeared: int
+    swapped: int
+
+
+def _and(first: bytes, second: bytes) -> bytes:
+    return (int.from_bytes(first) & int.from_bytes(second)).to_bytes(len(first))
+
+
+def diff_keys(previous: bytes, current: bytes) -> FrameDiff:
+    """Compares two planes of part keys (EMPTY where nothing is placed) with a few
+    big integer and translate operations, not per pixel."""
+    if len(previous) != len(current):
+        raise ValueError("Frames do not have the same size")
+    changed = (int.from_bytes(previous) ^ int.from_bytes(current)).to_bytes(
+        len(current)
+    )
+    changed = changed.translate(_NONZERO)
+    was_placed = _and(changed, previous.translate(_NOT_EMPTY))
+    added = _and(changed, current.translate(_NOT_EMPTY))
+    swapped = _and(was_placed, added).count(1)
+    return FrameDiff(
+        changed,
+        added,
+        added.count(1) - swapped,
+        was_placed.count(1) - swapped,
+        swapped,
+    )
+
+
+def _frame_sort_key(file_path) -> list:
+    """Sorts walk_2.png before walk_10.png."""
+    return [
+        int(part) if part.isdigit() else part
+        for part in re.split(r"(\d+)", Path(file_path).name)
+    ]
+
+
+def read_frames(sprite_files: List[str]) -> list:
+    """The frames of an animation: every frame of one animated file (GIF, APNG or WebP),
+    or one frame per file of a numbered sequence, in number order. Frames of an animated
+    file have to be decoded in order, so they are decoded here into RGBA images; files
+    of a sequence are returned as paths, to be decoded by the workers."""
+    if len(sprite_files) > 1:
+        return sorted(map(str, sprite_files), key=_frame_sort_key)
+    with Image.open(sprite_files[0]) as image:
+        validate_pixel_input_data(image)
+        if getattr(image, "n_frames", 1) == 1:
+            return [str(sprite_files[0])]
+        return [frame.convert("RGBA") for frame in ImageSequence.Iterator(image)]
+
+
+def frame_output_path(output_file, index: int) -> Path:
+    """out.json becomes out.frame0.json, out.frame1.json, ..."""
+    return sibling_path(output_file, f"frame{index}")
+
+
+def _map_frame(job: GenerationJob, frame) -> tuple:
+    """Worker side of animate: decodes and quantizes one frame. Returns the quantized
+    image and its part keys (see voxels.layer_keys)."""
+    tables = load_mapping_profile(job.profile)
+    if isinstance(frame, Image.Image):
+        sprite = SpriteImage(frame)
+    else:
+        sprite = SpriteImage.open(frame)
+    alpha_mask = sprite.transparency_mask()
+    image = sprite.quantize(color_matcher(job, tables))
+    keep = tile_plane(image, alpha_mask, tables)
+    keys = layer_keys(image.tobytes().translate(tables.part_lut), keep)
+    return image, keys
+
+
+def _map_changes(
+    job: GenerationJob, base_computer: dict, image: Image.Image, added: bytes
+) -> tuple:
+    """Worker side of animate: generates and encodes the objects of a frame's added
+    pixels only. Returns the ObjectTable and the encoded objects."""
+    objects, _ = map_image(
+        image,
+        added.translate(_INVERT),
+        NMSObject(base_computer),
+        load_mapping_profile(job.profile),
+        job,
+    )
+    objects.set_message(job_tag(job))
+    indent = None if job.compact else 4
+    return objects, encode_objects(objects.iter_dicts(), indent)
+
+
+def animate(job: GenerationJob, sprite_files: List[str], max_workers=None) -> dict:
+    """Generates an animated sprite as one base variant per frame, written next to
+    job.output_file (see frame_output_path). Frames are decoded and quantized in
+    parallel in a process pool. The first frame is generated in full, every later frame
+    only where its parts differ from the frame before, so the work and the objects that
+    change between variants follow what moves in the animation rather than its size.
+    Objects are encoded once, and copied as text into every variant they appear in.
+    Every frame is tagged like job, so with job.replace each variant replaces what an
+    earlier run generated. Writes a manifest of the frames and returns it."""
+    if job.voxels or job.coalesce:
+        raise ValueError("Animations can not be coalesced or use voxels")
+    base_document = load_base(job.base_json, job.cache)
+    base_computer = base_document.base_computer
+    anchor = NMSObject(base_computer)
+    tag = job_tag(job)
+    removed = array("q")
+    if job.replace:
+        removed = ObjectIndex.from_document(base_document).with_tag(tag)
+    frames = read_frames(sprite_files)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=warm_caches, initargs=([job.profile],)
+    ) as executor:
+        mapped = list(executor.map(_map_frame, [job] * len(frames), frames))
+        sizes = {image.size for image, _ in mapped}
+        if len(sizes) > 1:
+            raise IncompatibleImageError("All frames must have the same size")
+
+        diffs = []
+        previous = bytes([EMPTY]) * len(mapped[0][1])
+        for _, keys in mapped:
+            diffs.append(diff_keys(previous, keys))
+            previous = keys
+        changes = [
+            executor.submit(_map_changes, job, base_computer, image, diff.added)
+            for (image, _), diff in zip(mapped, diffs)
+        ]
+
+        objects = ObjectTable()
+        encoded = []
+        # The pixel each row of objects was generated from, in the same order
+        row_pixels = array("q")
+        manifest_frames = []
+        tables = load_mapping_profile(job.profile)
+        for index, (diff, change) in enumerate(zip(diffs, changes)):
+            kept = bytes(map(diff.changed.__getitem__, row_pixels)).translate(_INVERT)
+            objects = objects.filter(kept)
+            encoded = list(compress(encoded, kept))
+            row_pixels = array("q", compress(row_pixels, kept))
+            added_objects, added_encoded = change.result()
+            objects.extend(added_objects)
+            encoded.extend(added_encoded)
+            row_pixels.extend(compress(range(len(diff.added)), diff.added))
+
+            output_file = frame_output_path(job.output_file, index)
+            with open_output(output_file, compress=job.compress) as outfile:
+                write_base_document(
+                    outfile,
+                    base_document,
+                    encoded,
+                    indent=None if job.compact else 4,
+                    removed=removed,
+                    encoded=True,
+                )
+            if job.preview:
+                image = rasterize(objects, anchor, tables, job.placement)
+                save_preview(image, frame_output_path(job.preview, index))
+            manifest_frames.append(
+                {
+                    "output_file": str(output_file),
+                    "objects": len(objects),
+                    "added": diff.appeared,
+                    "removed": diff.disappeared,
+                    "swapped": diff.swapped,
+                }
+            )
+
+    manifest = {
+        "base_json": str(job.base_json),
+        "sprite_files": [str(sprite_file) for sprite_file in sprite_files],
+        "tag": tag,
+        "z_up": job.z_up,
+        "frames": manifest_frames,
+        "removed": len(removed),
+    }
+    with open(manifest_path(job.output_file), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    logger.debug("Wrote %s frames of %s next to %s", len(frames), tag, job.output_file)
+    return manifest
@@ -0,0 +1,231 @@
+import gzip
+import hashlib
+import json
+import mmap
+import struct
+from pathlib import Path
+
+from model import ObjectTable
+from palette import cache_dir
+from result_cache import DEFAULT_MAX_CACHE_BYTES, ResultCache
+from serialization import BaseDocument, parse_base_document
+
+SNAPSHOT_VERSION = 3
+SNAPSHOT_MAGIC = b"NMSB"
+# magic, format version, size, mtime and SHA-256 of the source file, the offsets of the
+# Objects array's "[" and "]" and the base computer's row (-1 when missing)
+SNAPSHOT_HEADER = struct.Struct("<4sHQq32sqqq")
+# Sections follow the header and a table of their byte lengths, each one padded to a
+# multiple of 8 bytes so the arrays can be read straight out of the mapped file
+SECTIONS = (
+    ("text", None),
+    ("base_computer", None),
+    ("object_spans", "q"),
+    ("object_ids", None),
+    ("object_id_index", "H"),
+    ("positions", "d"),
+    ("up", "d"),
+    ("at", "d"),
+    ("timestamps", "q"),
+    ("userdata", "q"),
+    ("messages", None),
+    ("message_index", "H"),
+    ("extras", None),
+    ("missing", None),
+)
+SECTION_TABLE = struct.Struct(f"<{len(SECTIONS)}Q")
+
+
+def _padded(data: bytes) -> bytes:
+    return data + bytes(-len(data) % 8)
+
+
+def _decode_text(data: bytes, source) -> str:
+    """Decodes the bytes of a base export like serialization.read_base_document does."""
+    if str(source).endswith(".gz"):
+        data = gzip.decompress(data)
+    return data.decode("utf-8-sig")
+
+
+def encode_snapshot(document: BaseDocument, source_stat, source_hash: bytes) -> bytes:
+    """Packs a scanned document and its object table into the snapshot format."""
+    table = document.object_table()
+    sections = {
+        "text": document.text.encode(),
+        "base_computer": json.dumps(document.base_computer).encode(),
+        "object_spans": document.object_spans.tobytes(),
+        "object_ids": json.dumps(table.object_ids).encode(),
+        "messages": json.dumps(table.messages).encode(),
+        "extras": json.dumps(table.extras).encode(),
+        "missing": json.dumps(table.missing).encode(),
+    }
+    for name, typecode in SECTIONS:
+        if typecode is not None and name != "object_spans":
+            sections[name] = getattr(table, name).tobytes()
+
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_VERSION,
+        source_stat.st_size,
+        source_stat.st_mtime_ns,
+        source_hash,
+        -1 if document.objects_start is None else document.objects_start,
+        -1 if document.objects_end is None else document.objects_end,
+        -1 if document.base_computer_index is None else document.base_computer_index,
+    )
+    lengths = SECTION_TABLE.pack(*(len(sections[name]) for name, _ in SECTIONS))
+    return b"".join(
+        [_padded(header + lengths), *(_padded(sections[name]) for name, _ in SECTIONS)]
+    )
+
+
+def snapshot_source(data) -> tuple:
+    """(size, mtime, hash) of the source file a snapshot was made from."""
+    _, _, size, mtime_ns, source_hash, *_ = SNAPSHOT_HEADER.unpack_from(data)
+    return size, mtime_ns, source_hash
+
+
+class SnapshotDocument(BaseDocument):
+    """A BaseDocument backed by a snapshot. The object spans and table columns are
+    views of the snapshot's buffer, and the text is only decoded from it when something
+    needs it as a str, usually to write the document out."""
+
+    def __init__(self, data, text_start: int, text_end: int):
+        # Set before BaseDocument.__init__ assigns the text
+        self._data = data
+        self._text_bounds = (text_start, text_end)
+        super().__init__(None)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            start, end = self._text_bounds
+            self._text = str(memoryview(self._data)[start:end], "utf-8")
+        return self._text
+
+    @text.setter
+    def text(self, text: str | None):
+        self._text = text
+
+    def contains(self, fragment: str) -> bool:
+        if self._text is None and fragment.isascii():
+            # ASCII only matches ASCII in UTF-8, so the encoded text can be searched
+            return self._data.find(fragment.encode(), *self._text_bounds) >= 0
+        return super().contains(fragment)
+
+
+def decode_snapshot(data) -> BaseDocument:
+    """Rebuilds the document and its object table from a snapshot. data is bytes or a
+    memory-mapped file, which the document keeps open: columns are cast views of it,
+    and nothing but the string pools and the base computer is decoded up front."""
+    view = memoryview(data)
+    magic, version, _, _, _, start, end, base_row = SNAPSHOT_HEADER.unpack_from(view)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported base snapshot")
+    lengths = SECTION_TABLE.unpack_from(view, SNAPSHOT_HEADER.size)
+    offset = SNAPSHOT_HEADER.size + SECTION_TABLE.size
+    offset += -offset % 8
+    bounds = {}
+    for (name, typecode), length in zip(SECTIONS, lengths):
+        if offset + length > len(view):
+            raise ValueError("Truncated base snapshot")
+        bounds[name] = (offset, offset + length)
+        offset += length + -length % 8
+
+    def section(name):
+        section_start, section_end = bounds[name]
+        return view[section_start:section_end]
+
+    def column(name, typecode):
+        return section(name).cast(typecode)
+
+    document = SnapshotDocument(data, *bounds["text"])
+    document.objects_start = None if start < 0 else start
+    document.objects_end = None if end < 0 else end
+    document.object_spans = column("object_spans", "q")
+    if base_row >= 0:
+        document.base_computer_index = base_row
+        document.base_computer = json.loads(bytes(section("base_computer")))
+
+    table = ObjectTable()
+    table.object_ids = json.loads(bytes(section("object_ids")))
+    table.messages = json.loads(bytes(section("messages")))
+    extras = json.loads(bytes(section("extras")))
+    table.extras = {int(row): values for row, values in extras.items()}
+    missing = json.loads(bytes(section("missing")))
+    table.missing = {int(row): keys for row, keys in missing.items()}
+    for name, typecode in SECTIONS:
+        if typecode is not None and name != "object_spans":
+            setattr(table, name, column(name, typecode))
+    table.check_columns()
+    if len(table) != document.object_count:
+        raise ValueError("Base snapshot does not match its document")
+    document.table = table
+    return document
+
+
+class SnapshotCache(ResultCache):
+    """Snapshots of parsed base exports, one per source file. A snapshot is used while
+    the source file keeps its size and modification time, or its content hash when only
+    the time changed, and is rebuilt otherwise. Shares the eviction of ResultCache."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        super().__init__(directory or cache_dir() / "bases", max_bytes)
+
+    @staticmethod
+    def snapshot_name(source) -> str:
+        path = str(Path(source).resolve()).encode()
+        return f"base-{hashlib.sha256(path).hexdigest()[:32]}.snap"
+
+    def load(self, source) -> BaseDocument | None:
+        """The snapshot of the source file, or None when it is missing or stale."""
+        path = self.directory / self.snapshot_name(source)
+        try:
+            stat = Path(source).stat()
+            with open(path, "rb") as snapshot_file:
+                data = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        # The mapping is not closed here: the document's columns are views of it, and
+        # it is unmapped once they are all gone
+        try:
+            size, mtime_ns, source_hash = snapshot_source(data)
+            if size != stat.st_size:
+                return None
+            touched = mtime_ns != stat.st_mtime_ns
+            if touched:
+                source_data = Path(source).read_bytes()
+                if hashlib.sha256(source_data).digest() != source_hash:
+                    return None
+            document = decode_snapshot(data)
+        except (OSError, ValueError, TypeError, struct.error):
+            return None
+        if touched:
+            # Same content with a new time, so the next load can skip the hash again
+            self.store(source, document, stat, source_hash)
+        else:
+            self._touch(path)
+        return document
+
+    def store(self, source, document: BaseDocument, source_stat, source_hash: bytes):
+        data = encode_snapshot(document, source_stat, source_hash)
+        self._write(self.snapshot_name(source), data)
+
+
+def read_base_snapshot(file_path, cache: SnapshotCache | None = None) -> BaseDocument:
+    """serialization.read_base_document through the snapshot cache: the scanned
+    document comes with its object table already decoded, and byte-identical text."""
+    cache = cache or SnapshotCache()
+    document = cache.load(file_path)
+    if document is not None:
+        return document
+
+    source_stat = Path(file_path).stat()
+    data = Path(file_path).read_bytes()
+    document = parse_base_document(_decode_text(data, file_path))
+    try:
+        cache.store(file_path, document, source_stat, hashlib.sha256(data).digest())
+    except (OSError, ValueError):
+        # Objects the table can not hold are still fine to pass through
+        document.table = None
+    return document
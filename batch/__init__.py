@@ -0,0 +1,110 @@
+import csv
+import dataclasses
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterator, List
+
+from pipeline import GenerationJob, run_job, warm_caches
+from validation import InvalidBatchManifestError
+
+# Manifest columns that hold paths, resolved relative to the manifest file
+PATH_FIELDS = (
+    "base_json",
+    "sprite_file",
+    "output_file",
+    "profile",
+    "heightmap",
+    "preview",
+)
+BOOLEAN_FIELDS = ("coalesce", "compact", "compress", "cache", "replace")
+FLOAT_FIELDS = ("z_up", "rotation", "scale")
+
+
+@dataclasses.dataclass
+class BatchResult(object):
+    job: GenerationJob
+    ok: bool
+    seconds: float
+    objects: int = 0
+    error: str = ""
+
+
+def _parse_boolean(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "y")
+
+
+def _job_from_row(row: dict, root: Path, line: int) -> GenerationJob:
+    fields = {key: value for key, value in row.items() if value not in (None, "")}
+    names = {field.name for field in dataclasses.fields(GenerationJob)}
+    unknown = set(fields) - names
+    if unknown:
+        raise InvalidBatchManifestError(f"Job {line}: unknown fields {sorted(unknown)}")
+    try:
+        for key in PATH_FIELDS:
+            if key in fields:
+                fields[key] = str(root / fields[key])
+        for key in BOOLEAN_FIELDS:
+            if key in fields:
+                fields[key] = _parse_boolean(fields[key])
+        for key in FLOAT_FIELDS:
+            if key in fields:
+                fields[key] = float(fields[key])
+        if "max_height" in fields:
+            fields["max_height"] = int(fields["max_height"])
+        if "layers" in fields:
+            # A JSON list, or paths separated by ";" in a CSV column
+            layers = fields["layers"]
+            if isinstance(layers, str):
+                layers = layers.split(";")
+            fields["layers"] = tuple(str(root / layer) for layer in layers)
+        return GenerationJob(**fields)
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidBatchManifestError(f"Job {line}: {e!r}") from e
+
+
+def load_batch_manifest(manifest_file) -> List[GenerationJob]:
+    """Reads generation jobs from a CSV file with a header row, or a JSON file holding a
+    list of objects. Both use GenerationJob's field names, e.g.
+
+        sprite_file,base_json,z_up,output_file
+        sprites/link_sprite.png,bases/home.json,40,out/link.json
+
+    Relative paths are resolved against the manifest's directory."""
+    manifest_file = Path(manifest_file)
+    root = manifest_file.parent
+    with open(manifest_file, newline="") as infile:
+        if manifest_file.suffix == ".json":
+            rows = json.load(infile)
+            if isinstance(rows, dict):
+                rows = rows.get("jobs")
+            if not isinstance(rows, list):
+                raise InvalidBatchManifestError("Expected a list of jobs")
+        else:
+            rows = list(csv.DictReader(infile))
+    return [_job_from_row(row, root, line) for line, row in enumerate(rows, start=1)]
+
+
+def _timed_run_job(job: GenerationJob) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        result = run_job(job)
+    except Exception as e:
+        # One bad job must not stop the batch, so every failure is reported as a result
+        error = f"{type(e).__name__}: {e}"
+        return BatchResult(job, False, time.perf_counter() - start, error=error)
+    return BatchResult(job, True, time.perf_counter() - start, result.objects)
+
+
+def run_batch(jobs: List[GenerationJob], max_workers=None) -> Iterator[BatchResult]:
+    """Runs the jobs on a process pool and yields their results as they finish."""
+    profiles = sorted({job.profile for job in jobs})
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=warm_caches, initargs=(profiles,)
+    ) as executor:
+        futures = [executor.submit(_timed_run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,719 @@
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+from constants import (
+    CONFLICT_MODES,
+    DEFAULT_HOST,
+    DEFAULT_MAX_HEIGHT,
+    DEFAULT_PORT,
+    DEFAULT_PROFILE_PATH,
+    DEFAULT_SPACING,
+    MATCHERS,
+    PLANES,
+)
+from validation import (
+    ImageTooBigError,
+    IncompatibleImageError,
+    InvalidBaseDataError,
+    InvalidBatchManifestError,
+    InvalidImageType,
+    InvalidMappingProfileError,
+    PlacementConflictError,
+)
+
+# Only constants and the exceptions are imported up front. Each command imports the
+# modules it runs (and with them Pillow) itself, so --help and invalid arguments return
+# before any of them are loaded.
+
+logger = logging.getLogger(__name__)
+
+
+def generate_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Produces updated NMS base JSON data from PNG image data (pixel art); intended to be used with NMS Save Editor",
+        epilog="Run 'nms-gen batch --help' to process many sprites and bases at once, "
+        "'nms-gen compose --help' to lay out many sprites in one base, "
+        "'nms-gen animate --help' to generate an animated sprite, "
+        "'nms-gen preview --help' to render a result back into an image, or "
+        "'nms-gen serve --help' to keep a generation service running.",
+    )
+    parser.add_argument(
+        "base_json", type=str, help="Path to the JSON file containing base data"
+    )
+    parser.add_argument(
+        "sprite_file", type=str, help="Path to the PNG file with the input sprite data"
+    )
+    parser.add_argument(
+        "z_up",
+        type=float,
+        help="Vertical adjustment (Z) to put tiles above terrain",
+        default=5.0,
+    )
+    parser.add_argument("--o", type=str, help="Path to JSON output file")
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Path to a mapping profile (TOML/JSON) mapping palette colors to base parts",
+        default=DEFAULT_PROFILE_PATH,
+    )
+    parser.add_argument(
+        "--matcher",
+        choices=MATCHERS,
+        default="rgb",
+        help="rgb snaps colors to the nearest NES palette color, so colors the profile "
+        "does not map are left out; lab matches every color to the perceptually nearest "
+        "color that maps to a part",
+    )
+    parser.add_argument(
+        "--plane",
+        choices=PLANES,
+        default="floor",
+        help="Lay the sprite flat on the floor or stand it up like a wall, in the base "
+        "computer's frame",
+    )
+    parser.add_argument(
+        "--rotate",
+        type=float,
+        default=0.0,
+        metavar="DEGREES",
+        help="Rotate the sprite about the plane's normal",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Scale the tile spacing and the size of every part",
+    )
+    parser.add_argument(
+        "--layers",
+        type=str,
+        nargs="+",
+        metavar="SPRITE_FILE",
+        help="Voxel mode: sprites of the same size stacked above sprite_file, one layer each",
+    )
+    parser.add_argument(
+        "--heightmap",
+        type=str,
+        help="Voxel mode: grayscale PNG the size of the sprite; brighter pixels extrude "
+        "the sprite higher",
+    )
+    parser.add_argument(
+        "--max-height",
+        type=int,
+        default=DEFAULT_MAX_HEIGHT,
+        help="Height in voxels of the brightest heightmap pixels",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Merge same-colored areas into scaled-up square parts to reduce the object count",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        nargs="+",
+        metavar="BASE_JSON",
+        help="Additional base JSON files; a sprite too big for one base is split across "
+        "base_json and these bases, writing one output per base plus a manifest",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes used with --shard (defaults to the CPU count)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        nargs="?",
+        const="-",
+        metavar="TRACE_JSON",
+        help="Time every pipeline stage and track peak memory; prints a summary, or writes "
+        "a JSON trace when a path is given",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Write compact JSON without indentation (much smaller and faster to write)",
+    )
+    parser.add_argument(
+        "--tag",
+        type=str,
+        help="Name to tag the generated objects with (defaults to the sprite file's name)",
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Replace the objects a previous run generated with the same tag instead of "
+        "adding another copy; unchanged objects are left in place",
+    )
+    parser.add_argument(
+        "--on-conflict",
+        choices=CONFLICT_MODES,
+        default="ignore",
+        help="Check generated objects against the base's existing objects and report the "
+        "overlapping ones, skip them, or shift the sprite to the nearest clear spot",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Neither reuse nor store intermediate results in the on-disk result cache",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Gzip compress the output file (implied when the output path ends with .gz)",
+    )
+    parser.add_argument(
+        "--preview",
+        type=str,
+        help="Also render the generated objects back into this PNG file",
+    )
+    return parser
+
+
+def batch_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="nms-gen batch",
+        description="Runs many generation jobs listed in a CSV/JSON manifest on a process pool",
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="CSV (with a header row) or JSON file of jobs with the columns sprite_file, "
+        "base_json, z_up, output_file and optionally profile, coalesce, compact",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes (defaults to the CPU count)",
+    )
+    return parser
+
+
+def compose_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="nms-gen compose",
+        description="Lays out many sprites around the base computer of one base and writes "
+        "them all in a single pass. Sprites that do not fit in the object budget are skipped",
+    )
+    parser.add_argument(
+        "base_json",
+        type=str,
+        help="Path to base JSON data (exported from NMS Save Editor)",
+    )
+    parser.add_argument(
+        "z_up",
+        type=float,
+        help="Raises every sprite up along the base computer's Up axis",
+    )
+    parser.add_argument("sprites", type=str, nargs="+", help="Sprite files")
+    parser.add_argument(
+        "--output", "-o", type=str, required=True, help="Path of the output base JSON"
+    )
+    parser.add_argument(
+        "--spacing",
+        type=int,
+        default=DEFAULT_SPACING,
+        help=f"Empty tiles between neighbouring sprites (default {DEFAULT_SPACING})",
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        help="Most objects to add (defaults to the room left in the base)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=DEFAULT_PROFILE_PATH,
+        help="Mapping profile (TOML or JSON) of palette colors to objects",
+    )
+    parser.add_argument(
+        "--matcher", choices=MATCHERS, default="rgb", help="See nms-gen --help"
+    )
+    parser.add_argument(
+        "--plane", type=str, choices=PLANES, default="floor", help="See nms-gen --help"
+    )
+    parser.add_argument("--rotate", type=float, default=0.0, help="See nms-gen --help")
+    parser.add_argument("--scale", type=float, default=1.0, help="See nms-gen --help")
+    parser.add_argument("--coalesce", action="store_true", help="See nms-gen --help")
+    parser.add_argument("--compact", action="store_true", help="See nms-gen --help")
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Replace the objects previous runs generated from the same sprites",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes (defaults to the CPU count)",
+    )
+    parser.add_argument(
+        "--gzip", action="store_true", help="Gzip compress the output file"
+    )
+    return parser
+
+
+def animate_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="nms-gen animate",
+        description="Generates one base variant per frame of an animated sprite (GIF, APNG "
+        "or WebP) or of a numbered sequence of PNGs, written as OUTPUT.frame0.json, "
+        "OUTPUT.frame1.json, ... Only the pixels that change between frames are generated "
+        "again",
+    )
+    parser.add_argument(
+        "base_json",
+        type=str,
+        help="Path to base JSON data (exported from NMS Save Editor)",
+    )
+    parser.add_argument(
+        "z_up",
+        type=float,
+        help="Raises the sprite up along the base computer's Up axis",
+    )
+    parser.add_argument(
+        "frames", type=str, nargs="+", help="An animated sprite, or one file per frame"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        required=True,
+        help="Path the variants are named after",
+    )
+    parser.add_argument(
+        "--tag",
+        type=str,
+        help="Name the objects are tagged with (defaults to the first frame's file name)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=DEFAULT_PROFILE_PATH,
+        help="Mapping profile (TOML or JSON) of palette colors to objects",
+    )
+    parser.add_argument(
+        "--matcher", choices=MATCHERS, default="rgb", help="See nms-gen --help"
+    )
+    parser.add_argument(
+        "--plane", type=str, choices=PLANES, default="floor", help="See nms-gen --help"
+    )
+    parser.add_argument("--rotate", type=float, default=0.0, help="See nms-gen --help")
+    parser.add_argument("--scale", type=float, default=1.0, help="See nms-gen --help")
+    parser.add_argument("--compact", action="store_true", help="See nms-gen --help")
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Replace the objects a previous run generated with the same tag",
+    )
+    parser.add_argument(
+        "--preview",
+        type=str,
+        help="Also render every variant into a PNG named after this path",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes (defaults to the CPU count)",
+    )
+    parser.add_argument(
+        "--gzip", action="store_true", help="Gzip compress the output files"
+    )
+    return parser
+
+
+def preview_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="nms-gen preview",
+        description="Renders the generated objects of a base JSON back into a PNG, one "
+        "pixel per tile, colored like the palette colors they were mapped from. Parts the "
+        "mapping profile does not know are drawn in magenta",
+    )
+    parser.add_argument("base_json", type=str, help="Path to base JSON data")
+    parser.add_argument(
+        "--output", "-o", type=str, required=True, help="Path of the PNG to write"
+    )
+    parser.add_argument(
+        "--tag",
+        type=str,
+        help="Only render the objects generated from this sprite (all generated objects "
+        "by default)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=DEFAULT_PROFILE_PATH,
+        help="Mapping profile the objects were generated with",
+    )
+    parser.add_argument(
+        "--plane", type=str, choices=PLANES, default="floor", help="See nms-gen --help"
+    )
+    parser.add_argument("--rotate", type=float, default=0.0, help="See nms-gen --help")
+    parser.add_argument("--scale", type=float, default=1.0, help="See nms-gen --help")
+    parser.add_argument(
+        "--zoom", type=int, default=1, help="Pixels per tile in the written PNG"
+    )
+    return parser
+
+
+def serve_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="nms-gen serve",
+        description="Keeps the palette, mapping profiles and recently used bases loaded and "
+        "generates sprites sent over HTTP on a Unix socket or a localhost port",
+    )
+    parser.add_argument(
+        "--socket", type=str, help="Listen on this Unix socket instead of a TCP port"
+    )
+    parser.add_argument(
+        "--host", type=str, default=DEFAULT_HOST, help="Address to listen on"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="Port to listen on"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="+",
+        default=[DEFAULT_PROFILE_PATH],
+        help="Mapping profiles to compile when the service starts",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes (defaults to the CPU count)",
+    )
+    return parser
+
+
+def run_serve_command(argv) -> int:
+    args = vars(serve_parser().parse_args(argv))
+    logging.basicConfig(level=logging.INFO)
+    import asyncio
+
+    from service import serve
+
+    try:
+        asyncio.run(
+            serve(
+                socket_path=args["socket"],
+                host=args["host"],
+                port=args["port"],
+                max_workers=args["workers"],
+                profiles=args["profile"],
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error("Unable to start the service: %s", e)
+        return 1
+    return 0
+
+
+def run_compose_command(argv) -> int:
+    args = vars(compose_parser().parse_args(argv))
+    logging.basicConfig(level=logging.INFO)
+    for file_path in [args["base_json"], *args["sprites"]]:
+        file_exists(file_path)
+    from composition import compose
+    from pipeline import GenerationJob
+
+    try:
+        job = GenerationJob(
+            base_json=args["base_json"],
+            sprite_file=args["sprites"][0],
+            z_up=args["z_up"],
+            output_file=args["output"],
+            profile=args["profile"],
+            coalesce=args["coalesce"],
+            compact=args["compact"],
+            compress=True if args["gzip"] else None,
+            replace=args["replace"],
+            plane=args["plane"],
+            rotation=args["rotate"],
+            scale=args["scale"],
+            matcher=args["matcher"],
+        )
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    start = time.perf_counter()
+    try:
+        manifest = compose(
+            job,
+            args["sprites"],
+            spacing=args["spacing"],
+            budget=args["budget"],
+            max_workers=args["workers"],
+        )
+    except ImageTooBigError:
+        logger.error("A sprite has more pixels than a base allows")
+        return 1
+    except (
+        OSError,
+        IncompatibleImageError,
+        InvalidBaseDataError,
+        InvalidMappingProfileError,
+    ) as e:
+        logger.error(e)
+        return 1
+    for sprite in manifest["sprites"]:
+        print(
+            f"[ok] {sprite['sprite_file']} at {sprite['box']} ({sprite['objects']} objects)"
+        )
+    for sprite_file in manifest["skipped"]:
+        print(f"[skipped] {sprite_file}")
+    print(
+        f"Composed {len(manifest['sprites'])} of {len(args['sprites'])} sprites into "
+        f"{job.output_file} in {time.perf_counter() - start:.2f}s"
+    )
+    return 0
+
+
+def run_animate_command(argv) -> int:
+    args = vars(animate_parser().parse_args(argv))
+    logging.basicConfig(level=logging.INFO)
+    for file_path in [args["base_json"], *args["frames"]]:
+        file_exists(file_path)
+    from animation import animate
+    from pipeline import GenerationJob
+
+    try:
+        job = GenerationJob(
+            base_json=args["base_json"],
+            sprite_file=args["frames"][0],
+            z_up=args["z_up"],
+            output_file=args["output"],
+            profile=args["profile"],
+            compact=args["compact"],
+            compress=True if args["gzip"] else None,
+            tag=args["tag"],
+            replace=args["replace"],
+            plane=args["plane"],
+            rotation=args["rotate"],
+            scale=args["scale"],
+            preview=args["preview"],
+            matcher=args["matcher"],
+        )
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    start = time.perf_counter()
+    try:
+        manifest = animate(job, args["frames"], max_workers=args["workers"])
+    except ImageTooBigError:
+        logger.error("The frames have more pixels than a base allows")
+        return 1
+    except (
+        OSError,
+        IncompatibleImageError,
+        InvalidBaseDataError,
+        InvalidMappingProfileError,
+    ) as e:
+        logger.error(e)
+        return 1
+    for frame in manifest["frames"]:
+        print(
+            f"[ok] {frame['output_file']} ({frame['objects']} objects, "
+            f"+{frame['added']} -{frame['removed']} ~{frame['swapped']})"
+        )
+    print(
+        f"Wrote {len(manifest['frames'])} frames of {manifest['tag']} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return 0
+
+
+def run_preview_command(argv) -> int:
+    args = vars(preview_parser().parse_args(argv))
+    file_exists(args["base_json"])
+    from object_index import generated_tag
+    from placement import Placement
+    from preview import render_base, save_preview
+
+    try:
+        image = render_base(
+            args["base_json"],
+            tag=args["tag"] and generated_tag(args["tag"]),
+            profile=args["profile"],
+            placement=Placement(args["plane"], args["rotate"], args["scale"]),
+        )
+        save_preview(image, args["output"], zoom=args["zoom"])
+    except (
+        OSError,
+        ValueError,
+        InvalidBaseDataError,
+        InvalidMappingProfileError,
+    ) as e:
+        logger.error(e)
+        return 1
+    print(f"Wrote a {image.width}x{image.height} preview to {args['output']}")
+    return 0
+
+
+def run_batch_command(argv) -> int:
+    args = vars(batch_parser().parse_args(argv))
+    from batch import load_batch_manifest, run_batch
+
+    try:
+        jobs = load_batch_manifest(args["manifest"])
+    except (OSError, ValueError, InvalidBatchManifestError) as e:
+        logger.error("Unable to read batch manifest %s: %s", args["manifest"], e)
+        return 1
+
+    failed = 0
+    start = time.perf_counter()
+    for result in run_batch(jobs, max_workers=args["workers"]):
+        job = result.job
+        if result.ok:
+            print(
+                f"[ok] {job.sprite_file} -> {job.output_file} "
+                f"({result.objects} objects, {result.seconds:.2f}s)"
+            )
+        else:
+            failed += 1
+            print(f"[failed] {job.sprite_file} -> {job.output_file}: {result.error}")
+    print(
+        f"{len(jobs) - failed} of {len(jobs)} jobs succeeded "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return 1 if failed else 0
+
+
+def file_exists(file_path):
+    if not Path(file_path).is_file():
+        logger.error("The file specified does not exist: %s", file_path)
+        sys.exit(1)
+
+
+def run_generate_command(argv) -> int:
+    args = vars(generate_parser().parse_args(argv))
+
+    logger.debug("z_up is %s", args["z_up"])
+
+    file_exists(args["base_json"])
+    file_exists(args["sprite_file"])
+    for shard_base_file in args["shard"] or ():
+        file_exists(shard_base_file)
+    for layer_file in args["layers"] or ():
+        file_exists(layer_file)
+    if args["heightmap"]:
+        file_exists(args["heightmap"])
+
+    from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+    from pipeline import GenerationJob, run_job
+    from sharding import generate_shards
+
+    try:
+        job = GenerationJob(
+            base_json=args["base_json"],
+            sprite_file=args["sprite_file"],
+            z_up=args["z_up"],
+            output_file=args["o"],
+            profile=args["profile"],
+            coalesce=args["coalesce"],
+            compact=args["compact"],
+            compress=args["gzip"] or None,
+            cache=not args["no_cache"],
+            tag=args["tag"],
+            replace=args["replace"],
+            on_conflict=args["on_conflict"],
+            plane=args["plane"],
+            rotation=args["rotate"],
+            scale=args["scale"],
+            layers=tuple(args["layers"] or ()),
+            heightmap=args["heightmap"],
+            max_height=args["max_height"],
+            preview=args["preview"],
+            matcher=args["matcher"],
+        )
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    instrumentation = (
+        Instrumentation(track_memory=True) if args["trace"] else NULL_INSTRUMENTATION
+    )
+    try:
+        if args["shard"]:
+            manifest = generate_shards(
+                job, [args["base_json"], *args["shard"]], max_workers=args["workers"]
+            )
+            for shard in manifest["shards"]:
+                print(f"Shard {shard['index']}: {shard['output_file']}")
+        else:
+            result = run_job(job, instrumentation)
+            if args["trace"] == "-":
+                print(instrumentation.summary())
+            elif args["trace"]:
+                instrumentation.write_trace(args["trace"])
+            if result.conflicts:
+                action = {"report": "found", "skip": "skipped", "shift": "moved"}
+                print(
+                    f"{result.conflicts} objects overlapping existing ones "
+                    f"{action[args['on_conflict']]}"
+                )
+            if args["replace"]:
+                print(
+                    f"Replaced {result.removed} objects, kept {result.kept} and added "
+                    f"{result.objects - result.kept}"
+                )
+            if job.voxels:
+                print(
+                    f"Culled {result.tiles - result.objects} hidden voxels of "
+                    f"{result.tiles}"
+                )
+            if args["coalesce"]:
+                print(
+                    f"Coalesced {result.tiles} tiles into {result.objects} objects "
+                    f"({result.tiles - result.objects} saved)"
+                )
+    except ImageTooBigError:
+        logger.error(
+            "The sprite has more pixels than a base allows, use --shard to split it "
+            "across several bases"
+        )
+        return 1
+    except InvalidImageType:
+        logger.error("%s could not be quantized to the palette", args["sprite_file"])
+        return 1
+    except (
+        OSError,
+        IncompatibleImageError,
+        InvalidBaseDataError,
+        InvalidMappingProfileError,
+        PlacementConflictError,
+    ) as e:
+        logger.error(e)
+        return 1
+    finally:
+        # Memory tracing slows down everything else in the process
+        instrumentation.stop()
+
+    print("Success!")
+    return 0
+
+
+COMMANDS = {
+    "generate": run_generate_command,
+    "batch": run_batch_command,
+    "compose": run_compose_command,
+    "animate": run_animate_command,
+    "preview": run_preview_command,
+    "serve": run_serve_command,
+}
+
+
+def main(argv=None) -> int:
+    """Entry point of the nms-gen command. The first argument picks one of COMMANDS;
+    without one, the arguments are those of generate."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return run_generate_command(argv)
@@ -0,0 +1,112 @@
+from typing import Iterator, List, NamedTuple
+
+
+class Rect(NamedTuple):
+    """A width x height block of pixels with the same key, anchored at its top-left x, y."""
+
+    x: int
+    y: int
+    width: int
+    height: int
+    key: int
+
+
+def greedy_rectangles(plane: bytes, keep: bytes, width: int) -> List[Rect]:
+    """Breaks the kept pixels of a row-major plane of keys (e.g. palette indexes) into
+    rectangles of a single key. Scanning in row order, each unclaimed pixel starts a
+    rectangle that is grown right as far as its run goes, then down for as long as the
+    whole run continues in the next row."""
+    remaining = bytearray(keep)
+    height = len(plane) // width
+    result = []
+    for start in range(len(plane)):
+        if not remaining[start]:
+            continue
+        key = plane[start]
+        x, y = start % width, start // width
+
+        run = 1
+        while x + run < width and remaining[start + run] and plane[start + run] == key:
+            run += 1
+        key_run = bytes([key]) * run
+        kept_run = b"\x01" * run
+
+        rows = 1
+        while y + rows < height:
+            row_start = start + rows * width
+            if (
+                plane[row_start : row_start + run] != key_run
+                or remaining[row_start : row_start + run] != kept_run
+            ):
+                break
+            rows += 1
+
+        for row in range(rows):
+            row_start = start + row * width
+            remaining[row_start : row_start + run] = bytes(run)
+        result.append(Rect(x, y, run, rows, key))
+    return result
+
+
+def split_into_squares(rect: Rect) -> Iterator[Rect]:
+    """Splits a rectangle into squares, largest first, since parts only scale uniformly."""
+    x, y, width, height, key = rect
+    while width and height:
+        size = min(width, height)
+        if width >= height:
+            for offset in range(0, width - width % size, size):
+                yield Rect(x + offset, y, size, size, key)
+            x += width - width % size
+            width %= size
+        else:
+            for offset in range(0, height - height % size, size):
+                yield Rect(x, y + offset, size, size, key)
+            y += height - height % size
+            height %= size
+
+
+def greedy_squares(plane: bytes, keep: bytes, width: int) -> List[Rect]:
+    """Covers the kept pixels with same-key squares. Scanning in row order, each unclaimed
+    pixel starts a square that grows down and right while the new row and column it
+    would add are unclaimed and share its key."""
+    remaining = bytearray(keep)
+    height = len(plane) // width
+    result = []
+    for start in range(len(plane)):
+        if not remaining[start]:
+            continue
+        key = plane[start]
+        x, y = start % width, start // width
+
+        size = 1
+        while x + size < width and y + size < height:
+            # The square grows by one row below it and one column to its right
+            row_start = start + size * width
+            column = range(start + size, row_start + size + 1, width)
+            if (
+                plane[row_start : row_start + size + 1] != bytes([key]) * (size + 1)
+                or remaining[row_start : row_start + size + 1] != b"\x01" * (size + 1)
+                or any(plane[i] != key or not remaining[i] for i in column)
+            ):
+                break
+            size += 1
+
+        for row in range(size):
+            row_start = start + row * width
+            remaining[row_start : row_start + size] = bytes(size)
+        result.append(Rect(x, y, size, size, key))
+    return result
+
+
+def coalesce_squares(plane: bytes, keep: bytes, width: int) -> List[Rect]:
+    """Covers the kept pixels with as few same-key squares as the greedy decompositions
+    find; each square can be emitted as a single uniformly scaled part. Both growing
+    squares directly and splitting maximal rectangles are cheap, so the smaller result
+    of the two is used."""
+    squares = greedy_squares(plane, keep, width)
+    from_rectangles = [
+        square
+        for rect in greedy_rectangles(plane, keep, width)
+        for square in split_into_squares(rect)
+    ]
+    return min(squares, from_rectangles, key=len)
@@ -0,0 +1,238 @@
+import dataclasses
+import json
+import logging
+import math
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import List, NamedTuple
+
+from constants import DEFAULT_SPACING, MAX_BASE_OBJS
+from model import NMSObject, ObjectTable
+from object_index import ObjectIndex, plan_replacement
+from pipeline import (
+    GenerationJob,
+    SpriteImage,
+    generate_objects,
+    job_tag,
+    load_base,
+    warm_caches,
+)
+from mapping import load_mapping_profile
+from placement import placement_frame
+from preview import rasterize, save_preview
+from serialization import open_output, write_base_document
+from sharding import manifest_path
+
+logger = logging.getLogger(__name__)
+
+
+class SpriteSlot(NamedTuple):
+    """Where one sprite of a composition goes: the (left, upper) tile of its box in the
+    layout, and its size. opaque is the number of pixels the sprite can place at most,
+    index the sprite's position in the list it was planned from."""
+
+    sprite_file: str
+    width: int
+    height: int
+    opaque: int
+    left: int
+    upper: int
+    index: int
+
+
+def count_opaque(sprite_file) -> tuple:
+    """Returns the sprite's size and how many of its pixels are not transparent. Only the
+    alpha plane is looked at, the sprite is not quantized or mapped."""
+    sprite = SpriteImage.open(sprite_file, check_size=False)
+    width, height = sprite.size
+    mask = sprite.transparency_mask()
+    opaque = width * height if mask is None else mask.count(0)
+    return width, height, opaque
+
+
+def pack_boxes(sizes: List[tuple], spacing=DEFAULT_SPACING) -> tuple:
+    """Shelf-packs (width, height) boxes, tallest first, into rows about as wide as the
+    square root of their total area, keeping spacing empty tiles between boxes. Returns
+    the (left, upper) corner of each box in input order and the size of the layout."""
+    if not sizes:
+        return [], (0, 0)
+    area = sum((width + spacing) * (height + spacing) for width, height in sizes)
+    max_width = max(math.isqrt(area), max(width for width, _ in sizes))
+
+    corners = [None] * len(sizes)
+    left = upper = shelf_height = layout_width = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        width, height = sizes[i]
+        if left and left + width > max_width:
+            upper += shelf_height + spacing
+            left = shelf_height = 0
+        corners[i] = (left, upper)
+        layout_width = max(layout_width, left + width)
+        shelf_height = max(shelf_height, height)
+        left += width + spacing
+    return corners, (layout_width, upper + shelf_height)
+
+
+def plan_composition(
+    sprite_files: List[str], budget: int, spacing=DEFAULT_SPACING
+) -> tuple:
+    """Picks sprites in the order given while their opaque pixels fit in the object
+    budget, and lays them out centred on the anchor. Returns the slots of the picked
+    sprites and the files of the sprites left out."""
+    picked, skipped = [], []
+    for index, sprite_file in enumerate(sprite_files):
+        width, height, opaque = count_opaque(sprite_file)
+        if opaque > budget:
+            skipped.append(str(sprite_file))
+            continue
+        budget -= opaque
+        picked.append((str(sprite_file), width, height, opaque, index))
+
+    corners, (layout_width, layout_height) = pack_boxes(
+        [(width, height) for _, width, height, _, _ in picked], spacing
+    )
+    slots = [
+        SpriteSlot(
+            sprite_file,
+            width,
+            height,
+            opaque,
+            left - layout_width // 2,
+            upper - layout_height // 2,
+            index,
+        )
+        for (sprite_file, width, height, opaque, index), (left, upper) in zip(
+            picked, corners
+        )
+    ]
+    return slots, skipped
+
+
+def slot_offset(slot: SpriteSlot, anchor: NMSObject, job: GenerationJob) -> list:
+    """The x, y, z shift that moves a sprite generated at the anchor into its slot."""
+    frame = placement_frame(anchor, job.placement, height=slot.height)
+    # The frame counts rows from first_row, so the sprite's top row lands on slot.upper
+    row = slot.upper + frame.first_row
+    return [
+        slot.left * column + row * down
+        for column, down in zip(frame.column_axis, frame.row_axis)
+    ]
+
+
+def _generate_slot(job: GenerationJob, base_computer: dict, offset: list) -> tuple:
+    """Worker side of compose: generates one sprite and shifts it into its slot."""
+    objects, tiles, _ = generate_objects(
+        job, base_computer, load_mapping_profile(job.profile)
+    )
+    objects.translate(offset)
+    return objects, tiles
+
+
+def compose(
+    job: GenerationJob,
+    sprite_files: List[str],
+    spacing=DEFAULT_SPACING,
+    budget: int | None = None,
+    max_workers=None,
+) -> dict:
+    """Injects many sprites into one base. The sprites are bin-packed around the base
+    computer, generated in parallel in a process pool, each tagged with its own name,
+    and all written out in a single pass over the base. job holds the settings shared by
+    every sprite; its sprite_file and tag are ignored. The budget (the room left in the
+    base by default) is checked against opaque pixels, an upper bound on the objects a
+    sprite places. A sprite listed more than once gets a slot each, all under its tag.
+    With job.preview, the whole composition is rendered into one PNG. Writes a manifest
+    describing the layout and returns it."""
+    if job.voxels:
+        raise ValueError("Voxel mode can not be composed")
+    if job.on_conflict != "ignore":
+        # Shifting a sprite out of the way could move it into its neighbour's slot
+        raise ValueError("Compositions can not resolve conflicts")
+    base_document = load_base(job.base_json, job.cache)
+    sprite_jobs = [
+        dataclasses.replace(job, sprite_file=str(sprite_file), tag=None, budgeted=True)
+        for sprite_file in sprite_files
+    ]
+    index = ObjectIndex.from_document(base_document) if job.replace else None
+    if budget is None:
+        budget = MAX_BASE_OBJS - base_document.object_count
+        if index is not None:
+            # Objects about to be replaced make room for their new generation
+            tags = {job_tag(sprite_job) for sprite_job in sprite_jobs}
+            budget += sum(len(index.with_tag(tag)) for tag in tags)
+    slots, skipped = plan_composition(sprite_files, budget, spacing)
+    for sprite_file in skipped:
+        logger.warning("Skipping %s, it does not fit in the object budget", sprite_file)
+
+    anchor = NMSObject(base_document.base_computer)
+    slot_jobs = [sprite_jobs[slot.index] for slot in slots]
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=warm_caches, initargs=([job.profile],)
+    ) as executor:
+        futures = [
+            executor.submit(
+                _generate_slot,
+                slot_job,
+                base_computer=base_document.base_computer,
+                offset=slot_offset(slot, anchor, job),
+            )
+            for slot, slot_job in zip(slots, slot_jobs)
+        ]
+        results = [future.result() for future in futures]
+
+    # Slots that share a sprite share its tag, so they replace its objects together
+    by_tag = {}
+    for slot_job, (objects, _) in zip(slot_jobs, results):
+        by_tag.setdefault(job_tag(slot_job), ObjectTable()).extend(objects)
+    added, removed = [], array("q")
+    for tag, objects in by_tag.items():
+        if index is not None:
+            plan = plan_replacement(index, tag, objects)
+            objects = plan.added
+            removed.extend(plan.removed)
+        added.append(objects)
+
+    with open_output(job.output_file, compress=job.compress) as outfile:
+        write_base_document(
+            outfile,
+            base_document,
+            chain.from_iterable(objects.iter_dicts() for objects in added),
+            indent=None if job.compact else 4,
+            removed=removed,
+        )
+    if job.preview and by_tag:
+        composed = ObjectTable()
+        for objects in by_tag.values():
+            composed.extend(objects)
+        image = rasterize(
+            composed, anchor, load_mapping_profile(job.profile), job.placement
+        )
+        save_preview(image, job.preview)
+
+    manifest = {
+        "base_json": str(job.base_json),
+        "output_file": str(job.output_file),
+        "z_up": job.z_up,
+        "sprites": [
+            {
+                "sprite_file": slot.sprite_file,
+                "tag": job_tag(slot_job),
+                "box": [
+                    slot.left,
+                    slot.upper,
+                    slot.left + slot.width,
+                    slot.upper + slot.height,
+                ],
+                "tiles": tiles,
+                "objects": len(objects),
+            }
+            for slot, slot_job, (objects, tiles) in zip(slots, slot_jobs, results)
+        ],
+        "skipped": skipped,
+        "removed": len(removed),
+    }
+    with open(manifest_path(job.output_file), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    logger.debug("Composed %s sprites into %s", len(slots), job.output_file)
+    return manifest
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 # As of today the object build limit for bases is 3k
 MAX_BASE_OBJS = 3000
 
@@ -15,3 +17,20 @@ METAL_FLOOR = "^F_FLOOR"
 
 # DEFAULT_OBJECT is the "standard" or "background" used when mapping
 DEFAULT_OBJECT_ID = STONE_FLOOR_TILE
+
+# Defaults and choices of the command line options. They live here so the command line
+# can offer them without importing the modules that use them (see cli).
+
+# Mapping profile used when none is specified, equivalent to mapping.color_index_map.
+# Relative to the installed modules, not the working directory, like palette's data.
+DEFAULT_PROFILE_PATH = str(Path(__file__).parents[1] / "profiles" / "nes_default.toml")
+# How sprite colors are matched to parts: "rgb" snaps them to the nearest palette color,
+# "lab" to the nearest color that maps to a part, by CIELAB distance
+MATCHERS = ("rgb", "lab")
+PLANES = ("floor", "wall")
+CONFLICT_MODES = ("ignore", "report", "skip", "shift")
+# Empty tiles kept between neighbouring sprites of a composition
+DEFAULT_SPACING = 2
+DEFAULT_MAX_HEIGHT = 8
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
@@ -0,0 +1,95 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+
+class Instrumentation(object):
+    """Collects wall time (and optionally peak traced memory) per pipeline stage, plus
+    named counters, for a single run."""
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        # {stage: {"seconds": float, "peak_bytes": int}} in the order stages first ran
+        self.stages: dict = {}
+        self.counters: dict = {}
+        self._started_tracemalloc = False
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Times the body of the with block as stage name. Repeated stages accumulate."""
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "peak_bytes": 0})
+            stage["seconds"] += elapsed
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stage["peak_bytes"] = max(stage["peak_bytes"], peak)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stop(self):
+        """Stops memory tracing if this instance started it."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(stage["seconds"] for stage in self.stages.values())
+
+    def as_dict(self) -> dict:
+        trace = {
+            "stages": self.stages,
+            "counters": self.counters,
+            "total_seconds": self.total_seconds,
+        }
+        pixels = self.counters.get("pixels")
+        if pixels and self.total_seconds:
+            trace["pixels_per_second"] = pixels / self.total_seconds
+        return trace
+
+    def write_trace(self, trace_file):
+        with open(trace_file, "w") as outfile:
+            json.dump(self.as_dict(), outfile, indent=4)
+
+    def summary(self) -> str:
+        lines = [f"{'stage':<12}{'time (ms)':>12}{'peak memory (KiB)':>20}"]
+        for name, stage in self.stages.items():
+            peak = f"{stage['peak_bytes'] / 1024:.1f}" if self.track_memory else "-"
+            lines.append(f"{name:<12}{stage['seconds'] * 1000:>12.2f}{peak:>20}")
+        lines.append(f"{'total':<12}{self.total_seconds * 1000:>12.2f}")
+        trace = self.as_dict()
+        for name, value in self.counters.items():
+            lines.append(f"{name}: {value}")
+        if "pixels_per_second" in trace:
+            lines.append(f"pixels/s: {trace['pixels_per_second']:,.0f}")
+        return "\n".join(lines)
+
+
+class _NullInstrumentation(object):
+    """Drop-in for Instrumentation that records nothing, used when profiling is off so the
+    pipeline's stage/count calls cost next to nothing."""
+
+    _null_context = contextlib.nullcontext()
+
+    def stage(self, name: str):
+        return self._null_context
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def stop(self):
+        pass
+
+
+NULL_INSTRUMENTATION = _NullInstrumentation()
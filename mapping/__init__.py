@@ -1,12 +1,24 @@
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import struct
+import threading
+import tomllib
+from array import array
+from itertools import chain, compress
+from pathlib import Path
 from typing import List
 
 from PIL import Image
-from validation import InvalidImageType
+from validation import InvalidImageType, InvalidMappingProfileError
 import logging
 
 logger = logging.getLogger(__name__)
 
 from constants import (
+    DEFAULT_PROFILE_PATH,
     STONE_FLOOR_TILE,
     WOOD_FLOOR_TILE,
     PAVING,
@@ -16,7 +28,22 @@ from constants import (
     WOOD_ROOF,
     METAL_FLOOR,
 )
-from model import NMSObject, create_from_reference_object
+from coalescing import coalesce_squares
+from model import NMSObject, ObjectTable
+from palette import cache_dir
+from placement import (
+    DEFAULT_PLACEMENT,
+    Frame,
+    Placement,
+    lift,
+    place_grid,
+    place_points,
+    placement_frame,
+)
+
+# One entry per pixel, truthy when the pixel should be skipped. build_transparency_mask produces
+# the compact bytes form; plain lists of bools are still accepted.
+TransparencyMask = bytes | bytearray | list[bool]
 
 # For now, use hard-coded RGB color values. Need to find a better way to map colors to objects
 MARIO_BLUE_BACKGROUND = (146, 144, 255, 255)
@@ -77,6 +104,7 @@ BLACK_TILE = ("^F_FLOOR", 0)
 
 # New color map for 64 color palette mapping
 # Maps color indexes to tuples with NMS Object IDs and userdata values
+# The mapper uses profiles/nes_default.toml, which holds the same mapping (see load_mapping_profile)
 color_index_map = {
     # === Row 0
     # (124, 124, 124) - Darker Gray
@@ -164,71 +192,357 @@ color_index_map = {
 }
 
 
-def build_transparency_mask(original_image: Image) -> list[bool] | None:
+def alpha_threshold_table(alpha_threshold: int = 0) -> bytes:
+    """Translation table that turns alpha values into 1 (transparent, alpha <= alpha_threshold)
+    or 0 (opaque enough to be converted)."""
+    if not 0 <= alpha_threshold <= 255:
+        raise ValueError("alpha_threshold must be between 0 and 255")
+    return bytes(int(alpha <= alpha_threshold) for alpha in range(256))
+
+
+def build_transparency_mask(original_image: Image, alpha_threshold: int = 0) -> bytes:
     """
-    Builds a list of bools for each pixel in the original image. True means the pixel is 100% transparent. False means the pixel is 0% transparent.
+    Builds a compact bitmap with one byte per pixel of the original image. A value of 1 means
+    the pixel is treated as transparent (alpha <= alpha_threshold), 0 means it is opaque enough
+    to be converted. The default threshold only masks pixels that are 100% transparent.
+
+    The alpha channel is extracted and thresholded in bulk, so this never touches individual
+    pixels from Python.
     """
     if original_image.mode != "RGBA":
         raise ValueError("Image must be RGBA")
 
-    result = []
-    width, height = original_image.size
-    image_data = original_image.getdata()
-    for i in range(len(image_data)):
-        y = i // width
-        x = i % width
-        # Assuming this is RGBA
-        alpha = original_image.getpixel((x, y))[3]
-        if alpha == 0:
-            result.append(True)
-        else:
-            result.append(False)
-    return result
+    threshold_table = alpha_threshold_table(alpha_threshold)
+    return original_image.getchannel("A").tobytes().translate(threshold_table)
 
 
-def sprite_data_to_objects(
+# Marks palette indexes without an object in MappingTables.object_id_lut
+NO_OBJECT = 255
+
+# Compiled profiles are stored next to the palette lookup tables as a header (magic,
+# format version, length of the object IDs) followed by the object ID and userdata
+# lookup tables and the object IDs as JSON
+PROFILE_MAGIC = b"NMSMAP"
+PROFILE_VERSION = 1
+PROFILE_HEADER = struct.Struct("<6sHI")
+
+
+@dataclasses.dataclass(frozen=True)
+class MappingTables(object):
+    """Lookup tables compiled from a color index map, indexed by palette index (0-255).
+
+    object_id_lut holds an index into object_ids (or NO_OBJECT) and userdata_lut holds the
+    userdata value for every palette index, so mapping a pixel is a pair of array reads."""
+
+    object_ids: tuple
+    object_id_lut: bytes
+    userdata_lut: array
+
+    @functools.cached_property
+    def part_lut(self) -> bytes:
+        """Translation table that turns palette indexes into the lowest palette index that
+        maps to the same part (object ID and userdata), so equal parts compare equal."""
+        parts = {}
+        return bytes(
+            parts.setdefault((object_id, userdata), color_index)
+            for color_index, (object_id, userdata) in enumerate(
+                zip(self.object_id_lut, self.userdata_lut)
+            )
+        )
+
+    @functools.cached_property
+    def present_lut(self) -> bytes:
+        """Translation table that turns palette indexes into 1 (has object) or 0 (skip)."""
+        return bytes(int(object_id != NO_OBJECT) for object_id in self.object_id_lut)
+
+    @functools.cached_property
+    def match_targets(self) -> bytes:
+        """For palette.load_perceptual_lut: the part (see part_lut) of every palette index
+        that has an object, and NO_OBJECT for the others, so pixels only ever match
+        colors that produce a part."""
+        return bytes(
+            part if present else NO_OBJECT
+            for part, present in zip(self.part_lut, self.present_lut)
+        )
+
+
+def compile_color_index_map(index_map: dict) -> MappingTables:
+    """Compiles a {palette index: (object_id, userdata)} map into MappingTables. Entries
+    that are None or have an empty object ID produce no object."""
+    object_ids = []
+    object_id_lut = bytearray([NO_OBJECT]) * 256
+    userdata_lut = array("q", [0]) * 256
+    for color_index, entry in index_map.items():
+        if not 0 <= color_index <= 255:
+            raise ValueError(f"Palette index out of range: {color_index}")
+        if entry is None or not entry[0]:
+            continue
+        object_id, userdata = entry
+        if object_id not in object_ids:
+            if len(object_ids) == NO_OBJECT:
+                raise ValueError(f"More than {NO_OBJECT} distinct object IDs")
+            object_ids.append(object_id)
+        object_id_lut[color_index] = object_ids.index(object_id)
+        userdata_lut[color_index] = userdata
+    return MappingTables(tuple(object_ids), bytes(object_id_lut), userdata_lut)
+
+
+def _parse_profile_entry(color_index: str, entry) -> tuple:
+    """Validates one [colors] entry of a mapping profile and returns its palette index and
+    (object_id, userdata) pair."""
+    try:
+        index = int(color_index)
+    except ValueError:
+        raise InvalidMappingProfileError(
+            f"Palette index is not a number: {color_index}"
+        )
+    if not 0 <= index <= 255:
+        raise InvalidMappingProfileError(f"Palette index out of range: {index}")
+    if not isinstance(entry, dict):
+        raise InvalidMappingProfileError(f"Entry {index} must be a table")
+
+    object_id = entry.get("object_id")
+    userdata = entry.get("userdata", 0)
+    if not isinstance(object_id, str) or not object_id.startswith("^"):
+        raise InvalidMappingProfileError(f"Entry {index} has an invalid object_id")
+    if type(userdata) is not int or not 0 <= userdata < 2**63:
+        raise InvalidMappingProfileError(f"Entry {index} has an invalid userdata value")
+    return index, (object_id, userdata)
+
+
+def _read_compiled_profile(compiled_path: Path) -> MappingTables | None:
+    try:
+        data = compiled_path.read_bytes()
+        magic, version, ids_length = PROFILE_HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    lut_end = PROFILE_HEADER.size + 256 * 9
+    if (
+        magic != PROFILE_MAGIC
+        or version != PROFILE_VERSION
+        or len(data) != lut_end + ids_length
+    ):
+        return None
+    object_id_lut = data[PROFILE_HEADER.size : PROFILE_HEADER.size + 256]
+    userdata_lut = array("q")
+    userdata_lut.frombytes(data[PROFILE_HEADER.size + 256 : lut_end])
+    try:
+        object_ids = tuple(json.loads(data[lut_end:]))
+    except ValueError:
+        return None
+    return MappingTables(object_ids, object_id_lut, userdata_lut)
+
+
+def _write_compiled_profile(compiled_path: Path, tables: MappingTables):
+    object_ids = json.dumps(tables.object_ids).encode()
+    header = PROFILE_HEADER.pack(PROFILE_MAGIC, PROFILE_VERSION, len(object_ids))
+    compiled_path.parent.mkdir(parents=True, exist_ok=True)
+    # Written to a temporary file first, like the palette lookup tables
+    temp_name = f"{compiled_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    temp_path = compiled_path.with_name(temp_name)
+    temp_path.write_bytes(
+        header + tables.object_id_lut + tables.userdata_lut.tobytes() + object_ids
+    )
+    os.replace(temp_path, compiled_path)
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_profile(profile_path: str, mtime_ns: int, size: int) -> MappingTables:
+    # mtime_ns and size are only part of the cache key, so edited files get recompiled.
+    # Parsing the TOML dominates, so the compiled tables are also kept on disk, keyed by
+    # the profile's contents.
+    with open(profile_path, "rb") as profile_file:
+        data = profile_file.read()
+    is_json = profile_path.endswith(".json")
+    profile_hash = hashlib.sha256(b"json" if is_json else b"toml")
+    profile_hash.update(data)
+    compiled_path = (
+        cache_dir() / f"profile-v{PROFILE_VERSION}-{profile_hash.hexdigest()[:16]}.map"
+    )
+    tables = _read_compiled_profile(compiled_path)
+    if tables is not None:
+        return tables
+
+    profile = json.loads(data) if is_json else tomllib.loads(data.decode())
+    colors = profile.get("colors") if isinstance(profile, dict) else None
+    if not isinstance(colors, dict) or not colors:
+        raise InvalidMappingProfileError(f"No [colors] found in {profile_path}")
+    index_map = dict(
+        _parse_profile_entry(color_index, entry)
+        for color_index, entry in colors.items()
+    )
+    try:
+        tables = compile_color_index_map(index_map)
+    except ValueError as e:
+        raise InvalidMappingProfileError(str(e))
+    try:
+        _write_compiled_profile(compiled_path, tables)
+    except OSError as e:
+        logger.debug("Could not store the compiled profile %s: %s", compiled_path, e)
+    return tables
+
+
+def load_mapping_profile(profile_path=DEFAULT_PROFILE_PATH) -> MappingTables:
+    """Loads a mapping profile (TOML, or JSON with the same layout) and compiles it into
+    MappingTables. A profile maps palette indexes to object IDs and userdata values:
+
+        [colors]
+        0 = { object_id = "^BUILDPAVING_BIG", userdata = 15 }
+
+    Compiled profiles are cached in memory, so switching between profiles costs nothing
+    after the first use, and on disk (see palette.cache_dir), so new processes do not
+    parse the profile again."""
+    path = Path(profile_path).resolve()
+    stat = path.stat()
+    return _compile_profile(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def default_mapping_tables() -> MappingTables:
+    """MappingTables for the default profile (see DEFAULT_PROFILE_PATH)."""
+    return load_mapping_profile()
+
+
+def _keep_unmasked(present: bytes, transparency_mask: TransparencyMask) -> bytes:
+    """Clears every byte of present whose transparency mask entry is set. Both inputs hold
+    only 0/1 bytes, so this is a single big-integer AND NOT instead of a per-pixel loop."""
+    mask = bytes(map(bool, transparency_mask))
+    if len(mask) != len(present):
+        raise ValueError("Transparency mask does not match the image size")
+    keep = int.from_bytes(present) & ~int.from_bytes(mask)
+    return keep.to_bytes(len(present))
+
+
+def _kept_pixels(
+    image: Image,
+    transparency_mask: TransparencyMask | None,
+    tables: MappingTables,
+) -> tuple:
+    """Returns the palette index plane of the image and a 0/1 plane of the pixels that
+    produce an object (mapped and not masked)."""
+    # Confirm the image is RBG, 64-color, indexed. Image data per-pixel should be a 0-255 integer value
+    if image.mode != "P":
+        raise InvalidImageType
+
+    pixels = image.tobytes()
+    keep = pixels.translate(tables.present_lut)
+    if transparency_mask:
+        keep = _keep_unmasked(keep, transparency_mask)
+    return pixels, keep
+
+
+def tile_plane(
+    image: Image,
+    transparency_mask: TransparencyMask | None = None,
+    tables: MappingTables | None = None,
+) -> bytes:
+    """One byte per pixel: 1 where sprite_data_to_table places a tile, 0 elsewhere."""
+    _, keep = _kept_pixels(image, transparency_mask, tables or default_mapping_tables())
+    return keep
+
+
+def count_tiles(
+    image: Image,
+    transparency_mask: TransparencyMask | None = None,
+    tables: MappingTables | None = None,
+) -> int:
+    """Number of objects sprite_data_to_table produces for the image without coalescing."""
+    return tile_plane(image, transparency_mask, tables).count(1)
+
+
+def sprite_data_to_table(
     image: Image,
     anchor_object: NMSObject,
     z_up=0.0,
     tile_spacing=5,
-    transparency_mask: list[bool] | None = None,
-) -> List[NMSObject]:
-    """Iterates through the sprite data and build a list of NMSObjects that will
-    represent each pixel of the sprite. Be sure to run validation before invoking this function."""
+    transparency_mask: TransparencyMask | None = None,
+    tables: MappingTables | None = None,
+    coalesce=False,
+    placement: Placement = DEFAULT_PLACEMENT,
+) -> ObjectTable:
+    """Maps the whole sprite at once into an ObjectTable with one row per tile. Tile
+    coordinates, object IDs and userdata are gathered column by column through the
+    palette-indexed lookup tables. Be sure to run validation before invoking this function.
 
-    # Confirm the image is RBG, 64-color, indexed. Image data per-pixel should be a 0-255 integer value
-    if image.mode != "P" or type(image.getdata()[0]) == tuple:
-        raise InvalidImageType
+    Tiles are laid out in the anchor object's frame (see placement), raised z_up along
+    its Up vector. With coalesce, same-part areas are covered by squares (see coalescing)
+    and each square becomes a single part scaled up to cover it."""
+    if tables is None:
+        tables = default_mapping_tables()
+    pixels, keep = _kept_pixels(image, transparency_mask, tables)
+    width, height = image.size
+    frame = placement_frame(anchor_object, placement, tile_spacing, height)
+    offset = lift(anchor_object, z_up)
+    if coalesce:
+        return _coalesced_table(
+            pixels, keep, width, anchor_object, frame, offset, tables
+        )
 
-    result = []
+    kept_pixels = bytes(compress(pixels, keep))
+    table = ObjectTable.from_tiles(
+        anchor_object,
+        tables.object_ids,
+        # iter() so array() widens each byte instead of reading the raw buffer
+        array("H", iter(kept_pixels.translate(tables.object_id_lut))),
+        place_grid(frame, width, height, keep, offset),
+        array("q", map(tables.userdata_lut.__getitem__, kept_pixels)),
+    )
+    table.up = array("d", frame.part_up) * len(table)
+    table.at = array("d", frame.part_at) * len(table)
+    return table
 
-    pixels = list(image.getdata())
-    width, height = image.size
 
-    # break data into rows
-    offset = 0
-    for i in range(len(pixels)):
-        if transparency_mask and transparency_mask[i]:
-            # skip pixels that have a transparency mask bit set
-            print(f"skipping pixel {i}")
-            offset += 1
-            continue
-        # set x and y appropriately
-        y = offset // width
-        x = offset % width
-        pixel_color_index = pixels[i]
-        object_id = color_index_map[pixel_color_index][0]
-        object_userdata = color_index_map[pixel_color_index][1]
-        logger.debug(f"offset: {offset} ({x},{y})")
-        tile_x = anchor_object.position[0] + x * tile_spacing
-        tile_y = anchor_object.position[1] + y * tile_spacing
-        # z is constant, flat
-        tile_z = anchor_object.position[2] + z_up
-        logger.debug(f"Tile coord: ({tile_x}, {tile_y}, {tile_z})")
-        if object_id:
-            this_obj = create_from_reference_object(
-                anchor_object, [tile_x, tile_z, tile_y], object_id, object_userdata
-            )
-            result.append(this_obj)
-        offset += 1
-    return result
+def _coalesced_table(
+    pixels: bytes,
+    keep: bytes,
+    width: int,
+    anchor_object: NMSObject,
+    frame: Frame,
+    offset: List[float],
+    tables: MappingTables,
+) -> ObjectTable:
+    """Builds one row per coalesced square. A square of size k sits at the center of the
+    k x k tiles it replaces and has its Up and At vectors scaled by k, which scales the
+    part uniformly in-game."""
+    squares = coalesce_squares(pixels.translate(tables.part_lut), keep, width)
+    centers = [(square.width - 1) / 2 for square in squares]
+    positions = place_points(
+        frame,
+        [square.x + center for square, center in zip(squares, centers)],
+        [square.y + center for square, center in zip(squares, centers)],
+        offset,
+    )
+    keys = bytes(square.key for square in squares)
+    table = ObjectTable.from_tiles(
+        anchor_object,
+        tables.object_ids,
+        array("H", iter(keys.translate(tables.object_id_lut))),
+        positions,
+        array("q", map(tables.userdata_lut.__getitem__, keys)),
+    )
+    up, at = frame.part_up, frame.part_at
+    sizes = [square.width for square in squares]
+    table.up = array("d", chain.from_iterable([v * k for v in up] for k in sizes))
+    table.at = array("d", chain.from_iterable([v * k for v in at] for k in sizes))
+    return table
+
+
+def sprite_data_to_objects(
+    image: Image,
+    anchor_object: NMSObject,
+    z_up=0.0,
+    tile_spacing=5,
+    transparency_mask: TransparencyMask | None = None,
+) -> List[NMSObject]:
+    """Iterates through the sprite data and build a list of NMSObjects that will
+    represent each pixel of the sprite. Be sure to run validation before invoking this function.
+
+    This is a compatibility view over sprite_data_to_table, which should be preferred."""
+    return list(
+        sprite_data_to_table(
+            image,
+            anchor_object,
+            z_up=z_up,
+            tile_spacing=tile_spacing,
+            transparency_mask=transparency_mask,
+        )
+    )
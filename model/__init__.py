@@ -1,7 +1,9 @@
 # TODO: Consider having a SaveDataObject instead of just assuming dict type everywhere
 import copy
 import dataclasses
-from typing import List
+from array import array
+from itertools import chain, compress
+from typing import Iterable, Iterator, List
 
 
 @dataclasses.dataclass
@@ -18,6 +20,7 @@ class NMSObject(object):
     message: str = dataclasses.field(default_factory=str)
 
     def __init__(self, obj_from_json_data: dict):
+        self.object_id = obj_from_json_data.get("ObjectID", "")
         self.up = obj_from_json_data.get("Up", [])
         self.timestamp = obj_from_json_data.get("Timestamp", "")
         self.at = obj_from_json_data.get("At", [])
@@ -61,3 +64,352 @@ def create_from_reference_object(
         reference_object.position[2] + offsets[2],
     ]
     return this_obj
+
+
+# Keys of a save editor object that ObjectTable stores in columns. Anything else is kept
+# per row in ObjectTable.extras so that loading and writing a base never drops data.
+OBJECT_KEYS = ("ObjectID", "Position", "Up", "At", "Timestamp", "UserData", "Message")
+_OBJECT_KEY_SET = frozenset(OBJECT_KEYS)
+
+
+class ObjectTable(object):
+    """Columnar (struct-of-arrays) storage for NMS objects.
+
+    Each attribute of an object lives in its own flat array instead of a per-object
+    NMSObject or dict. Object IDs and messages are interned into small string pools and
+    stored as indices. Positions, Up and At vectors are stored as three consecutive
+    floats per object. A row costs about 92 bytes, compared to well over a kilobyte for
+    the equivalent JSON dict with its lists."""
+
+    def __init__(self):
+        self.object_ids: List[str] = []
+        self.object_id_index = array("H")
+        self.positions = array("d")
+        self.up = array("d")
+        self.at = array("d")
+        self.timestamps = array("q")
+        self.userdata = array("q")
+        self.messages: List[str] = []
+        self.message_index = array("H")
+        # Sparse {row: {key: value}} for keys outside of OBJECT_KEYS
+        self.extras: dict = {}
+        # Sparse {row: [key, ...]} for OBJECT_KEYS a row was loaded without. Their
+        # columns hold placeholders (zeros, "" or 0) and the keys are left out again
+        # when the row is converted back
+        self.missing: dict = {}
+
+    @classmethod
+    def from_tiles(
+        cls,
+        reference_object: NMSObject,
+        object_ids: List[str],
+        object_id_index: array,
+        positions: array,
+        userdata: array,
+    ) -> "ObjectTable":
+        """Builds a table of objects that share the orientation, timestamp and message
+        of the reference object. object_id_index indexes into object_ids and positions
+        holds x, y, z for every object."""
+        count = len(object_id_index)
+        if len(positions) != 3 * count or len(userdata) != count:
+            raise ValueError("Column lengths do not match")
+
+        table = cls()
+        table.object_ids = list(object_ids)
+        table.object_id_index = array("H", object_id_index)
+        table.positions = array("d", positions)
+        table.up = array("d", _vector(reference_object.up)) * count
+        table.at = array("d", _vector(reference_object.at)) * count
+        table.timestamps = array("q", [_timestamp(reference_object.timestamp)]) * count
+        table.userdata = array("q", userdata)
+        table.messages = [reference_object.message]
+        table.message_index = array("H", [0]) * count
+        table.check_columns()
+        return table
+
+    @classmethod
+    def from_dicts(cls, objects: Iterable[dict]) -> "ObjectTable":
+        """Builds a table from the save editor's JSON Objects list."""
+        table = cls()
+        table.extend_dicts(objects)
+        return table
+
+    def extend_dicts(self, objects: Iterable[dict]):
+        """Appends objects in the save editor's JSON format. Values are collected column
+        by column and converted to arrays in bulk. Raises ValueError for a Timestamp or
+        UserData that is not an integer, which the columns could not hold as is."""
+        object_ids = {value: i for i, value in enumerate(self.object_ids)}
+        messages = {value: i for i, value in enumerate(self.messages)}
+        object_id_index = []
+        message_index = []
+        positions = []
+        up = []
+        at = []
+        timestamps = []
+        userdata = []
+        row = len(self)
+        for obj in objects:
+            object_id_index.append(
+                object_ids.setdefault(obj.get("ObjectID", ""), len(object_ids))
+            )
+            message_index.append(
+                messages.setdefault(obj.get("Message", ""), len(messages))
+            )
+            positions.extend(_vector(obj.get("Position")))
+            up.extend(_vector(obj.get("Up")))
+            at.extend(_vector(obj.get("At")))
+            timestamps.append(_integer(obj, "Timestamp"))
+            userdata.append(_integer(obj, "UserData"))
+            if len(obj) > len(OBJECT_KEYS) or not all(
+                key in obj for key in OBJECT_KEYS
+            ):
+                extras = {k: v for k, v in obj.items() if k not in OBJECT_KEYS}
+                if extras:
+                    self.extras[row] = extras
+                missing = [key for key in OBJECT_KEYS if key not in obj]
+                if missing:
+                    self.missing[row] = missing
+            row += 1
+
+        self.object_ids = list(object_ids)
+        self.messages = list(messages)
+        self.object_id_index.extend(object_id_index)
+        self.message_index.extend(message_index)
+        self.positions.extend(positions)
+        self.up.extend(up)
+        self.at.extend(at)
+        self.timestamps.extend(timestamps)
+        self.userdata.extend(userdata)
+
+    def append(self, obj: dict):
+        """Appends a single object in the save editor's JSON format."""
+        self.extend_dicts((obj,))
+
+    def extend(self, other: "ObjectTable"):
+        """Appends every row of another table, merging its string pools into this one."""
+        offset = len(self)
+        self.object_id_index.extend(
+            _remap(self.object_ids, other.object_ids, other.object_id_index)
+        )
+        self.message_index.extend(
+            _remap(self.messages, other.messages, other.message_index)
+        )
+        self.positions.extend(other.positions)
+        self.up.extend(other.up)
+        self.at.extend(other.at)
+        self.timestamps.extend(other.timestamps)
+        self.userdata.extend(other.userdata)
+        for row, extras in other.extras.items():
+            self.extras[offset + row] = extras
+        for row, missing in other.missing.items():
+            self.missing[offset + row] = missing
+
+    def filter(self, keep: Iterable) -> "ObjectTable":
+        """Returns a new table with the rows whose entry in keep is truthy. keep holds one
+        entry per row, e.g. a bytes mask or a list of bools."""
+        keep = bytes(map(bool, keep))
+        if len(keep) != len(self):
+            raise ValueError("Filter mask does not match the table size")
+        keep_vectors = bytes(chain.from_iterable(zip(keep, keep, keep)))
+
+        table = ObjectTable()
+        table.object_ids = list(self.object_ids)
+        table.messages = list(self.messages)
+        table.object_id_index = array("H", compress(self.object_id_index, keep))
+        table.message_index = array("H", compress(self.message_index, keep))
+        table.positions = array("d", compress(self.positions, keep_vectors))
+        table.up = array("d", compress(self.up, keep_vectors))
+        table.at = array("d", compress(self.at, keep_vectors))
+        table.timestamps = array("q", compress(self.timestamps, keep))
+        table.userdata = array("q", compress(self.userdata, keep))
+        if self.extras or self.missing:
+            rows = list(compress(range(len(self)), keep))
+            table.extras = _select_rows(self.extras, rows)
+            table.missing = _select_rows(self.missing, rows)
+        return table
+
+    def translate(self, offset: List[float]):
+        """Shifts every position by the x, y, z offset in place."""
+        for axis, delta in enumerate(offset):
+            if delta:
+                column = self.positions[axis::3]
+                self.positions[axis::3] = array("d", [v + delta for v in column])
+
+    def set_message(self, message: str):
+        """Gives every row the same Message, e.g. the tag of the sprite it was made from."""
+        self.messages = [message]
+        self.message_index = array("H", [0]) * len(self)
+
+    def object_id_mask(self, *object_ids: str) -> bytes:
+        """Returns a filter mask selecting the rows with any of the given object IDs."""
+        wanted = (
+            bytes(int(object_id in object_ids) for object_id in self.object_ids)
+            or b"\x00"
+        )
+        return bytes(map(wanted.__getitem__, self.object_id_index))
+
+    def __len__(self):
+        return len(self.object_id_index)
+
+    def __getitem__(self, item):
+        """Returns an NMSObject view of a single row, or a new table for a slice."""
+        if isinstance(item, slice):
+            return self._slice(item)
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("ObjectTable index out of range")
+        return NMSObject(self._row_as_dict(item))
+
+    def __iter__(self) -> Iterator[NMSObject]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def _slice(self, rows: slice) -> "ObjectTable":
+        start, stop, step = rows.indices(len(self))
+        vectors = slice(3 * start, 3 * stop) if step == 1 else None
+
+        table = ObjectTable()
+        table.object_ids = list(self.object_ids)
+        table.messages = list(self.messages)
+        table.object_id_index = self.object_id_index[rows]
+        table.message_index = self.message_index[rows]
+        table.timestamps = self.timestamps[rows]
+        table.userdata = self.userdata[rows]
+        if vectors is not None:
+            table.positions = self.positions[vectors]
+            table.up = self.up[vectors]
+            table.at = self.at[vectors]
+        else:
+            for column in ("positions", "up", "at"):
+                source = getattr(self, column)
+                getattr(table, column).extend(
+                    chain.from_iterable(
+                        source[3 * row : 3 * row + 3]
+                        for row in range(start, stop, step)
+                    )
+                )
+        selected = range(start, stop, step)
+        table.extras = _select_rows(self.extras, selected)
+        table.missing = _select_rows(self.missing, selected)
+        return table
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the column arrays, excluding the shared string pools."""
+        columns = (
+            self.object_id_index,
+            self.message_index,
+            self.positions,
+            self.up,
+            self.at,
+            self.timestamps,
+            self.userdata,
+        )
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def _row_as_dict(self, i: int) -> dict:
+        vector = slice(3 * i, 3 * i + 3)
+        row = {
+            "ObjectID": self.object_ids[self.object_id_index[i]],
+            "Position": self.positions[vector].tolist(),
+            "Up": self.up[vector].tolist(),
+            "At": self.at[vector].tolist(),
+            "Timestamp": self.timestamps[i],
+            "UserData": self.userdata[i],
+            "Message": self.messages[self.message_index[i]],
+        }
+        row.update(self.extras.get(i, ()))
+        for key in self.missing.get(i, ()):
+            del row[key]
+        return row
+
+    def check_columns(self):
+        """Raises ValueError unless every column holds one entry (or one x, y, z
+        vector) per row. Rows are read by zipping the columns, so a short column would
+        silently drop rows instead."""
+        count = len(self)
+        vectors = (self.positions, self.up, self.at)
+        columns = (self.timestamps, self.userdata, self.message_index)
+        if any(len(v) != 3 * count for v in vectors) or any(
+            len(column) != count for column in columns
+        ):
+            raise ValueError("Column lengths do not match")
+
+    def iter_dicts(self) -> Iterator[dict]:
+        """Yields each row in the save editor's JSON object format, one at a time."""
+        self.check_columns()
+        rows = zip(
+            range(len(self)),
+            self.object_id_index,
+            _vectors(self.positions),
+            _vectors(self.up),
+            _vectors(self.at),
+            self.timestamps,
+            self.userdata,
+            self.message_index,
+        )
+        for i, object_id, position, up, at, timestamp, userdata, message in rows:
+            row = {
+                "ObjectID": self.object_ids[object_id],
+                "Position": position,
+                "Up": up,
+                "At": at,
+                "Timestamp": timestamp,
+                "UserData": userdata,
+                "Message": self.messages[message],
+            }
+            if i in self.extras:
+                row.update(self.extras[i])
+            for key in self.missing.get(i, ()):
+                del row[key]
+            yield row
+
+    def to_dicts(self) -> List[dict]:
+        """Converts the whole table back into the save editor's JSON Objects list."""
+        return list(self.iter_dicts())
+
+
+def _vectors(values: array) -> Iterator[list]:
+    """Splits a flat x, y, z array into one list per object."""
+    flat = iter(values.tolist())
+    return map(list, zip(flat, flat, flat))
+
+
+def _vector(value) -> list:
+    # Missing vectors are stored as zeros so every row keeps three floats, see
+    # ObjectTable.missing
+    if not value:
+        return [0.0, 0.0, 0.0]
+    if len(value) != 3:
+        raise ValueError(f"Expected a 3 component vector, got {value}")
+    return value
+
+
+def _remap(pool: List[str], other_pool: List[str], indices: array) -> array:
+    """Interns other_pool into pool and translates indices from other_pool to pool."""
+    for value in other_pool:
+        if value not in pool:
+            pool.append(value)
+    translation = [pool.index(value) for value in other_pool]
+    return array("H", map(translation.__getitem__, indices))
+
+
+def _select_rows(sparse: dict, rows: Iterable[int]) -> dict:
+    """The entries of a sparse {row: value} dict for rows, renumbered from 0."""
+    if not sparse:
+        return {}
+    return {new_row: sparse[row] for new_row, row in enumerate(rows) if row in sparse}
+
+
+def _integer(obj: dict, key: str) -> int:
+    # Missing values are stored as 0 and recorded in ObjectTable.missing
+    value = obj.get(key, 0)
+    if not isinstance(value, int):
+        raise ValueError(f"Expected an integer {key}, got {value!r}")
+    return value
+
+
+def _timestamp(value) -> int:
+    # NMSObject falls back to "" when the JSON data has no Timestamp
+    return int(value) if value != "" else 0
@@ -0,0 +1,346 @@
+import itertools
+import math
+from array import array
+from collections import defaultdict
+from typing import Iterable, NamedTuple
+
+from constants import CONFLICT_MODES
+from model import ObjectTable
+from serialization import BaseDocument
+from validation import PlacementConflictError
+
+# Generated objects carry this prefix and the sprite's name in their Message, which the
+# save editor keeps, so later runs can find them again
+GENERATED_TAG_PREFIX = "nms-gen:"
+DEFAULT_CELL_SIZE = 5.0
+# Generated objects conflict with existing ones closer than half a tile
+DEFAULT_CONFLICT_RADIUS = 2.5
+# How many tile widths a sprite is moved at most to get clear of existing objects
+DEFAULT_SHIFT_TILES = 16
+# Multipliers that spread grid cells over the hash buckets (Teschner et al., 2003)
+CELL_HASH = (73856093, 19349663, 83492791)
+
+
+def generated_tag(name: str) -> str:
+    return GENERATED_TAG_PREFIX + name
+
+
+def _group_rows(keys: Iterable) -> dict:
+    """Maps every distinct key to the array of rows it appears in."""
+    groups = defaultdict(list)
+    for row, key in enumerate(keys):
+        groups[key].append(row)
+    return {key: array("q", rows) for key, rows in groups.items()}
+
+
+class SpatialHash(object):
+    """A uniform grid over object positions, hashed into a flat array of buckets.
+
+    The index is built in bulk with a counting sort: rows holds every row number grouped
+    by bucket, and the rows in bucket b are rows[starts[b] : starts[b + 1]]. Looking up
+    the objects near a point only visits the few cells around it."""
+
+    def __init__(self, positions: array, cell_size: float = DEFAULT_CELL_SIZE):
+        self.positions = positions
+        self.cell_size = cell_size
+        count = len(positions) // 3
+        # A power of two buckets, at least twice the object count to keep them short
+        self.bucket_mask = (1 << (2 * count).bit_length()) - 1
+        scale = 1 / cell_size
+        cells = zip(
+            *(
+                map(math.floor, (value * scale for value in positions[axis::3]))
+                for axis in range(3)
+            )
+        )
+        buckets = array("q", (self._bucket(cell) for cell in cells))
+
+        counts = [0] * (self.bucket_mask + 2)
+        for bucket in buckets:
+            counts[bucket + 1] += 1
+        self.starts = array("q", itertools.accumulate(counts))
+        next_slot = self.starts.tolist()
+        self.rows = array("q", bytes(8 * count))
+        for row, bucket in enumerate(buckets):
+            self.rows[next_slot[bucket]] = row
+            next_slot[bucket] += 1
+
+    def _bucket(self, cell) -> int:
+        x, y, z = cell
+        return (
+            (x * CELL_HASH[0]) ^ (y * CELL_HASH[1]) ^ (z * CELL_HASH[2])
+        ) & self.bucket_mask
+
+    def _bucket_rows(self, bucket: int) -> array:
+        return self.rows[self.starts[bucket] : self.starts[bucket + 1]]
+
+    def in_cell(self, position) -> array:
+        """Rows of the objects in the same grid cell as position."""
+        scale = 1 / self.cell_size
+        cell = [math.floor(value * scale) for value in position]
+        return array(
+            "q",
+            (
+                row
+                for row in self._bucket_rows(self._bucket(cell))
+                if [
+                    math.floor(value * scale)
+                    for value in self.positions[3 * row : 3 * row + 3]
+                ]
+                == cell
+            ),
+        )
+
+    def near(self, position, radius: float) -> list:
+        """Rows of the objects closer than radius to position along every axis."""
+        scale = 1 / self.cell_size
+        ranges = [
+            range(
+                math.floor((value - radius) * scale),
+                math.floor((value + radius) * scale) + 1,
+            )
+            for value in position
+        ]
+        buckets = {self._bucket(cell) for cell in itertools.product(*ranges)}
+        x, y, z = position
+        found = []
+        positions = self.positions
+        for bucket in buckets:
+            for row in self._bucket_rows(bucket):
+                i = 3 * row
+                if (
+                    abs(positions[i] - x) < radius
+                    and abs(positions[i + 1] - y) < radius
+                    and abs(positions[i + 2] - z) < radius
+                ):
+                    found.append(row)
+        return found
+
+    def _candidates(self, columns: list, radius: float) -> bytes:
+        """Positions whose cell range misses every occupied cell along some axis cannot
+        have a neighbour, which rules out most of a sprite without hashing its cells."""
+        scale = 1 / self.cell_size
+        candidates = b"\x01" * len(columns[0])
+        for axis, column in enumerate(columns):
+            cells = set(
+                map(math.floor, (value * scale for value in self.positions[axis::3]))
+            )
+            lows = map(math.floor, ((value - radius) * scale for value in column))
+            highs = map(math.floor, ((value + radius) * scale for value in column))
+            near_axis = bytes(
+                low in cells
+                or high in cells
+                or any(cell in cells for cell in range(low + 1, high))
+                for low, high in zip(lows, highs)
+            )
+            candidates = bytes(map(min, candidates, near_axis))
+        return candidates
+
+    def conflicts(
+        self, positions: array, radius: float, ignore: bytes | None = None
+    ) -> bytearray:
+        """One byte per position in the flat x, y, z array: 1 where an object (other
+        than those set in the ignore mask) is closer than radius."""
+        columns = [positions[axis::3] for axis in range(3)]
+        candidates = self._candidates(columns, radius)
+        mask = bytearray(len(candidates))
+        for row in itertools.compress(range(len(candidates)), candidates):
+            position = [column[row] for column in columns]
+            if self.has_neighbour(position, radius, ignore):
+                mask[row] = 1
+        return mask
+
+    def has_neighbour(
+        self, position, radius: float, ignore: bytes | None = None
+    ) -> bool:
+        """Whether near() would find any object, stopping at the first one found."""
+        scale = 1 / self.cell_size
+        ranges = [
+            range(
+                math.floor((value - radius) * scale),
+                math.floor((value + radius) * scale) + 1,
+            )
+            for value in position
+        ]
+        x, y, z = position
+        positions = self.positions
+        starts = self.starts
+        rows = self.rows
+        for cell in itertools.product(*ranges):
+            bucket = self._bucket(cell)
+            for row in rows[starts[bucket] : starts[bucket + 1]]:
+                i = 3 * row
+                if (
+                    abs(positions[i] - x) < radius
+                    and abs(positions[i + 1] - y) < radius
+                    and abs(positions[i + 2] - z) < radius
+                    and not (ignore and ignore[row])
+                ):
+                    return True
+        return False
+
+
+class ObjectIndex(object):
+    """Rows of a base's existing objects grouped by generated tag and ObjectID, plus a
+    SpatialHash of their positions. Rows are positions in the Objects array, as in
+    BaseDocument.object_spans."""
+
+    def __init__(self, table: ObjectTable, cell_size: float = DEFAULT_CELL_SIZE):
+        self.table = table
+        by_message = _group_rows(table.message_index)
+        self.tags = {
+            table.messages[message]: rows
+            for message, rows in by_message.items()
+            if table.messages[message].startswith(GENERATED_TAG_PREFIX)
+        }
+        self.object_ids = {
+            table.object_ids[object_id]: rows
+            for object_id, rows in _group_rows(table.object_id_index).items()
+        }
+        self.spatial = SpatialHash(table.positions, cell_size)
+
+    @classmethod
+    def from_document(cls, document: BaseDocument, cell_size=DEFAULT_CELL_SIZE):
+        return cls(document.object_table(), cell_size)
+
+    def with_tag(self, tag: str) -> array:
+        return self.tags.get(tag, array("q"))
+
+    def with_object_id(self, object_id: str) -> array:
+        return self.object_ids.get(object_id, array("q"))
+
+    def in_cell(self, position) -> array:
+        """Rows of the objects in the same grid cell as position."""
+        return self.spatial.in_cell(position)
+
+
+class ReplacementPlan(NamedTuple):
+    """How to turn a base's previously generated objects into a new generation: rows to
+    remove, objects to add and how many identical objects stay where they are."""
+
+    removed: array
+    added: ObjectTable
+    kept: int
+
+
+def _row_keys(table: ObjectTable, rows: Iterable[int]):
+    """Everything but the Message of each row, as hashable tuples."""
+    for row in rows:
+        vector = slice(3 * row, 3 * row + 3)
+        yield (
+            table.object_ids[table.object_id_index[row]],
+            tuple(table.positions[vector]),
+            tuple(table.up[vector]),
+            tuple(table.at[vector]),
+            table.timestamps[row],
+            table.userdata[row],
+        )
+
+
+def plan_replacement(
+    index: ObjectIndex, tag: str, generated: ObjectTable
+) -> ReplacementPlan:
+    """Diffs the objects previously generated with tag against a new generation. Objects
+    present in both are left untouched, so writing the plan is a minimal change."""
+    previous = defaultdict(list)
+    old_rows = index.with_tag(tag)
+    for row, key in zip(old_rows, _row_keys(index.table, old_rows)):
+        previous[key].append(row)
+
+    add = bytearray(len(generated))
+    for row, key in enumerate(_row_keys(generated, range(len(generated)))):
+        if previous.get(key):
+            previous[key].pop()
+        else:
+            add[row] = 1
+    removed = array("q", sorted(row for rows in previous.values() for row in rows))
+    kept = len(old_rows) - len(removed)
+    return ReplacementPlan(removed, generated.filter(add), kept)
+
+
+def find_clear_offset(
+    spatial: SpatialHash,
+    positions: array,
+    radius: float = DEFAULT_CONFLICT_RADIUS,
+    step: float = DEFAULT_CELL_SIZE,
+    max_tiles: int = DEFAULT_SHIFT_TILES,
+    ignore: bytes | None = None,
+    axes: tuple = ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+) -> list | None:
+    """Finds the smallest shift, in whole tiles along the two axes (world x and z by
+    default), that moves every position clear of the indexed objects. None when there is
+    no such shift within max_tiles."""
+    shifts = sorted(
+        itertools.product(range(-max_tiles, max_tiles + 1), repeat=2),
+        key=lambda shift: (shift[0] ** 2 + shift[1] ** 2, shift),
+    )
+    tiles = list(zip(*(positions[axis::3] for axis in range(3))))
+    # Tiles that blocked earlier shifts are likely to block the next ones too, so they
+    # are tried first and most shifts are ruled out after a lookup or two
+    blockers = []
+    for dx, dz in shifts[1:]:
+        offset = [(dx * a + dz * b) * step for a, b in zip(axes[0], axes[1])]
+
+        def blocked(tile) -> bool:
+            shifted = [value + delta for value, delta in zip(tile, offset)]
+            return spatial.has_neighbour(shifted, radius, ignore)
+
+        blocker = next(filter(blocked, blockers), None) or next(
+            filter(blocked, tiles), None
+        )
+        if blocker is None:
+            return offset
+        if blocker not in blockers:
+            blockers.append(blocker)
+    return None
+
+
+def resolve_conflicts(
+    index: ObjectIndex,
+    generated: ObjectTable,
+    mode: str,
+    radius: float = DEFAULT_CONFLICT_RADIUS,
+    ignore_tag: str | None = None,
+    axes: tuple = ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    step: float = DEFAULT_CELL_SIZE,
+) -> tuple:
+    """Checks the generated objects against the indexed base and handles conflicts by
+    mode: "report" only counts them, "skip" leaves the conflicting objects out and
+    "shift" moves the whole sprite by whole steps along the two unit axes to the nearest
+    clear spot (see find_clear_offset). The axes and step should be the sprite's own
+    columns, rows and tile pitch (see placement.tile_pitch), so shifted parts stay on
+    their grid. Objects tagged ignore_tag are not counted, e.g. the ones a replacement
+    removes. Returns the objects and the number of conflicts found before resolving
+    them."""
+    if mode not in CONFLICT_MODES:
+        raise ValueError(f"Unknown conflict mode {mode}")
+    if mode == "ignore":
+        return generated, 0
+
+    ignore = None
+    if ignore_tag is not None:
+        ignore = bytearray(len(index.table))
+        for row in index.with_tag(ignore_tag):
+            ignore[row] = 1
+    mask = index.spatial.conflicts(generated.positions, radius, ignore)
+    conflicts = sum(mask)
+    if not conflicts or mode == "report":
+        return generated, conflicts
+    if mode == "skip":
+        return generated.filter(bytes(1 - conflict for conflict in mask)), conflicts
+
+    offset = find_clear_offset(
+        index.spatial,
+        generated.positions,
+        radius,
+        step,
+        ignore=ignore,
+        axes=axes,
+    )
+    if offset is None:
+        raise PlacementConflictError(
+            f"{conflicts} objects overlap existing ones and no clear spot was found "
+            f"within {DEFAULT_SHIFT_TILES} tiles"
+        )
+    generated.translate(offset)
+    return generated, conflicts
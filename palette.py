@@ -1,11 +1,234 @@
-from PIL import Image
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from array import array
+from operator import itemgetter
+from pathlib import Path
+
+from PIL import Image, ImageMath
+from PIL.Image import Dither
+
+# Palettes ship next to this module, so they are found from any working directory
+SPRITES_DIR = Path(__file__).parent / "sprites"
+NES_PALETTE_PATH = str(SPRITES_DIR / "NES_Palette_NTSC.png")
+
+# Compiled palette lookup tables are stored as a header followed by one palette index per
+# 24-bit RGB color: magic, format version, palette color count, then the palette itself
+LUT_MAGIC = b"NMSLUT"
+LUT_VERSION = 1
+LUT_HEADER = struct.Struct("<6sHH768s")
+LUT_SIZE = 1 << 24
+
+# Entry of a perceptual target table for palette colors that are not candidates
+NO_TARGET = 255
 
 
 def load_color_palette() -> Image.Image:
     """Loads a 256 color palette from a png file."""
-    return Image.open("sprites/palette.png")
+    return Image.open(SPRITES_DIR / "palette.png")
 
 
 def load_nes_palette() -> Image.Image:
     """Loads a 64 color palette from a png file."""
-    return Image.open("sprites/NES_Palette_NTSC.png")
+    return Image.open(NES_PALETTE_PATH)
+
+
+def cache_dir() -> Path:
+    """Directory for compiled data, NMS_GEN_CACHE_DIR or ~/.cache/nms-gen by default"""
+    return Path(os.environ.get("NMS_GEN_CACHE_DIR", Path.home() / ".cache" / "nms-gen"))
+
+
+def _all_rgb_colors() -> Image.Image:
+    """A 4096x4096 RGB image holding every 24-bit color once, in RGB integer order."""
+    blue = bytes(range(256)) * 65536
+    green = b"".join(bytes([value]) * 256 for value in range(256)) * 256
+    red = b"".join(bytes([value]) * 65536 for value in range(256))
+    channels = [Image.frombytes("L", (4096, 4096), data) for data in (red, green, blue)]
+    return Image.merge("RGB", channels)
+
+
+def _lab_as_rgb(image: Image.Image) -> Image.Image:
+    """Converts an sRGB image to CIELAB, with L rescaled to 0-100 so all three channels
+    are in the same units, and returns the Lab values as an "RGB" image. Euclidean
+    distances between its pixels are CIE76 color differences."""
+    # Only needed to compile perceptual tables, and slow to import with LittleCMS
+    from PIL import ImageCms
+
+    transform = ImageCms.buildTransform(
+        ImageCms.createProfile("sRGB"), ImageCms.createProfile("LAB"), "RGB", "LAB"
+    )
+    lab = ImageCms.applyTransform(image, transform)
+    lightness = lab.getchannel(0).point([round(v * 100 / 255) for v in range(256)])
+    return Image.merge("RGB", (lightness, lab.getchannel(1), lab.getchannel(2)))
+
+
+def _color_keys(image: Image.Image) -> array:
+    """24-bit RGB keys for every pixel of an RGB(A) image, computed by Pillow in one pass."""
+    red, green, blue = (image.getchannel(band) for band in "RGB")
+    keys = ImageMath.lambda_eval(
+        lambda args: args["r"] * 65536 + args["g"] * 256 + args["b"],
+        r=red,
+        g=green,
+        b=blue,
+    )
+    key_array = array("i")
+    key_array.frombytes(keys.tobytes())
+    return key_array
+
+
+class PaletteQuantizer(object):
+    """Quantizes to a palette with Pillow's quantize(), to the nearest color without
+    dithering. Pillow searches the palette in C through its own color cache, which is
+    far faster than gathering from a lookup table pixel by pixel in Python, so the
+    default matcher quantizes this way rather than through a compiled table."""
+
+    def __init__(self, palette_path):
+        with Image.open(palette_path) as palette_image:
+            palette_image.load()
+        self.image = palette_image
+        self.palette = palette_image.getpalette()
+        # Identifies the palette, e.g. for cache keys
+        palette_hash = hashlib.sha256(Path(palette_path).read_bytes()).hexdigest()
+        self.name = f"palette-{palette_hash[:16]}"
+
+    def index_plane(self, image: Image.Image) -> bytes:
+        """Returns the palette index of every pixel, in row-major order."""
+        return self.quantize(image).tobytes()
+
+    def quantize(self, image: Image.Image) -> Image.Image:
+        """Converts the image to a "P" mode image using this palette."""
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return image.quantize(palette=self.image, dither=Dither.NONE)
+
+
+class PaletteLUT(object):
+    """A dense RGB to palette index lookup table, memory-mapped from the compiled file.
+    Used where no Pillow operation gives the same mapping (see compile_perceptual_lut);
+    the lookup itself is one Python gather per pixel."""
+
+    def __init__(self, lut_path: Path):
+        with open(lut_path, "rb") as lut_file:
+            self._mmap = mmap.mmap(lut_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) != LUT_HEADER.size + LUT_SIZE:
+            raise ValueError(f"Truncated palette lookup table: {lut_path}")
+        magic, version, color_count, palette = LUT_HEADER.unpack_from(self._mmap)
+        if magic != LUT_MAGIC or version != LUT_VERSION:
+            raise ValueError(f"Unsupported palette lookup table: {lut_path}")
+        self.palette = list(palette[: 3 * color_count])
+        self.table = memoryview(self._mmap)[LUT_HEADER.size :]
+        # Identifies the table's contents, e.g. for cache keys
+        self.name = lut_path.stem
+
+    def index_plane(self, image: Image.Image) -> bytes:
+        """Returns the palette index of every pixel, in row-major order."""
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        keys = _color_keys(image)
+        if not keys:
+            return b""
+        # itemgetter gathers all the keys in one call, without a Python call per pixel
+        found = itemgetter(*keys)(self.table)
+        return bytes(found) if len(keys) > 1 else bytes([found])
+
+    def quantize(self, image: Image.Image) -> Image.Image:
+        """Converts the image to a "P" mode image using this palette."""
+        quantized = Image.frombytes("P", image.size, self.index_plane(image))
+        quantized.putpalette(self.palette)
+        return quantized
+
+
+def compile_perceptual_lut(palette_path, targets: bytes, lut_path: Path):
+    """Compiles a lookup table that maps every RGB color to targets[i], where i is the
+    candidate palette color nearest to it in CIELAB (the lowest index on ties). targets
+    has one entry per palette index, NO_TARGET for colors that are not candidates.
+
+    The 16.7M colors only take about 870k distinct Lab values (see _lab_as_rgb). Those
+    are searched exactly with Pillow's integer image arithmetic, one pass per candidate
+    over all of them at once, and then looked up for every color by its Lab key."""
+    with Image.open(palette_path) as palette_image:
+        palette = palette_image.getpalette()
+    candidates = [i for i in range(len(palette) // 3) if targets[i] != NO_TARGET]
+    if not candidates:
+        raise ValueError("No palette color is a match target")
+    colors = Image.new("RGB", (len(candidates), 1))
+    colors.putdata([tuple(palette[3 * i : 3 * i + 3]) for i in candidates])
+    flat = iter(_lab_as_rgb(colors).tobytes())
+    candidate_labs = list(zip(flat, flat, flat))
+
+    lab = _lab_as_rgb(_all_rgb_colors())
+    values = [value for _, value in lab.getcolors(LUT_SIZE)]
+    distinct = Image.new("RGB", (len(values), 1))
+    distinct.putdata(values)
+    channels = {band: distinct.getchannel(band).convert("I") for band in "RGB"}
+    # Index of the nearest candidate so far, and its distance
+    nearest = ImageMath.lambda_eval(lambda args: args["R"] * 0, R=channels["R"])
+    best = None
+    for k, (lightness, a, b) in enumerate(candidate_labs):
+        distance = ImageMath.lambda_eval(
+            lambda args: (
+                (args["R"] - lightness) * (args["R"] - lightness)
+                + (args["G"] - a) * (args["G"] - a)
+                + (args["B"] - b) * (args["B"] - b)
+            ),
+            **channels,
+        )
+        if best is None:
+            best = distance
+            continue
+        nearest = ImageMath.lambda_eval(
+            lambda args: args["n"] + (args["d"] < args["best"]) * (k - args["n"]),
+            n=nearest,
+            d=distance,
+            best=best,
+        )
+        best = ImageMath.lambda_eval(
+            lambda args: args["min"](args["d"], args["best"]), d=distance, best=best
+        )
+
+    by_key = bytearray(LUT_SIZE)
+    winners = bytes(targets[i] for i in candidates)
+    nearest_array = array("i")
+    nearest_array.frombytes(nearest.tobytes())
+    for (lightness, a, b), k in zip(values, nearest_array):
+        by_key[lightness << 16 | a << 8 | b] = winners[k]
+    table = bytes(map(by_key.__getitem__, _color_keys(lab)))
+    _write_lut(lut_path, palette, table)
+
+
+def _write_lut(lut_path: Path, palette: list, table: bytes):
+    header = LUT_HEADER.pack(LUT_MAGIC, LUT_VERSION, len(palette) // 3, bytes(palette))
+    lut_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so concurrent runs never see a partial table. It
+    # is named after the thread too, threads of a service worker can compile at once.
+    temp_name = f"{lut_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    temp_path = lut_path.with_name(temp_name)
+    with open(temp_path, "wb") as lut_file:
+        lut_file.write(header)
+        lut_file.write(table)
+    os.replace(temp_path, lut_path)
+
+
+@functools.cache
+def load_palette(palette_path=NES_PALETTE_PATH) -> PaletteQuantizer:
+    """The quantizer for the palette PNG, loaded once per process."""
+    return PaletteQuantizer(palette_path)
+
+
+@functools.cache
+def load_perceptual_lut(targets: bytes, palette_path=NES_PALETTE_PATH) -> PaletteLUT:
+    """Loads the compiled perceptual lookup table for the palette PNG and targets (see
+    compile_perceptual_lut), compiling it on first use. Quantizing with it gives images
+    in the palette whose indexes are the matched targets."""
+    palette_hash = hashlib.sha256(Path(palette_path).read_bytes() + targets).hexdigest()
+    lut_path = cache_dir() / f"perceptual-v{LUT_VERSION}-{palette_hash[:16]}.lut"
+    if lut_path.is_file():
+        try:
+            return PaletteLUT(lut_path)
+        except ValueError:
+            pass
+    compile_perceptual_lut(palette_path, targets, lut_path)
+    return PaletteLUT(lut_path)
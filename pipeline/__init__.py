@@ -0,0 +1,469 @@
+import dataclasses
+import json
+import logging
+from array import array
+from pathlib import Path
+
+from PIL import Image
+
+from base_snapshot import read_base_snapshot
+from constants import DEFAULT_MAX_HEIGHT, MATCHERS, MAX_BASE_OBJS
+from instrumentation import NULL_INSTRUMENTATION
+from mapping import (
+    DEFAULT_PROFILE_PATH,
+    MappingTables,
+    alpha_threshold_table,
+    count_tiles,
+    load_mapping_profile,
+    sprite_data_to_table,
+    tile_plane,
+)
+from model import NMSObject
+from object_index import (
+    ObjectIndex,
+    ReplacementPlan,
+    generated_tag,
+    plan_replacement,
+    resolve_conflicts,
+)
+from palette import PaletteLUT, PaletteQuantizer, load_palette, load_perceptual_lut
+from preview import rasterize, save_preview
+from voxels import VoxelVolume, height_lut, layer_keys
+from placement import Placement, lift, placement_frame, tile_pitch
+from result_cache import CachedObjects, CachedPlanes, ResultCache
+from serialization import (
+    BaseDocument,
+    open_output,
+    read_base_document,
+    write_base_document,
+)
+from validation import (
+    IncompatibleImageError,
+    InvalidBaseDataError,
+    validate_base_document,
+    validate_pixel_input_data,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class GenerationJob(object):
+    """Everything needed to inject one sprite into one base export. Jobs only hold plain
+    values so they can be handed to worker processes."""
+
+    base_json: str
+    sprite_file: str
+    z_up: float
+    output_file: str
+    profile: str = DEFAULT_PROFILE_PATH
+    coalesce: bool = False
+    compact: bool = False
+    compress: bool | None = None
+    # Only generate this (left, upper, right, lower) region of the sprite
+    crop: tuple | None = None
+    # The caller already fit the sprite's objects into the base (see composition), so
+    # the sprite's size is not checked against the object limit
+    budgeted: bool = False
+    # Reuse and store intermediate results in the on-disk cache (see result_cache)
+    cache: bool = True
+    # Name the objects are tagged with, the sprite file's name by default
+    tag: str | None = None
+    # Replace the objects a previous run generated with the same tag
+    replace: bool = False
+    # What to do with objects overlapping existing ones, see object_index.CONFLICT_MODES
+    on_conflict: str = "ignore"
+    # Layout in the base computer's frame, see placement.Placement
+    plane: str = "floor"
+    rotation: float = 0.0
+    scale: float = 1.0
+    # Voxel mode: sprites stacked above sprite_file, or a grayscale heightmap that
+    # extrudes it up to max_height voxels (see voxels)
+    layers: tuple = ()
+    heightmap: str | None = None
+    max_height: int = DEFAULT_MAX_HEIGHT
+    # Also render the generated objects back into this PNG (see preview)
+    preview: str | None = None
+    # How sprite colors are matched to parts, see palette.MATCHERS
+    matcher: str = "rgb"
+
+    def __post_init__(self):
+        # Fail on invalid options here rather than in a worker process
+        self._validate_placement()
+        if self.layers and self.heightmap:
+            raise ValueError("Use either layers or a heightmap, not both")
+        if self.voxels and self.coalesce:
+            raise ValueError("Coalescing is not supported for voxels")
+        if not 1 <= self.max_height <= 255:
+            raise ValueError("The maximum height must be between 1 and 255")
+        if self.matcher not in MATCHERS:
+            raise ValueError(f"Unknown color matcher: {self.matcher}")
+
+    @property
+    def voxels(self) -> bool:
+        return bool(self.layers or self.heightmap)
+
+    @property
+    def placement(self) -> Placement:
+        return Placement(self.plane, self.rotation, self.scale)
+
+    def _validate_placement(self):
+        """Raises ValueError for an unknown plane or a scale that is not positive, the
+        checks Placement runs when it is built."""
+        Placement(self.plane, self.rotation, self.scale)
+
+
+@dataclasses.dataclass
+class GenerationResult(object):
+    output_file: str
+    tiles: int
+    objects: int
+    # With GenerationJob.replace, previously generated objects removed and left in place
+    removed: int = 0
+    kept: int = 0
+    # Generated objects that overlapped existing ones, unless on_conflict is "ignore"
+    conflicts: int = 0
+
+
+def _read_base(base_json, cache=True) -> BaseDocument:
+    """Reads a base export, reporting parse errors as InvalidBaseDataError. With cache,
+    the base is loaded from its snapshot when it has not changed (see base_snapshot)."""
+    try:
+        if cache:
+            return read_base_snapshot(base_json)
+        return read_base_document(base_json)
+    except ValueError as e:
+        raise InvalidBaseDataError(
+            f"An error occurred when trying to load base json data from {base_json}: {e}"
+        ) from e
+
+
+def load_base(base_json, cache=True) -> BaseDocument:
+    """Reads and validates a base export."""
+    base_document = _read_base(base_json, cache)
+    validate_base_document(base_document)
+    return base_document
+
+
+class SpriteImage(object):
+    """A sprite decoded exactly once into an RGBA image. The transparency mask and the
+    palette index plane are both derived from that one buffer, so the sprite is never
+    decoded, converted or quantized again."""
+
+    def __init__(self, image: Image.Image):
+        self.size = image.size
+        self.has_alpha = image.has_transparency_data
+        self.image = image if image.mode == "RGBA" else image.convert("RGBA")
+
+    @classmethod
+    def open(cls, sprite_file, crop: tuple | None = None, check_size=True):
+        """Opens and validates a sprite (or the crop box of it). Validation only looks at
+        the header, the pixel data is decoded once when it is converted."""
+        with Image.open(sprite_file) as image:
+            if crop is not None:
+                image = image.crop(crop)
+            validate_pixel_input_data(image, check_size=check_size)
+            image.load()
+            return cls(image)
+
+    def transparency_mask(self, alpha_threshold: int = 0) -> bytes | None:
+        """See mapping.build_transparency_mask. None when the sprite has no alpha."""
+        if not self.has_alpha:
+            return None
+        alpha = self.image.getchannel("A").tobytes()
+        return alpha.translate(alpha_threshold_table(alpha_threshold))
+
+    def quantize(
+        self, palette: PaletteQuantizer | PaletteLUT | None = None
+    ) -> Image.Image:
+        """The sprite as a "P" mode image in the NES palette, or quantized with palette."""
+        return (palette or load_palette()).quantize(self.image)
+
+
+def color_matcher(
+    job: GenerationJob, mapping_tables: MappingTables
+) -> PaletteQuantizer | PaletteLUT:
+    """What quantizes the job's sprites. With the "lab" matcher, a lookup table takes
+    pixels straight to the palette index of their part (see
+    MappingTables.match_targets)."""
+    if job.matcher == "lab":
+        return load_perceptual_lut(mapping_tables.match_targets)
+    return load_palette()
+
+
+def load_sprite(sprite_file, crop: tuple | None = None, check_size=True) -> tuple:
+    """Opens a sprite (or the crop box of it) and returns it quantized to the NES palette
+    along with its transparency mask (None when the sprite has no alpha channel)."""
+    sprite = SpriteImage.open(sprite_file, crop, check_size=check_size)
+    return sprite.quantize(), sprite.transparency_mask()
+
+
+def warm_caches(profiles=(DEFAULT_PROFILE_PATH,)):
+    """Loads the palette and compiles the mapping profiles, so later jobs in this process
+    never pay for them."""
+    load_palette()
+    for profile in profiles:
+        load_mapping_profile(profile)
+
+
+def map_sprite(
+    sprite: SpriteImage,
+    base_computer: NMSObject,
+    mapping_tables: MappingTables,
+    job: GenerationJob,
+    instrumentation=NULL_INSTRUMENTATION,
+) -> tuple:
+    """Masks, quantizes and maps a decoded sprite. Returns the generated ObjectTable and
+    the number of tiles it covers (more than the object count when coalescing)."""
+    with instrumentation.stage("mask"):
+        alpha_mask = sprite.transparency_mask()
+    with instrumentation.stage("quantize"):
+        image = sprite.quantize(color_matcher(job, mapping_tables))
+    return map_image(
+        image, alpha_mask, base_computer, mapping_tables, job, instrumentation
+    )
+
+
+def map_image(
+    image: Image.Image,
+    alpha_mask: bytes | None,
+    base_computer: NMSObject,
+    mapping_tables: MappingTables,
+    job: GenerationJob,
+    instrumentation=NULL_INSTRUMENTATION,
+) -> tuple:
+    """The mapping stage of map_sprite, for an already quantized image."""
+    with instrumentation.stage("map"):
+        objects = sprite_data_to_table(
+            image,
+            base_computer,
+            z_up=job.z_up,
+            transparency_mask=alpha_mask,
+            tables=mapping_tables,
+            coalesce=job.coalesce,
+            placement=job.placement,
+        )
+        tiles = count_tiles(image, alpha_mask, mapping_tables)
+    return objects, tiles
+
+
+def map_volume(
+    job: GenerationJob,
+    base_computer: NMSObject,
+    mapping_tables: MappingTables,
+    instrumentation=NULL_INSTRUMENTATION,
+) -> tuple:
+    """Builds the voxel volume of a job with layers or a heightmap and maps its visible
+    voxels. Returns the ObjectTable, the number of voxels and the pixels per layer."""
+    with instrumentation.stage("decode"):
+        sprites = [SpriteImage.open(path) for path in (job.sprite_file, *job.layers)]
+        size = sprites[0].size
+        for layer_file, sprite in zip(job.layers, sprites[1:]):
+            if sprite.size != size:
+                raise IncompatibleImageError(
+                    f"Layer {layer_file} is {sprite.size[0]}x{sprite.size[1]}, but "
+                    f"the sprite {job.sprite_file} is {size[0]}x{size[1]}"
+                )
+        heights = None
+        if job.heightmap:
+            with Image.open(job.heightmap) as heightmap:
+                if heightmap.size != size:
+                    raise IncompatibleImageError(
+                        f"Heightmap {job.heightmap} is {heightmap.width}x"
+                        f"{heightmap.height}, but the sprite {job.sprite_file} is "
+                        f"{size[0]}x{size[1]}"
+                    )
+                heights = heightmap.convert("L").tobytes()
+            heights = heights.translate(height_lut(job.max_height))
+    with instrumentation.stage("mask"):
+        masks = [sprite.transparency_mask() for sprite in sprites]
+    with instrumentation.stage("quantize"):
+        lut = color_matcher(job, mapping_tables)
+        images = [sprite.quantize(lut) for sprite in sprites]
+    with instrumentation.stage("map"):
+        planes = [
+            layer_keys(image.tobytes(), tile_plane(image, mask, mapping_tables))
+            for image, mask in zip(images, masks)
+        ]
+        if heights is not None:
+            volume = VoxelVolume.from_heightmap(*size, planes[0], heights)
+        else:
+            volume = VoxelVolume.from_layers(*size, planes)
+        objects = volume.to_table(
+            base_computer, mapping_tables, job.z_up, placement=job.placement
+        )
+    if len(objects) > MAX_BASE_OBJS:
+        logger.warning(
+            "%d voxels are visible, more than the %d objects a base can hold",
+            len(objects),
+            MAX_BASE_OBJS,
+        )
+    return objects, volume.occupancy().count(1), size[0] * size[1]
+
+
+def _map_cached(
+    job: GenerationJob,
+    base_computer: dict,
+    mapping_tables: MappingTables,
+    instrumentation=NULL_INSTRUMENTATION,
+) -> tuple:
+    """map_sprite through the result cache. Tables are cached as generated at a z_up of
+    0 and shifted up afterwards, which gives the exact same positions, so changing z_up
+    reuses the cached table as well as the planes (see placement.place_grid). Returns
+    CachedObjects."""
+    cache = ResultCache()
+    palette = color_matcher(job, mapping_tables)
+    check_size = job.crop is None and not job.budgeted
+    with instrumentation.stage("cache"):
+        with open(job.sprite_file, "rb") as sprite_file:
+            planes_key = cache.planes_key(
+                sprite_file.read(), job.crop, palette.name.encode(), check_size
+            )
+        with open(job.profile, "rb") as profile_file:
+            objects_key = cache.objects_key(
+                planes_key,
+                profile_file.read(),
+                base_computer,
+                {
+                    "coalesce": job.coalesce,
+                    "placement": dataclasses.astuple(job.placement),
+                },
+            )
+        cached = cache.load_objects(objects_key)
+
+    if cached is None:
+        with instrumentation.stage("cache"):
+            planes = cache.load_planes(planes_key)
+        if planes is None:
+            with instrumentation.stage("decode"):
+                sprite = SpriteImage.open(
+                    job.sprite_file, job.crop, check_size=check_size
+                )
+            with instrumentation.stage("mask"):
+                alpha_mask = sprite.transparency_mask()
+            with instrumentation.stage("quantize"):
+                image = sprite.quantize(palette)
+            planes = CachedPlanes(image.size, image.tobytes(), alpha_mask)
+            cache.store_planes(planes_key, planes)
+        else:
+            image = Image.frombytes("P", planes.size, planes.index_plane)
+            image.putpalette(palette.palette)
+        objects, tiles = map_image(
+            image,
+            planes.mask,
+            NMSObject(base_computer),
+            mapping_tables,
+            dataclasses.replace(job, z_up=0.0),
+            instrumentation,
+        )
+        cached = CachedObjects(image.width * image.height, tiles, objects)
+        cache.store_objects(objects_key, cached)
+
+    cached.objects.translate(lift(NMSObject(base_computer), job.z_up))
+    return cached
+
+
+def generate_objects(
+    job: GenerationJob,
+    base_computer: dict,
+    mapping_tables: MappingTables,
+    instrumentation=NULL_INSTRUMENTATION,
+) -> tuple:
+    """Generates the job's objects, tagged with its name (see object_index), around the
+    base computer. Returns the ObjectTable, the number of tiles (or voxels) and the
+    number of pixels in the sprite."""
+    if job.voxels:
+        objects, tiles, pixels = map_volume(
+            job, NMSObject(base_computer), mapping_tables, instrumentation
+        )
+    elif job.cache:
+        pixels, tiles, objects = _map_cached(
+            job, base_computer, mapping_tables, instrumentation
+        )
+    else:
+        with instrumentation.stage("decode"):
+            # Shards are cropped to fit their base's budget, see sharding.plan_shards
+            sprite = SpriteImage.open(
+                job.sprite_file,
+                job.crop,
+                check_size=job.crop is None and not job.budgeted,
+            )
+        objects, tiles = map_sprite(
+            sprite, NMSObject(base_computer), mapping_tables, job, instrumentation
+        )
+        pixels = sprite.size[0] * sprite.size[1]
+    instrumentation.count("pixels", pixels)
+    instrumentation.count("tiles", tiles)
+    instrumentation.count("objects", len(objects))
+    objects.set_message(job_tag(job))
+    return objects, tiles, pixels
+
+
+def job_tag(job: GenerationJob) -> str:
+    """The tag of the job's objects, from its name or its sprite file's name."""
+    return generated_tag(job.tag or Path(job.sprite_file).stem)
+
+
+def run_job(
+    job: GenerationJob, instrumentation=NULL_INSTRUMENTATION
+) -> GenerationResult:
+    """Generates the sprite's objects and writes them into a copy of the base export.
+    Each stage is timed through instrumentation (see instrumentation.Instrumentation)."""
+    with instrumentation.stage("load base"):
+        base_document = _read_base(job.base_json, job.cache)
+    with instrumentation.stage("validate"):
+        validate_base_document(base_document)
+        base_computer = NMSObject(base_document.base_computer)
+        mapping_tables = load_mapping_profile(job.profile)
+    objects, tiles, pixels = generate_objects(
+        job, base_document.base_computer, mapping_tables, instrumentation
+    )
+    tag = job_tag(job)
+    conflicts = 0
+    if job.replace or job.on_conflict != "ignore":
+        with instrumentation.stage("index"):
+            index = ObjectIndex.from_document(base_document)
+    if job.on_conflict != "ignore":
+        with instrumentation.stage("place"):
+            # Shifted along the sprite's own rows and columns, by whole tiles
+            axes, pitch = tile_pitch(placement_frame(base_computer, job.placement))
+            objects, conflicts = resolve_conflicts(
+                index,
+                objects,
+                job.on_conflict,
+                ignore_tag=tag if job.replace else None,
+                axes=axes,
+                step=pitch,
+            )
+    generated = len(objects)
+    if job.replace:
+        with instrumentation.stage("index"):
+            plan = plan_replacement(index, tag, objects)
+    else:
+        plan = ReplacementPlan(array("q"), objects, 0)
+    if not job.replace and base_document.contains(json.dumps(tag)):
+        logger.warning(
+            "The base already contains objects generated from %s, use --replace to "
+            "replace them instead of adding another copy",
+            tag,
+        )
+
+    logger.debug("Writing output JSON file to %s", job.output_file)
+    # Objects are serialized while they are streamed out, so this covers both
+    with instrumentation.stage("write"):
+        # Copy the base data through with the new objects appended to its Objects array
+        with open_output(job.output_file, compress=job.compress) as outfile:
+            write_base_document(
+                outfile,
+                base_document,
+                plan.added.iter_dicts(),
+                indent=None if job.compact else 4,
+                removed=plan.removed,
+            )
+    if job.preview:
+        with instrumentation.stage("preview"):
+            image = rasterize(objects, base_computer, mapping_tables, job.placement)
+            save_preview(image, job.preview)
+    return GenerationResult(
+        job.output_file, tiles, generated, len(plan.removed), plan.kept, conflicts
+    )
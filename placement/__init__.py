@@ -0,0 +1,191 @@
+import dataclasses
+import math
+from array import array
+from itertools import chain, compress, repeat
+from operator import add
+from typing import List, NamedTuple
+
+from constants import PLANES
+from model import NMSObject
+
+
+@dataclasses.dataclass(frozen=True)
+class Placement(object):
+    """How a sprite is laid out in the anchor object's frame. On the floor plane sprite
+    rows run along the anchor's At vector; on the wall plane they run down the anchor's
+    Up vector with the bottom row at the anchor, facing along At. The sprite is rotated
+    by rotation degrees about the plane's normal, and scale multiplies both the tile
+    spacing and the size of every part."""
+
+    plane: str = "floor"
+    rotation: float = 0.0
+    scale: float = 1.0
+
+    def __post_init__(self):
+        if self.plane not in PLANES:
+            raise ValueError(f"Unknown plane {self.plane}, expected one of {PLANES}")
+        if not self.scale > 0:
+            raise ValueError("The scale must be greater than 0")
+
+
+DEFAULT_PLACEMENT = Placement()
+
+
+class Frame(NamedTuple):
+    """The affine transform from sprite (column, row) coordinates to world positions,
+    position = origin + column * column_axis + (row - first_row) * row_axis, plus the
+    orientation given to every part and the plane's unit normal."""
+
+    origin: tuple
+    column_axis: tuple
+    row_axis: tuple
+    first_row: float
+    part_up: tuple
+    part_at: tuple
+    normal: tuple
+
+
+def _scaled(vector, factor: float) -> tuple:
+    return tuple(value * factor for value in vector)
+
+
+def _combine(a, a_factor: float, b, b_factor: float) -> tuple:
+    return tuple(x * a_factor + y * b_factor for x, y in zip(a, b))
+
+
+def _cross(a, b) -> tuple:
+    return (
+        a[1] * b[2] - a[2] * b[1],
+        a[2] * b[0] - a[0] * b[2],
+        a[0] * b[1] - a[1] * b[0],
+    )
+
+
+def _unit(vector) -> tuple | None:
+    length = math.sqrt(sum(value * value for value in vector))
+    if length < 1e-9:
+        return None
+    return _scaled(vector, 1 / length)
+
+
+# Right, forward and up of an anchor whose orientation is missing or degenerate
+WORLD_AXES = ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, 1.0, 0.0))
+
+
+def anchor_axes(anchor: NMSObject) -> tuple:
+    """Unit right, forward and up vectors of the anchor. Forward is At made perpendicular
+    to Up, and right is Up x At, which is world x for the default Up (0, 1, 0) and At
+    (0, 0, 1). Anchors without a usable Up and At fall back to the world axes."""
+    if len(anchor.up) != 3 or len(anchor.at) != 3:
+        return WORLD_AXES
+    up = _unit(anchor.up)
+    if up is None:
+        return WORLD_AXES
+    along_up = sum(a * u for a, u in zip(anchor.at, up))
+    forward = _unit(_combine(anchor.at, 1.0, up, -along_up))
+    if forward is None:
+        return WORLD_AXES
+    return _cross(up, forward), forward, up
+
+
+def lift(anchor: NMSObject, z_up: float) -> list:
+    """The offset that raises a sprite z_up above the anchor, along the anchor's Up."""
+    return [value * z_up for value in anchor_axes(anchor)[2]]
+
+
+def placement_frame(
+    anchor: NMSObject,
+    placement: Placement = DEFAULT_PLACEMENT,
+    tile_spacing=5,
+    height: int = 1,
+) -> Frame:
+    """Builds the transform for a sprite of the given height (in tiles)."""
+    right, forward, up = anchor_axes(anchor)
+    # Parts of an anchor without an orientation face the world axes, like its sprite
+    anchor_up = anchor.up if len(anchor.up) == 3 else WORLD_AXES[2]
+    anchor_at = anchor.at if len(anchor.at) == 3 else WORLD_AXES[1]
+    if placement.plane == "floor":
+        down, first_row, normal = forward, 0.0, up
+        part_up, part_at = anchor_up, anchor_at
+    else:
+        # Rows count down from the top, so the bottom row ends up at the anchor
+        down, first_row, normal = _scaled(up, -1.0), height - 1.0, forward
+        part_up, part_at = anchor_at, anchor_up
+
+    angle = math.radians(placement.rotation)
+    cos, sin = math.cos(angle), math.sin(angle)
+    spacing = tile_spacing * placement.scale
+    column_axis = _scaled(_combine(right, cos, down, sin), spacing)
+    row_axis = _scaled(_combine(down, cos, right, -sin), spacing)
+    # Parts turn with the sprite: At rotates about the plane normal like the rows do
+    part_at = _combine(part_at, cos, _cross(normal, part_at), -sin)
+    part_up = _scaled(part_up, placement.scale)
+    part_at = _scaled(part_at, placement.scale)
+    return Frame(
+        tuple(anchor.position),
+        column_axis,
+        row_axis,
+        first_row,
+        tuple(part_up),
+        tuple(part_at),
+        normal,
+    )
+
+
+def tile_pitch(frame: Frame) -> tuple:
+    """Unit vectors along the frame's columns and rows, and the distance between
+    neighbouring tiles (the tile spacing times the scale). Coalesced squares are laid
+    out on the same grid, so moving a sprite by whole pitches keeps every part on it."""
+    pitch = math.sqrt(sum(value * value for value in frame.column_axis))
+    axes = (_scaled(frame.column_axis, 1 / pitch), _scaled(frame.row_axis, 1 / pitch))
+    return axes, pitch
+
+
+def place_grid(
+    frame: Frame, width: int, height: int, keep: bytes, offset: List[float]
+) -> array:
+    """Positions of the kept cells of a width x height grid, as a flat x, y, z array.
+
+    The transform is separable, so each axis is the sum of a per-column and a per-row
+    term. Both are computed once per column and row and then gathered for every kept
+    cell with compress(), so the batch costs one pass per axis rather than a matrix
+    product per tile. offset (e.g. the lift) is added last, so shifting the positions
+    by a different offset later gives exactly the same values."""
+    count = keep.count(1)
+    positions = array("d", bytes(24 * count))
+    rows = [row - frame.first_row for row in range(height)]
+    for axis in range(3):
+        columns = [
+            frame.origin[axis] + column * frame.column_axis[axis]
+            for column in range(width)
+        ]
+        row_terms = [row * frame.row_axis[axis] for row in rows]
+        values = map(
+            add,
+            compress(columns * height, keep),
+            compress(chain.from_iterable(repeat(v, width) for v in row_terms), keep),
+        )
+        if offset[axis]:
+            values = (value + offset[axis] for value in values)
+        positions[axis::3] = array("d", values)
+    return positions
+
+
+def place_points(
+    frame: Frame, columns: List[float], rows: List[float], offset: List[float]
+) -> array:
+    """Positions of arbitrary (column, row) sprite coordinates, e.g. the centers of
+    coalesced squares, with the same arithmetic as place_grid."""
+    positions = array("d", bytes(24 * len(columns)))
+    for axis in range(3):
+        origin = frame.origin[axis]
+        column_axis = frame.column_axis[axis]
+        row_axis = frame.row_axis[axis]
+        values = (
+            (origin + column * column_axis) + (row - frame.first_row) * row_axis
+            for column, row in zip(columns, rows)
+        )
+        if offset[axis]:
+            values = (value + offset[axis] for value in values)
+        positions[axis::3] = array("d", values)
+    return positions
@@ -0,0 +1,156 @@
+import math
+from array import array
+from pathlib import Path
+
+from PIL import Image
+
+from base_snapshot import read_base_snapshot
+from mapping import (
+    DEFAULT_PROFILE_PATH,
+    NO_OBJECT,
+    MappingTables,
+    load_mapping_profile,
+)
+from model import NMSObject, ObjectTable
+from object_index import GENERATED_TAG_PREFIX
+from palette import load_palette
+from placement import DEFAULT_PLACEMENT, Placement, placement_frame
+from validation import validate_base_document
+
+# Palette slots after the 64 NES colors: parts the profile does not map, and empty cells
+UNMAPPED = 254
+BACKGROUND = 255
+UNMAPPED_COLOR = (255, 0, 255)
+
+
+def swatches(tables: MappingTables) -> dict:
+    """Maps each (ObjectID, userdata) part of the profile to the first palette index that
+    produces it, the color the part is drawn with."""
+    parts = {}
+    for color_index, (object_id, userdata) in enumerate(
+        zip(tables.object_id_lut, tables.userdata_lut)
+    ):
+        if object_id != NO_OBJECT:
+            parts.setdefault((tables.object_ids[object_id], userdata), color_index)
+    return parts
+
+
+def preview_palette() -> list:
+    """The NES palette padded to 256 colors, with UNMAPPED in magenta."""
+    palette = list(load_palette().palette)
+    palette += [0] * (3 * UNMAPPED - len(palette))
+    return palette + list(UNMAPPED_COLOR) + [0, 0, 0]
+
+
+def _grid_coordinates(positions, origin, axis) -> list:
+    """Projects every position onto a frame axis, in multiples of the axis length."""
+    scale = 1.0 / sum(v * v for v in axis)
+    xs, ys, zs = (positions[i::3] for i in range(3))
+    ox, oy, oz = origin
+    ax, ay, az = (v * scale for v in axis)
+    return [
+        (x - ox) * ax + (y - oy) * ay + (z - oz) * az for x, y, z in zip(xs, ys, zs)
+    ]
+
+
+def _square_sizes(table: ObjectTable, part_up) -> list | None:
+    """How many tiles wide each part is (see mapping._coalesced_table), or None when
+    every part has the frame's own Up vector and covers one tile."""
+    if len(part_up) != 3 or table.up == array("d", part_up) * len(table):
+        return None
+    base = math.sqrt(sum(v * v for v in part_up)) or 1.0
+    ups = table.up
+    return [
+        max(1, round(math.sqrt(sum(v * v for v in ups[i : i + 3])) / base))
+        for i in range(0, len(ups), 3)
+    ]
+
+
+def rasterize(
+    table: ObjectTable,
+    anchor: NMSObject,
+    tables: MappingTables,
+    placement: Placement = DEFAULT_PLACEMENT,
+    tile_spacing=5,
+) -> Image.Image:
+    """Draws the objects back onto the sprite grid they were laid out on, one pixel per
+    tile, as a "P" mode image with a transparent background. Positions are projected
+    onto the placement frame's column and row axes for the whole table at once, and
+    objects stacked along the plane normal (voxels) are drawn bottom to top."""
+    if not len(table):
+        raise ValueError("There are no objects to render")
+    frame = placement_frame(anchor, placement, tile_spacing)
+    columns = _grid_coordinates(table.positions, frame.origin, frame.column_axis)
+    rows = _grid_coordinates(table.positions, frame.origin, frame.row_axis)
+    depths = _grid_coordinates(table.positions, frame.origin, frame.normal)
+    sizes = _square_sizes(table, frame.part_up)
+    if sizes is not None:
+        # Coalesced parts sit at the center of the square they cover
+        columns = [c - (k - 1) / 2 for c, k in zip(columns, sizes)]
+        rows = [r - (k - 1) / 2 for r, k in zip(rows, sizes)]
+    columns = list(map(round, columns))
+    rows = list(map(round, rows))
+    left, upper = min(columns), min(rows)
+    right = max(columns) + 1 if sizes is None else max(map(sum, zip(columns, sizes)))
+    lower = max(rows) + 1 if sizes is None else max(map(sum, zip(rows, sizes)))
+    width = right - left
+
+    parts, names = swatches(tables), table.object_ids
+    colors = [
+        parts.get((names[object_id], userdata), UNMAPPED)
+        for object_id, userdata in zip(table.object_id_index, table.userdata)
+    ]
+    canvas = bytearray([BACKGROUND]) * (width * (lower - upper))
+    order = sorted(range(len(table)), key=depths.__getitem__)
+    if sizes is None:
+        cells = [(rows[i] - upper) * width + columns[i] - left for i in order]
+        for cell, color in zip(cells, map(colors.__getitem__, order)):
+            canvas[cell] = color
+    else:
+        for i in order:
+            k, start = sizes[i], (rows[i] - upper) * width + columns[i] - left
+            for cell in range(start, start + k * width, width):
+                canvas[cell : cell + k] = bytes([colors[i]]) * k
+    image = Image.frombytes("P", (width, lower - upper), bytes(canvas))
+    image.putpalette(preview_palette())
+    image.info["transparency"] = BACKGROUND
+    return image
+
+
+def generated_objects(table: ObjectTable, tag: str | None = None) -> ObjectTable:
+    """The rows tagged with tag, or every generated row (see object_index) by default."""
+    if tag is not None:
+        wanted = bytes(int(message == tag) for message in table.messages)
+    else:
+        wanted = bytes(
+            int(message.startswith(GENERATED_TAG_PREFIX)) for message in table.messages
+        )
+    return table.filter(map((wanted or b"\x00").__getitem__, table.message_index))
+
+
+def render_base(
+    base_json,
+    tag: str | None = None,
+    profile=DEFAULT_PROFILE_PATH,
+    placement: Placement = DEFAULT_PLACEMENT,
+) -> Image.Image:
+    """Renders the generated objects of a base export (see rasterize)."""
+    document = read_base_snapshot(base_json)
+    validate_base_document(document)
+    table = generated_objects(document.object_table(), tag)
+    return rasterize(
+        table,
+        NMSObject(document.base_computer),
+        load_mapping_profile(profile),
+        placement,
+    )
+
+
+def save_preview(image: Image.Image, output_file, zoom: int = 1):
+    """Writes the preview as a PNG, each tile zoom pixels wide."""
+    if zoom > 1:
+        image = image.resize(
+            (image.width * zoom, image.height * zoom), Image.Resampling.NEAREST
+        )
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    image.save(output_file, format="PNG", transparency=BACKGROUND)
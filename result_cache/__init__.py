@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import NamedTuple
+
+from model import ObjectTable
+from palette import cache_dir
+
+RESULT_CACHE_VERSION = 2
+# Least recently used entries are evicted once the cache grows past this
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+# Planes entries: magic, format version, width, height, whether a mask follows the plane
+PLANES_HEADER = struct.Struct("<4sHHHB")
+PLANES_MAGIC = b"NMSP"
+# Objects entries: magic, format version, pixel and tile counts, followed by a table of
+# the byte lengths of the sections, the table's columns and its JSON encoded pools
+OBJECTS_HEADER = struct.Struct("<4sHQQ")
+OBJECTS_MAGIC = b"NMSO"
+OBJECTS_SECTIONS = (
+    ("object_ids", None),
+    ("object_id_index", "H"),
+    ("positions", "d"),
+    ("up", "d"),
+    ("at", "d"),
+    ("timestamps", "q"),
+    ("userdata", "q"),
+    ("messages", None),
+    ("message_index", "H"),
+    ("extras", None),
+    ("missing", None),
+)
+OBJECTS_TABLE = struct.Struct(f"<{len(OBJECTS_SECTIONS)}Q")
+
+
+class CachedPlanes(NamedTuple):
+    """The palette index plane and transparency mask of a decoded sprite."""
+
+    size: tuple
+    index_plane: bytes
+    mask: bytes | None
+
+
+class CachedObjects(NamedTuple):
+    """A generated object table along with the pixel and tile counts of its sprite."""
+
+    pixels: int
+    tiles: int
+    objects: ObjectTable
+
+
+def _digest(*parts: bytes) -> str:
+    digest = hashlib.sha256(str(RESULT_CACHE_VERSION).encode())
+    for part in parts:
+        # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()[:32]
+
+
+class ResultCache(object):
+    """A content-addressed cache of intermediate generation results on disk.
+
+    Planes only depend on the sprite and the palette, object tables also depend on the
+    mapping profile, the base computer and the generation parameters, so each is stored
+    under its own key and changing a later input reuses the earlier results."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self.directory = Path(directory or cache_dir() / "results")
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def planes_key(
+        sprite_data: bytes, crop: tuple | None, palette: bytes, check_size=True
+    ) -> str:
+        # Sprites opened without the size check get their own entries, so a hit never
+        # lets a sprite that is too large skip it
+        return _digest(
+            b"planes", sprite_data, repr((crop, check_size)).encode(), palette
+        )
+
+    @staticmethod
+    def objects_key(
+        planes_key: str, profile_data: bytes, anchor: dict, parameters: dict
+    ) -> str:
+        return _digest(
+            b"objects",
+            planes_key.encode(),
+            profile_data,
+            json.dumps(anchor, sort_keys=True).encode(),
+            json.dumps(parameters, sort_keys=True).encode(),
+        )
+
+    def load_planes(self, key: str) -> CachedPlanes | None:
+        data = self._read(f"planes-{key}.bin")
+        if data is None or len(data) < PLANES_HEADER.size:
+            return None
+        magic, version, width, height, has_mask = PLANES_HEADER.unpack_from(data)
+        pixels = width * height
+        if (
+            magic != PLANES_MAGIC
+            or version != RESULT_CACHE_VERSION
+            or len(data) != PLANES_HEADER.size + pixels * (1 + has_mask)
+        ):
+            return None
+        plane = data[PLANES_HEADER.size : PLANES_HEADER.size + pixels]
+        mask = data[PLANES_HEADER.size + pixels :] if has_mask else None
+        return CachedPlanes((width, height), plane, mask)
+
+    def store_planes(self, key: str, planes: CachedPlanes):
+        width, height = planes.size
+        header = PLANES_HEADER.pack(
+            PLANES_MAGIC, RESULT_CACHE_VERSION, width, height, planes.mask is not None
+        )
+        self._write(
+            f"planes-{key}.bin", header + planes.index_plane + (planes.mask or b"")
+        )
+
+    def load_objects(self, key: str) -> CachedObjects | None:
+        data = self._read(f"objects-{key}.bin")
+        if data is None or len(data) < OBJECTS_HEADER.size + OBJECTS_TABLE.size:
+            return None
+        magic, version, pixels, tiles = OBJECTS_HEADER.unpack_from(data)
+        lengths = OBJECTS_TABLE.unpack_from(data, OBJECTS_HEADER.size)
+        offset = OBJECTS_HEADER.size + OBJECTS_TABLE.size
+        if (
+            magic != OBJECTS_MAGIC
+            or version != RESULT_CACHE_VERSION
+            or len(data) != offset + sum(lengths)
+        ):
+            return None
+
+        table = ObjectTable()
+        try:
+            for (name, typecode), length in zip(OBJECTS_SECTIONS, lengths):
+                section = data[offset : offset + length]
+                offset += length
+                if typecode is None:
+                    setattr(table, name, json.loads(section))
+                else:
+                    column = array(typecode)
+                    column.frombytes(section)
+                    setattr(table, name, column)
+            table.extras = {int(row): values for row, values in table.extras.items()}
+            table.missing = {int(row): keys for row, keys in table.missing.items()}
+            table.check_columns()
+        except ValueError:
+            return None
+        return CachedObjects(pixels, tiles, table)
+
+    def store_objects(self, key: str, cached_objects: CachedObjects):
+        table = cached_objects.objects
+        sections = [
+            json.dumps(getattr(table, name)).encode()
+            if typecode is None
+            else getattr(table, name).tobytes()
+            for name, typecode in OBJECTS_SECTIONS
+        ]
+        header = OBJECTS_HEADER.pack(
+            OBJECTS_MAGIC,
+            RESULT_CACHE_VERSION,
+            cached_objects.pixels,
+            cached_objects.tiles,
+        )
+        lengths = OBJECTS_TABLE.pack(*map(len, sections))
+        self._write(f"objects-{key}.bin", b"".join([header, lengths, *sections]))
+
+    def _read(self, name: str) -> bytes | None:
+        path = self.directory / name
+        try:
+            data = path.read_bytes()
+            self._touch(path)
+        except OSError:
+            return None
+        return data
+
+    def _write(self, name: str, data: bytes):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / name
+        # Write to a temporary file first so concurrent runs never see a partial entry,
+        # one per process and thread so concurrent writers do not share it
+        temp_path = path.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+        self._touch(path)
+        self.evict()
+
+    @staticmethod
+    def _touch(path: Path):
+        # The modification time doubles as the last use time for eviction. It is set
+        # explicitly because file system timestamps can be coarser than a nanosecond.
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def entries(self) -> list:
+        """(last use time, size, path) of every entry, least recently used first."""
+        entries = []
+        for path in self.directory.glob("*-*.*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
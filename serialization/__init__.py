@@ -0,0 +1,299 @@
+import gzip
+import json
+import re
+from array import array
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, TextIO
+
+from constants import BASE_FLAG_ID
+from model import ObjectTable
+
+# Number of encoded array elements joined into a single write
+WRITE_BATCH_SIZE = 256
+
+
+def open_output(file_path, compress: bool | None = None) -> TextIO:
+    """Opens the output file for writing text. The output is gzip compressed when compress
+    is True, or when compress is None and the path ends with .gz"""
+    if compress is None:
+        compress = str(file_path).endswith(".gz")
+    if compress:
+        return gzip.open(file_path, "wt", encoding="utf-8")
+    return open(file_path, "w", encoding="utf-8")
+
+
+def _encoder(indent: int | None) -> json.JSONEncoder:
+    if indent is None:
+        return json.JSONEncoder(separators=(",", ":"))
+    return json.JSONEncoder(indent=indent)
+
+
+def _encode_nested(encoder: json.JSONEncoder, value, depth: int) -> str:
+    """Encodes a value that sits depth levels deep in the document. Strings never contain a
+    raw newline once encoded, so indenting every line break is safe."""
+    text = encoder.encode(value)
+    if encoder.indent is None:
+        return text
+    return text.replace("\n", "\n" + " " * (encoder.indent * depth))
+
+
+def encode_objects(objects: Iterable[dict], indent: int | None = 4) -> List[str]:
+    """Encodes objects exactly like write_base_document does, so objects written into
+    many documents (see animation) are only encoded once."""
+    encoder = _encoder(indent)
+    return [_encode_nested(encoder, obj, depth=2) for obj in objects]
+
+
+def _write_array(
+    outfile: TextIO, encoder: json.JSONEncoder, items: Iterator, depth: int
+):
+    """Writes a JSON array one batch of elements at a time, so only a batch worth of
+    encoded text is held in memory."""
+    if encoder.indent is None:
+        opening, separator, closing = "[", ",", "]"
+    else:
+        inner = "\n" + " " * (encoder.indent * (depth + 1))
+        opening = "[" + inner
+        separator = "," + inner
+        closing = "\n" + " " * (encoder.indent * depth) + "]"
+
+    first = True
+    while batch := list(islice(items, WRITE_BATCH_SIZE)):
+        outfile.write(opening if first else separator)
+        outfile.write(
+            separator.join(_encode_nested(encoder, item, depth + 1) for item in batch)
+        )
+        first = False
+    outfile.write("[]" if first else closing)
+
+
+def write_objects(outfile: TextIO, generated_objects: Iterable = (), indent=4):
+    """Writes only the objects, as a top-level JSON array formatted like the Objects
+    array write_base would write."""
+    _write_array(outfile, _encoder(indent), iter(generated_objects), 0)
+
+
+def write_base(
+    outfile: TextIO,
+    base_data: dict,
+    generated_objects: Iterable[dict] = (),
+    indent: int | None = 4,
+):
+    """Streams the base data to outfile, appending generated_objects to its Objects array
+    as they are produced. Neither the generated objects nor the encoded document are
+    collected in memory first. The output is identical to json.dump with the same indent;
+    indent=None writes compact JSON without any whitespace."""
+    encoder = _encoder(indent)
+    if indent is None:
+        opening, separator, key_separator, closing = "{", ",", ":", "}"
+    else:
+        opening = "{\n" + " " * indent
+        separator = ",\n" + " " * indent
+        key_separator = ": "
+        closing = "\n}"
+
+    if "Objects" not in base_data:
+        base_data = {**base_data, "Objects": []}
+
+    outfile.write(opening if base_data else "{")
+    for i, (key, value) in enumerate(base_data.items()):
+        if i:
+            outfile.write(separator)
+        outfile.write(encoder.encode(key) + key_separator)
+        if key == "Objects":
+            _write_array(outfile, encoder, chain(value, generated_objects), depth=1)
+        else:
+            outfile.write(_encode_nested(encoder, value, depth=1))
+    outfile.write(closing)
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Splits JSON text into the text between strings and the strings themselves
+_STRINGS = re.compile(r'("(?:[^"\\]|\\.)*")')
+_DROP_WHITESPACE = {ord(char): None for char in " \t\n\r"}
+_decoder = json.JSONDecoder()
+
+
+def _compact_json(text: str) -> str:
+    """Drops the whitespace between the tokens of JSON text, leaving strings as they
+    are, so copied text matches what json.dump writes with separators=(",", ":")."""
+    parts = _STRINGS.split(text)
+    parts[::2] = [part.translate(_DROP_WHITESPACE) for part in parts[::2]]
+    return "".join(parts)
+
+
+class BaseDocument(object):
+    """A base export that has been scanned, but not parsed into Python objects.
+
+    Only the top level of the document and the bounds of the Objects array are located;
+    the text itself is kept as is so it can be passed through to the output untouched.
+    object_spans holds a (start, end) pair of text offsets for every element of Objects."""
+
+    def __init__(self, text: str):
+        self.text = text
+        # Offsets of the opening "[" and closing "]" of the Objects array, if found
+        self.objects_start: int | None = None
+        self.objects_end: int | None = None
+        self.object_spans = array("q")
+        self.base_computer: dict | None = None
+        self.base_computer_index: int | None = None
+        # The elements of Objects as an ObjectTable, see object_table()
+        self.table: ObjectTable | None = None
+
+    @property
+    def object_count(self) -> int:
+        return len(self.object_spans) // 2
+
+    def contains(self, fragment: str) -> bool:
+        """Whether fragment occurs anywhere in the document's text."""
+        return fragment in self.text
+
+    def iter_objects(self) -> Iterator[dict]:
+        """Decodes the existing objects one at a time."""
+        spans = iter(self.object_spans)
+        for start, end in zip(spans, spans):
+            yield _decoder.raw_decode(self.text, start)[0]
+
+    def object_table(self) -> ObjectTable:
+        """The existing objects as an ObjectTable, decoded on first use unless the
+        document was loaded with one (see base_snapshot)."""
+        if self.table is None:
+            self.table = ObjectTable.from_dicts(self.iter_objects())
+        return self.table
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _expect(text: str, pos: int, token: str) -> int:
+    if not text.startswith(token, pos):
+        raise json.JSONDecodeError(f"Expecting '{token}'", text, pos)
+    return _skip_whitespace(text, pos + 1)
+
+
+def _scan_objects(document: BaseDocument, pos: int) -> int:
+    """Scans the Objects array starting at its "[", decoding one element at a time to find
+    its bounds and the base computer. Returns the offset just past the closing "]"."""
+    text = document.text
+    document.objects_start = pos
+    pos = _expect(text, pos, "[")
+    if text.startswith("]", pos):
+        document.objects_end = pos
+        return pos + 1
+
+    while True:
+        start = pos
+        element, pos = _decoder.raw_decode(text, pos)
+        if (
+            document.base_computer is None
+            and isinstance(element, dict)
+            and element.get("ObjectID") == BASE_FLAG_ID
+        ):
+            document.base_computer = element
+            document.base_computer_index = document.object_count
+        document.object_spans.extend((start, pos))
+        pos = _skip_whitespace(text, pos)
+        if text.startswith("]", pos):
+            document.objects_end = pos
+            return pos + 1
+        pos = _expect(text, pos, ",")
+
+
+def parse_base_document(text: str) -> BaseDocument:
+    """Scans base export text that is already in memory. Each top-level value other than
+    the Objects array is decoded on its own to find where it ends, then dropped, and the
+    elements of Objects are decoded one at a time in the same way. Only the offsets, the
+    base computer and the text itself are kept, never a tree of the whole document."""
+    document = BaseDocument(text)
+    pos = _expect(text, _skip_whitespace(text, 0), "{")
+    if text.startswith("}", pos):
+        return document
+
+    while True:
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _expect(text, _skip_whitespace(text, pos), ":")
+        if key == "Objects" and document.objects_start is None:
+            pos = _scan_objects(document, pos)
+        else:
+            pos = _decoder.raw_decode(text, pos)[1]
+        pos = _skip_whitespace(text, pos)
+        if text.startswith("}", pos):
+            return document
+        pos = _expect(text, pos, ",")
+
+
+def read_base_document(file_path) -> BaseDocument:
+    """Reads and scans a base export, which may be gzip compressed (.gz). The whole file
+    is read into memory, since its text is copied through when the output is written."""
+    opener = gzip.open if str(file_path).endswith(".gz") else open
+    with opener(file_path, "rt", encoding="utf-8-sig") as infile:
+        return parse_base_document(infile.read())
+
+
+def write_base_document(
+    outfile: TextIO,
+    document: BaseDocument,
+    generated_objects: Iterable[dict] = (),
+    indent: int | None = 4,
+    removed: Iterable[int] = (),
+    encoded: bool = False,
+):
+    """Writes the scanned document with generated_objects appended to its Objects array,
+    leaving out the existing elements listed in removed. Everything else from the
+    original document is copied through byte for byte; only the new elements are
+    encoded, using indent. With indent None the copied text is compacted as well, so
+    the whole output is compact however the original was formatted. With encoded,
+    generated_objects are already encoded with encode_objects and the same indent."""
+    if document.objects_end is None:
+        raise ValueError("The base document has no Objects array")
+
+    text = document.text
+    encoder = _encoder(indent)
+    spans = document.object_spans
+    if indent is None:
+        separator = ","
+        copy = _compact_json
+    else:
+        separator = ",\n" + " " * (2 * indent)
+        copy = str
+
+    removed = set(removed)
+    kept = [row for row in range(document.object_count) if row not in removed]
+    if removed and kept:
+        # Copy the kept elements one at a time, joined like the new ones
+        outfile.write(copy(text[: spans[0]]))
+        outfile.write(
+            separator.join(
+                copy(text[spans[2 * row] : spans[2 * row + 1]]) for row in kept
+            )
+        )
+        insert_at = spans[-1]
+    elif kept:
+        # Insert the new elements right after the last existing one
+        insert_at = spans[-1]
+        outfile.write(copy(text[:insert_at]))
+    else:
+        insert_at = document.objects_start + 1
+        outfile.write(copy(text[:insert_at]))
+    first_separator = "," if kept else ""
+    if indent is not None:
+        first_separator += separator[1:]
+
+    generated_objects = iter(generated_objects)
+    first = True
+    while batch := list(islice(generated_objects, WRITE_BATCH_SIZE)):
+        outfile.write(first_separator if first else separator)
+        if not encoded:
+            batch = [_encode_nested(encoder, item, depth=2) for item in batch]
+        outfile.write(separator.join(batch))
+        first = False
+    if kept or (first and not document.object_count):
+        outfile.write(copy(text[insert_at:]))
+    elif first:
+        # Every element was removed, so the array is written empty like json.dump does
+        outfile.write("]" + copy(text[document.objects_end + 1 :]))
+    else:
+        # The array was empty, so the whitespace before "]" has to be rebuilt
+        closing = "" if indent is None else "\n" + " " * indent
+        outfile.write(closing + copy(text[document.objects_end :]))
@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import io
+import json
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from constants import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_PROFILE_PATH, MATCHERS
+from mapping import load_mapping_profile
+from model import NMSObject
+from placement import Placement
+from pipeline import (
+    GenerationJob,
+    SpriteImage,
+    job_tag,
+    load_base,
+    map_sprite,
+    warm_caches,
+)
+from serialization import BaseDocument, write_base_document, write_objects
+from validation import (
+    IncompatibleImageError,
+    ImageTooBigError,
+    InvalidBaseDataError,
+    InvalidImageType,
+    InvalidMappingProfileError,
+    InvalidServiceRequestError,
+)
+
+logger = logging.getLogger(__name__)
+# Largest request body (the sprite) accepted, sprites are at most a few kilobytes
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+# Parsed bases kept warm in every worker, most recently used first
+BASE_CACHE_SIZE = 8
+OUTPUT_FORMATS = ("base", "objects")
+# Name the generated objects are tagged with when the request does not give one
+DEFAULT_TAG = "sprite"
+
+# Errors caused by the request (bad sprite, base or parameters) rather than the service
+CLIENT_ERRORS = (
+    OSError,
+    IncompatibleImageError,
+    ImageTooBigError,
+    InvalidBaseDataError,
+    InvalidImageType,
+    InvalidMappingProfileError,
+    InvalidServiceRequestError,
+)
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Server Error"}
+
+
+@functools.lru_cache(maxsize=BASE_CACHE_SIZE)
+def _load_cached_base(base_json: str, mtime_ns: int, size: int) -> BaseDocument:
+    """Keyed by modification time and size as well, so an edited base is read again."""
+    return load_base(base_json)
+
+
+def cached_base(base_json: str) -> BaseDocument:
+    """Reads and validates a base export, reusing the parsed document while the file is
+    unchanged."""
+    stat = os.stat(base_json)
+    return _load_cached_base(os.path.abspath(base_json), stat.st_mtime_ns, stat.st_size)
+
+
+def parse_job_request(query: str) -> dict:
+    """Reads the generation parameters from a request's query string:
+
+    base_json   path of the base export on the server (required)
+    z_up        vertical adjustment of the tiles (required)
+    profile     mapping profile path, coalesce, compact, plane, rotation, scale and
+                matcher as in the CLI
+    output      "base" for the whole base JSON (default) or "objects" for only the
+                generated objects, as a JSON array
+    tag         name the generated objects are tagged with, like the CLI's --tag
+                (DEFAULT_TAG by default, the sprite has no file name)
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    try:
+        request = {
+            "base_json": params.pop("base_json"),
+            "z_up": float(params.pop("z_up")),
+            "profile": params.pop("profile", DEFAULT_PROFILE_PATH),
+            "coalesce": params.pop("coalesce", "") in ("1", "true", "yes"),
+            "compact": params.pop("compact", "") in ("1", "true", "yes"),
+            "output": params.pop("output", "base"),
+            "plane": params.pop("plane", "floor"),
+            "rotation": float(params.pop("rotation", 0.0)),
+            "scale": float(params.pop("scale", 1.0)),
+            "matcher": params.pop("matcher", "rgb"),
+            "tag": params.pop("tag", DEFAULT_TAG),
+        }
+        Placement(request["plane"], request["rotation"], request["scale"])
+    except KeyError as e:
+        raise InvalidServiceRequestError(f"Missing parameter {e}") from e
+    except ValueError as e:
+        raise InvalidServiceRequestError(f"Invalid parameter: {e}") from e
+    if params:
+        raise InvalidServiceRequestError(f"Unknown parameters {sorted(params)}")
+    if request["matcher"] not in MATCHERS:
+        raise InvalidServiceRequestError(f"Unknown color matcher {request['matcher']}")
+    if request["output"] not in OUTPUT_FORMATS:
+        raise InvalidServiceRequestError(f"Unknown output format {request['output']}")
+    return request
+
+
+def generate(request: dict, sprite_data: bytes) -> bytes:
+    """Runs one job from the service in a worker process and returns the response body."""
+    base_document = cached_base(request["base_json"])
+    job = GenerationJob(
+        base_json=request["base_json"],
+        sprite_file="<request>",
+        z_up=request["z_up"],
+        output_file="<response>",
+        profile=request["profile"],
+        coalesce=request["coalesce"],
+        plane=request["plane"],
+        rotation=request["rotation"],
+        scale=request["scale"],
+        matcher=request["matcher"],
+        tag=request["tag"],
+    )
+    sprite = SpriteImage.open(io.BytesIO(sprite_data))
+    objects, _ = map_sprite(
+        sprite,
+        NMSObject(base_document.base_computer),
+        load_mapping_profile(job.profile),
+        job,
+    )
+    objects.set_message(job_tag(job))
+
+    indent = None if request["compact"] else 4
+    outfile = io.StringIO()
+    if request["output"] == "objects":
+        write_objects(outfile, objects.iter_dicts(), indent=indent)
+    else:
+        write_base_document(outfile, base_document, objects.iter_dicts(), indent=indent)
+    return outfile.getvalue().encode()
+
+
+def _error_body(error: Exception) -> bytes:
+    return json.dumps({"error": f"{type(error).__name__}: {error}"}).encode()
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple:
+    """Reads an HTTP/1.1 request, returning its method, target and body."""
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) != 3:
+        raise InvalidServiceRequestError("Malformed request line")
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_REQUEST_BYTES:
+        raise InvalidServiceRequestError("Request body is too large")
+    body = await reader.readexactly(length)
+    return request_line[0], request_line[1], body
+
+
+async def _handle_connection(
+    executor: Executor, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+):
+    """Answers one request per connection. Generation runs on the executor, so the event
+    loop keeps accepting requests while workers are busy."""
+    try:
+        method, target, body = await _read_request(reader)
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/status":
+            status, response = 200, b'{"status": "ok"}'
+        elif method == "POST" and url.path == "/generate":
+            request = parse_job_request(url.query)
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(executor, generate, request, body)
+            status = 200
+        else:
+            status, response = 404, _error_body(LookupError(f"{method} {url.path}"))
+    except (*CLIENT_ERRORS, ValueError, asyncio.IncompleteReadError) as e:
+        status, response = 400, _error_body(e)
+    except Exception as e:
+        logger.exception("Generation request failed")
+        status, response = 500, _error_body(e)
+
+    writer.write(
+        f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(response)}\r\n"
+        "Connection: close\r\n\r\n".encode("latin-1")
+    )
+    writer.write(response)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_server(
+    executor: Executor, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT
+) -> asyncio.Server:
+    """Starts listening for HTTP requests on a Unix socket, or on host:port when no
+    socket path is given."""
+    handler = functools.partial(_handle_connection, executor)
+    if socket_path is not None:
+        return await asyncio.start_unix_server(
+            handler, socket_path, limit=MAX_REQUEST_BYTES
+        )
+    return await asyncio.start_server(handler, host, port, limit=MAX_REQUEST_BYTES)
+
+
+async def serve(
+    socket_path=None,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    max_workers=None,
+    profiles=(DEFAULT_PROFILE_PATH,),
+):
+    """Runs the generation service until cancelled. Every worker process loads the
+    palette and compiles the profiles once when it starts and keeps recently used bases
+    parsed, so requests only pay for their own sprite."""
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=warm_caches, initargs=(profiles,)
+    ) as executor:
+        server = await start_server(executor, socket_path, host, port)
+        async with server:
+            for address in server.sockets:
+                logger.info("Listening on %s", address.getsockname())
+            await server.serve_forever()
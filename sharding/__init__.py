@@ -0,0 +1,106 @@
+import dataclasses
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
+from constants import MAX_BASE_OBJS
+from mapping import tile_plane
+from pipeline import GenerationJob, load_base, load_sprite, run_job
+from validation import ImageTooBigError
+
+logger = logging.getLogger(__name__)
+
+
+def plan_shards(tiles: bytes, width: int, budgets: List[int]) -> List[tuple]:
+    """Splits a sprite into horizontal bands, one per budget, where band i holds at most
+    budgets[i] tiles. tiles has one byte per pixel, 1 where a tile is placed, so only
+    pixels that actually become objects count. Returns (left, upper, right, lower) boxes."""
+    height = len(tiles) // width
+    row_tiles = [
+        tiles.count(1, row * width, (row + 1) * width) for row in range(height)
+    ]
+
+    boxes = []
+    upper = 0
+    band_tiles = 0
+    for row, count in enumerate(row_tiles):
+        while band_tiles + count > budgets[len(boxes)]:
+            if row == upper:
+                raise ImageTooBigError(
+                    f"Row {row} has more tiles than base {len(boxes)} has room for"
+                )
+            boxes.append((0, upper, width, row))
+            if len(boxes) == len(budgets):
+                raise ImageTooBigError(
+                    f"The sprite needs more than the {len(budgets)} bases given"
+                )
+            upper, band_tiles = row, 0
+        band_tiles += count
+    boxes.append((0, upper, width, height))
+    return boxes
+
+
+def sibling_path(output_file, label: str, suffixes: str | None = None) -> Path:
+    """A file next to output_file with label added before all of its suffixes, so
+    out.json.gz becomes out.<label>.json.gz. suffixes replaces the original ones."""
+    output_file = Path(output_file)
+    original = "".join(output_file.suffixes)
+    stem = output_file.name[: len(output_file.name) - len(original)]
+    suffixes = original if suffixes is None else suffixes
+    return output_file.with_name(f"{stem}.{label}{suffixes}")
+
+
+def shard_output_path(output_file, index: int) -> Path:
+    """out.json becomes out.shard0.json, out.shard1.json, ..."""
+    return sibling_path(output_file, f"shard{index}")
+
+
+def manifest_path(output_file) -> Path:
+    return sibling_path(output_file, "manifest", ".json")
+
+
+def generate_shards(
+    job: GenerationJob, base_files: List[str], max_workers=None
+) -> dict:
+    """Generates a sprite that is too big for one base across several bases. Each shard is
+    placed at the base computer of its own base, and the shards are generated in parallel
+    in a process pool. Writes one output base per shard plus a manifest describing how the
+    shards fit together, and returns the manifest."""
+    budgets = [
+        MAX_BASE_OBJS - load_base(base_file).object_count for base_file in base_files
+    ]
+    image, alpha_mask = load_sprite(job.sprite_file, check_size=False)
+    boxes = plan_shards(tile_plane(image, alpha_mask), image.width, budgets)
+
+    shard_jobs = [
+        dataclasses.replace(
+            job,
+            base_json=str(base_file),
+            output_file=str(shard_output_path(job.output_file, i)),
+            crop=box,
+        )
+        for i, (base_file, box) in enumerate(zip(base_files, boxes))
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run_job, shard_jobs))
+
+    manifest = {
+        "sprite_file": str(job.sprite_file),
+        "z_up": job.z_up,
+        "shards": [
+            {
+                "index": i,
+                "base_json": shard_job.base_json,
+                "output_file": result.output_file,
+                "box": list(shard_job.crop),
+                "objects": result.objects,
+            }
+            for i, (shard_job, result) in enumerate(zip(shard_jobs, results))
+        ],
+    }
+    with open(manifest_path(job.output_file), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    logger.debug("Generated %s shards for %s", len(results), job.sprite_file)
+    return manifest
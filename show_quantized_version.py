@@ -1,15 +1,20 @@
-from palette import load_nes_palette
+import sys
+
+from palette import load_palette
 from PIL import Image
 
 
 def quantize_and_show(image_path):
     """
-    Converts the specified image to the NES color palette and displays it for troubleshooting
+    Converts the specified image to the NES color palette and displays it for troubleshooting.
+    To see the objects a sprite actually becomes, use nms-gen.py --preview instead
     """
     test_image = Image.open(image_path)
-    nes_palette = load_nes_palette()
-    test_image_nes = test_image.convert("RGB").quantize(palette=nes_palette)
+    test_image_nes = load_palette().quantize(test_image)
     test_image_nes.show()
 
 
-quantize_and_show("sprites/picard.png")
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        exit(f"Usage: {sys.argv[0]} sprite.png")
+    quantize_and_show(sys.argv[1])
@@ -0,0 +1,58 @@
+"""Shared fixtures for the benchmark suite.
+
+Benchmarks only run when selected with -m benchmark. Every benchmark records its timings
+in the session-wide results, which are written as JSON to NMS_GEN_BENCH_OUTPUT when the
+session ends, if it is set. When
+NMS_GEN_BENCH_BASELINE points at a previous results file, any stage that got slower than
+NMS_GEN_BENCH_TOLERANCE (default 1.5) times its baseline fails the benchmark. To update
+the stored baseline, copy a results file to tests/benchmark/baseline.json."""
+
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def benchmark_baseline() -> dict:
+    baseline_file = os.environ.get("NMS_GEN_BENCH_BASELINE")
+    if not baseline_file:
+        return {}
+    return json.loads(Path(baseline_file).read_text())["cases"]
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    results = {}
+    yield results
+    output_file = os.environ.get("NMS_GEN_BENCH_OUTPUT")
+    if not output_file:
+        return
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cases": results,
+    }
+    Path(output_file).write_text(json.dumps(report, indent=4, sort_keys=True))
+
+
+@pytest.fixture
+def record_benchmark(benchmark_results, benchmark_baseline):
+    """Records {stage: seconds} timings for a case and checks them against the baseline."""
+    tolerance = float(os.environ.get("NMS_GEN_BENCH_TOLERANCE", "1.5"))
+
+    def record(case: str, timings: dict, **details):
+        benchmark_results[case] = {"seconds": timings, **details}
+        baseline = benchmark_baseline.get(case, {}).get("seconds", {})
+        regressions = [
+            f"{stage}: {seconds * 1000:.2f}ms vs {baseline[stage] * 1000:.2f}ms"
+            for stage, seconds in timings.items()
+            if stage in baseline and seconds > baseline[stage] * tolerance
+        ]
+        assert not regressions, f"{case} regressed: " + ", ".join(regressions)
+
+    return record
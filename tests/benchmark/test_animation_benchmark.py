@@ -0,0 +1,61 @@
+import json
+import random
+import time
+
+import pytest
+from PIL import Image
+
+from animation import animate
+from pipeline import GenerationJob, warm_caches
+from tests.helpers import base_computer
+
+pytestmark = pytest.mark.benchmark
+
+FRAMES = 24
+SIZE = 54
+
+
+def moving_block() -> list:
+    """A 4 x 4 block walking across a gray background, 32 pixels change per frame."""
+    frames = []
+    for i in range(FRAMES):
+        frame = Image.new("RGB", (SIZE, SIZE), (124, 124, 124))
+        frame.paste((252, 252, 252), (2 * i, 20, 2 * i + 4, 24))
+        frames.append(frame)
+    return frames
+
+
+def noise() -> list:
+    """Every pixel of every frame drawn again at random."""
+    rng = random.Random(7)
+    return [
+        Image.frombytes("RGB", (SIZE, SIZE), rng.randbytes(3 * SIZE * SIZE))
+        for _ in range(FRAMES)
+    ]
+
+
+def test_animation_benchmark(tmp_path, record_benchmark):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps({"Objects": [base_computer]}))
+    # Compile the palette tables first, so the first animation does not pay for them
+    warm_caches()
+
+    timings = {}
+    for name, frames in [("block", moving_block()), ("noise", noise())]:
+        sprite_file = tmp_path / f"{name}.png"
+        frames[0].save(sprite_file, save_all=True, append_images=frames[1:])
+        job = GenerationJob(
+            base_json=str(base_file),
+            sprite_file=str(sprite_file),
+            z_up=0.0,
+            output_file=str(tmp_path / f"{name}.json"),
+            compact=True,
+            cache=False,
+        )
+        start = time.perf_counter()
+        animate(job, [sprite_file], max_workers=2)
+        timings[name] = time.perf_counter() - start
+
+    record_benchmark(f"animation/{FRAMES}x{SIZE}x{SIZE}", timings)
+    # Small changes between frames have to be cheaper than redrawing every frame
+    assert timings["block"] < timings["noise"]
@@ -0,0 +1,95 @@
+import io
+import random
+import time
+
+import pytest
+from PIL import Image
+
+from constants import MAX_BASE_OBJS
+from mapping import build_transparency_mask, sprite_data_to_table
+from model import NMSObject
+from palette import load_palette
+from serialization import write_base
+from tests.helpers import base_computer
+
+pytestmark = pytest.mark.benchmark
+
+REPEAT = 3
+SPRITES = (
+    "MarioSmallFrame1",
+    "mega_man_standing",
+    "link_sprite",
+    "samus_standing",
+    "picard",
+    "hank",
+)
+# Square sizes from tiny up to the object limit (54 x 54 is just under) and beyond it
+SYNTHETIC_SIZES = (8, 16, 32, 54, 64, 96)
+TRANSPARENCY_DENSITIES = (0.0, 0.5, 0.9)
+
+anchor = NMSObject(base_computer)
+base_data = {"Objects": [anchor.as_dict()]}
+
+
+def synthetic_sprite(size: int, transparency: float) -> Image.Image:
+    """A size x size RGBA sprite of random palette colors where roughly the transparency
+    fraction of the pixels is fully transparent. Seeded, so runs are comparable."""
+    rng = random.Random(size * 1000 + int(transparency * 100))
+    colors = load_palette().palette
+    pixels = bytearray()
+    for _ in range(size * size):
+        color = rng.randrange(len(colors) // 3)
+        alpha = 0 if rng.random() < transparency else 255
+        pixels.extend(colors[3 * color : 3 * color + 3])
+        pixels.append(alpha)
+    return Image.frombytes("RGBA", (size, size), bytes(pixels))
+
+
+def best_time(func, *args):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def serialize(table):
+    outfile = io.StringIO()
+    write_base(outfile, base_data, table.iter_dicts(), indent=None)
+    return outfile.getvalue()
+
+
+def benchmark_stages(image: Image.Image) -> tuple:
+    timings = {}
+    timings["mask"], mask = best_time(build_transparency_mask, image)
+    timings["quantize"], quantized = best_time(load_palette().quantize, image)
+    timings["map"], table = best_time(
+        lambda: sprite_data_to_table(quantized, anchor, transparency_mask=mask)
+    )
+    timings["serialize"], _ = best_time(serialize, table)
+    return timings, len(table)
+
+
+@pytest.mark.parametrize("sprite", SPRITES)
+def test_sprite_benchmark(sprite, record_benchmark):
+    with Image.open(f"sprites/{sprite}.png") as image:
+        image.load()
+    timings, objects = benchmark_stages(image)
+    record_benchmark(f"sprite/{sprite}", timings, pixels=image.width * image.height)
+    assert objects <= image.width * image.height
+
+
+@pytest.mark.parametrize("transparency", TRANSPARENCY_DENSITIES)
+@pytest.mark.parametrize("size", SYNTHETIC_SIZES)
+def test_synthetic_benchmark(size, transparency, record_benchmark):
+    image = synthetic_sprite(size, transparency)
+    timings, objects = benchmark_stages(image)
+    record_benchmark(
+        f"synthetic/{size}x{size}/{int(transparency * 100)}%",
+        timings,
+        pixels=size * size,
+        over_object_limit=size * size > MAX_BASE_OBJS,
+    )
+    if transparency == 0.0:
+        assert objects == size * size
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+from PIL import Image
+
+from mapping import load_mapping_profile, sprite_data_to_table
+from model import NMSObject
+from preview import rasterize
+from tests.helpers import base_computer
+
+pytestmark = pytest.mark.benchmark
+
+anchor = NMSObject(base_computer)
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_preview_benchmark(record_benchmark, coalesce):
+    # 60 x 50 = 3000 objects, the base object limit, cycling through all 64 colors
+    image = Image.new("P", (60, 50))
+    image.frombytes(bytes(i % 64 for i in range(60 * 50)))
+    tables = load_mapping_profile()
+    table = sprite_data_to_table(image, anchor, tables=tables, coalesce=coalesce)
+
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        rasterize(table, anchor, tables)
+        timings.append(time.perf_counter() - start)
+
+    seconds = min(timings)
+    record_benchmark(
+        f"preview/3000{'/coalesced' if coalesce else ''}",
+        {"render": seconds},
+        objects=len(table),
+    )
+    # Rendering has to be cheap enough to run after every generation
+    assert seconds < 0.1
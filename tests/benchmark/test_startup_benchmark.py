@@ -0,0 +1,52 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytestmark = pytest.mark.benchmark
+
+ROOT = Path(__file__).parents[2]
+# Modules the command line must not load before it runs a command
+HEAVY_MODULES = ("PIL", "asyncio", "concurrent", "multiprocessing", "pipeline")
+# Microseconds the command line may spend importing itself. Importing the generation
+# pipeline, the service and their dependencies up front took more than twice as long.
+IMPORT_BUDGET = 100_000
+
+
+def import_times(*args, returncode=0) -> dict:
+    """Runs python -X importtime with args and returns {module: cumulative microseconds}
+    for every module the run imported. The run has to exit with returncode."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == returncode, result.stderr[-2000:]
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "case, args, returncode",
+    [
+        ("help", ["--help"], 0),
+        ("compose-help", ["compose", "--help"], 0),
+        # Fails on the missing files, before anything is generated
+        ("missing-file", ["missing.json", "missing.png", "5"], 1),
+    ],
+)
+def test_startup_import_budget(record_benchmark, case, args, returncode):
+    times = import_times("-m", "cli", *args, returncode=returncode)
+    heavy = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+    assert not heavy, f"imported before running a command: {heavy}"
+
+    record_benchmark(f"startup/{case}", {"import": times["cli"] / 1e6})
+    assert times["cli"] < IMPORT_BUDGET
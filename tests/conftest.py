@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cache_dir(tmp_path_factory):
+    """Keeps compiled palettes, cached results and base snapshots out of the user's
+    cache. The directory is shared by the whole run, so palettes are compiled once."""
+    directory = tmp_path_factory.mktemp("cache")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("NMS_GEN_CACHE_DIR", str(directory))
+        yield directory
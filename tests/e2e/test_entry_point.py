@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tomllib
+from pathlib import Path
+
+from tests.helpers import base_computer
+
+ROOT = Path(__file__).parents[2]
+
+
+def run_entry_point(*args, cwd) -> subprocess.CompletedProcess:
+    """Runs the nms-gen console script the way an installed copy would: its modules on
+    the path and the working directory somewhere else."""
+    with open(ROOT / "pyproject.toml", "rb") as pyproject:
+        entry_point = tomllib.load(pyproject)["project"]["scripts"]["nms-gen"]
+    module, function = entry_point.split(":")
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    return subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys; from {module} import {function}; sys.exit({function}())",
+            *args,
+        ],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        # Callers assert on the return code, with stderr in the message
+        check=False,
+    )
+
+
+def test_entry_point_outside_the_repository(tmp_path):
+    shutil.copy(ROOT / "sprites" / "samus_standing.png", tmp_path)
+    (tmp_path / "base.json").write_text(json.dumps({"Objects": [base_computer]}))
+
+    result = run_entry_point(
+        "base.json", "samus_standing.png", "2", "--o", "out.json", cwd=tmp_path
+    )
+    assert result.returncode == 0, result.stderr
+    objects = json.loads((tmp_path / "out.json").read_text())["Objects"]
+    assert len(objects) > 1
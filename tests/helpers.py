@@ -0,0 +1,11 @@
+# The base computer of the test bases, at the origin and facing the world axes. Tests
+# that need it elsewhere override its Position: {**base_computer, "Position": [...]}
+base_computer = {
+    "ObjectID": "^BASE_FLAG",
+    "Position": [0.0, 0.0, 0.0],
+    "Up": [0.0, 1.0, 0.0],
+    "At": [0.0, 0.0, 1.0],
+    "Timestamp": 1755537617,
+    "UserData": 0,
+    "Message": "",
+}
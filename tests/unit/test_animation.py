@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from PIL import Image
+
+from animation import animate, diff_keys, frame_output_path, read_frames
+from object_index import generated_tag
+from pipeline import GenerationJob, run_job
+from sharding import manifest_path
+from tests.helpers import base_computer
+from voxels import EMPTY
+
+
+def sorted_objects(objects) -> list:
+    return sorted(objects, key=lambda obj: (obj["Position"], obj["ObjectID"]))
+
+
+def make_frames() -> list:
+    """Three frames of samus: as she is, with a block painted over, and with part of
+    her erased."""
+    with Image.open("sprites/samus_standing.png") as image:
+        first = image.convert("RGBA")
+    second = first.copy()
+    second.paste((252, 252, 252, 255), (4, 4, 8, 8))
+    third = second.copy()
+    third.paste((0, 0, 0, 0), (0, 20, first.width, 26))
+    return [first, second, third]
+
+
+def test_diff_keys():
+    previous = bytes([1, 2, EMPTY, 3, EMPTY])
+    current = bytes([1, 4, 5, EMPTY, EMPTY])
+    diff = diff_keys(previous, current)
+    assert diff.changed == bytes([0, 1, 1, 1, 0])
+    assert diff.added == bytes([0, 1, 1, 0, 0])
+    assert (diff.appeared, diff.disappeared, diff.swapped) == (1, 1, 1)
+    with pytest.raises(ValueError):
+        diff_keys(previous, current[1:])
+
+
+def test_read_frames(tmp_path):
+    frames = make_frames()
+    # A numbered sequence is read in number order, not name order
+    sequence = []
+    for number, frame in zip([2, 10, 1], frames):
+        frame.save(tmp_path / f"walk_{number}.png")
+        sequence.append(str(tmp_path / f"walk_{number}.png"))
+    assert read_frames(sequence) == [sequence[2], sequence[0], sequence[1]]
+
+    frames[0].save(tmp_path / "walk.png", save_all=True, append_images=frames[1:])
+    decoded = read_frames([tmp_path / "walk.png"])
+    assert [frame.tobytes() for frame in decoded] == [f.tobytes() for f in frames]
+    assert frame_output_path("out.json.gz", 3).name == "out.frame3.json.gz"
+
+
+def test_animate(tmp_path):
+    base_file = tmp_path / "base.json"
+    sign = {**base_computer, "ObjectID": "^SIGN", "Message": "hello"}
+    base_file.write_text(json.dumps({"Objects": [base_computer, sign]}))
+    frames = make_frames()
+    frames[0].save(tmp_path / "samus.png", save_all=True, append_images=frames[1:])
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file=str(tmp_path / "samus.png"),
+        z_up=2.0,
+        output_file=str(tmp_path / "out.json"),
+        cache=False,
+    )
+    manifest = animate(job, [job.sprite_file], max_workers=2)
+    assert manifest == json.loads(manifest_path(job.output_file).read_text())
+    assert manifest["tag"] == generated_tag("samus")
+    assert len(manifest["frames"]) == 3
+
+    previous = None
+    for index, (frame, entry) in enumerate(zip(frames, manifest["frames"])):
+        # Every variant holds exactly what generating its frame on its own gives
+        frame.save(tmp_path / "samus.png")
+        run_job(
+            GenerationJob(
+                base_json=str(base_file),
+                sprite_file=str(tmp_path / "samus.png"),
+                z_up=2.0,
+                output_file=str(tmp_path / "single.json"),
+                cache=False,
+            )
+        )
+        expected = json.loads((tmp_path / "single.json").read_text())["Objects"]
+        objects = json.loads(frame_output_path(job.output_file, index).read_text())
+        objects = objects["Objects"]
+        assert entry["output_file"] == str(frame_output_path(job.output_file, index))
+        assert sorted_objects(objects) == sorted_objects(expected)
+        assert entry["objects"] == len(objects) - 2
+
+        if previous is not None:
+            # Only the changed pixels come or go between variants
+            before = {json.dumps(obj) for obj in previous}
+            after = {json.dumps(obj) for obj in objects}
+            assert len(after - before) == entry["added"] + entry["swapped"]
+            assert len(before - after) == entry["removed"] + entry["swapped"]
+        previous = objects
+    assert manifest["frames"][1]["removed"] == 0
+    assert 0 < manifest["frames"][1]["added"] + manifest["frames"][1]["swapped"] <= 16
+    assert manifest["frames"][2]["added"] == 0
+
+    # Animating onto a variant with replace swaps its frame out instead of adding one
+    again = animate(
+        GenerationJob(
+            base_json=str(frame_output_path(job.output_file, 2)),
+            sprite_file=job.sprite_file,
+            z_up=2.0,
+            output_file=str(tmp_path / "again.json"),
+            tag="samus",
+            cache=False,
+            replace=True,
+        ),
+        [job.sprite_file],
+        max_workers=2,
+    )
+    assert again["removed"] == manifest["frames"][2]["objects"]
+    replaced = json.loads((tmp_path / "again.frame0.json").read_text())["Objects"]
+    assert sorted_objects(replaced) == sorted_objects(objects)
@@ -0,0 +1,116 @@
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+from base_snapshot import (
+    SnapshotCache,
+    decode_snapshot,
+    read_base_snapshot,
+    snapshot_source,
+)
+from serialization import read_base_document, write_base_document
+from tests import helpers
+
+base_computer = {**helpers.base_computer, "Position": [1.5, 0.0, -2.25]}
+base_data = {
+    "BaseVersion": 8,
+    "Name": "Café",
+    "Objects": [
+        {**base_computer, "ObjectID": "^F_FLOOR", "Message": "nms-gen:mario"},
+        base_computer,
+        {**base_computer, "ObjectID": "^SIGN", "Message": "hi", "Extra": [1, 2]},
+        {"ObjectID": "^SIGN", "Position": [0.0, 1.0, 0.0]},
+    ],
+    "UserData": 0,
+}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SnapshotCache(tmp_path / "cache")
+
+
+def snapshot_path(cache, source):
+    return cache.directory / cache.snapshot_name(source)
+
+
+def written(document) -> str:
+    output = io.StringIO()
+    write_base_document(output, document)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("name", ["base.json", "base.json.gz"])
+def test_snapshot_round_trip(tmp_path, cache, name):
+    source = tmp_path / name
+    text = json.dumps(base_data, indent=2, ensure_ascii=False)
+    data = text.encode()
+    source.write_bytes(gzip.compress(data) if name.endswith(".gz") else data)
+
+    first = read_base_snapshot(source, cache)
+    assert snapshot_path(cache, source).is_file()
+    loaded = cache.load(source)
+    expected = read_base_document(source)
+
+    assert loaded.text == text
+    assert written(loaded) == text
+    assert loaded.object_spans == expected.object_spans
+    assert (loaded.objects_start, loaded.objects_end) == (
+        expected.objects_start,
+        expected.objects_end,
+    )
+    assert loaded.base_computer == base_computer
+    assert loaded.base_computer_index == 1
+    assert loaded.table.to_dicts() == base_data["Objects"]
+    assert first.object_table().to_dicts() == base_data["Objects"]
+
+
+def test_snapshot_is_read_in_place(tmp_path, cache):
+    source = tmp_path / "base.json"
+    source.write_text(json.dumps(base_data, ensure_ascii=False))
+    read_base_snapshot(source, cache)
+
+    loaded = cache.load(source)
+    # Columns are views of the mapped snapshot, the text is decoded when written
+    assert isinstance(loaded.table.positions, memoryview)
+    assert loaded.table.positions[:3].tolist() == [1.5, 0.0, -2.25]
+    assert loaded.contains('"nms-gen:mario"')
+    assert not loaded.contains('"nms-gen:luigi"')
+    assert loaded.contains("Café")
+    assert written(loaded) == source.read_text()
+
+
+def test_snapshot_follows_the_source(tmp_path, cache):
+    source = tmp_path / "base.json"
+    source.write_text(json.dumps(base_data))
+    read_base_snapshot(source, cache)
+
+    # Only the time changed: the snapshot is still used, and refreshed
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.load(source).object_count == 4
+    snapshot = snapshot_path(cache, source).read_bytes()
+    assert snapshot_source(snapshot)[1] == source.stat().st_mtime_ns
+
+    # Same size, different content: the snapshot is stale
+    source.write_text(json.dumps({**base_data, "Name": "Cafè"}))
+    assert cache.load(source) is None
+    assert read_base_snapshot(source, cache).text == source.read_text()
+    assert cache.load(source) is not None
+
+
+def test_damaged_snapshot_is_rebuilt(tmp_path, cache):
+    source = tmp_path / "base.json"
+    source.write_text(json.dumps(base_data))
+    read_base_snapshot(source, cache)
+
+    path = snapshot_path(cache, source)
+    path.write_bytes(path.read_bytes()[:100])
+    assert cache.load(source) is None
+    with pytest.raises(ValueError):
+        decode_snapshot(b"NMSB" + bytes(200))
+    assert written(read_base_snapshot(source, cache)) == source.read_text()
+    assert cache.load(source) is not None
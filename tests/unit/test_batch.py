@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from batch import load_batch_manifest, run_batch
+from tests.helpers import base_computer
+from validation import InvalidBatchManifestError
+
+base_data = {"Objects": [base_computer]}
+sprites = Path("sprites").resolve()
+
+
+def test_load_batch_manifest(tmp_path):
+    manifest = tmp_path / "jobs.csv"
+    manifest.write_text(
+        "sprite_file,base_json,z_up,output_file,coalesce\n"
+        f"{sprites / 'link_sprite.png'},base.json,40,out/link.json,\n"
+        f"{sprites / 'picard.png'},base.json,12.5,out/picard.json,yes\n"
+    )
+    jobs = load_batch_manifest(manifest)
+    assert [job.z_up for job in jobs] == [40.0, 12.5]
+    assert [job.coalesce for job in jobs] == [False, True]
+    assert jobs[0].base_json == str(tmp_path / "base.json")
+    assert jobs[1].sprite_file == str(sprites / "picard.png")
+
+    json_manifest = tmp_path / "jobs.json"
+    json_manifest.write_text(
+        json.dumps([{"sprite_file": "a.png", "base_json": "b.json", "z_up": 1}])
+    )
+    with pytest.raises(InvalidBatchManifestError):
+        load_batch_manifest(json_manifest)
+
+
+def test_run_batch_continues_after_failure(tmp_path):
+    (tmp_path / "base.json").write_text(json.dumps(base_data))
+    jobs = [
+        {"sprite_file": str(sprites / sprite), "z_up": 40}
+        for sprite in ("link_sprite.png", "missing.png", "mega_man_standing.png")
+    ]
+    for i, job in enumerate(jobs):
+        job.update(base_json="base.json", output_file=f"out{i}.json")
+    manifest = tmp_path / "jobs.json"
+    manifest.write_text(json.dumps({"jobs": jobs}))
+
+    results = list(run_batch(load_batch_manifest(manifest), max_workers=2))
+    assert len(results) == 3
+    by_sprite = {Path(result.job.sprite_file).name: result for result in results}
+    assert not by_sprite["missing.png"].ok
+    assert "FileNotFoundError" in by_sprite["missing.png"].error
+    assert by_sprite["link_sprite.png"].ok
+    assert by_sprite["link_sprite.png"].objects == 256
+    assert (tmp_path / "out2.json").is_file()
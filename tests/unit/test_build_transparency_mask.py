@@ -48,3 +48,23 @@ def test_build_transparency_mask_with_non_rgba_image():
     rgb_test_image = test_image.convert("RGB")
     with pytest.raises(ValueError):
         build_transparency_mask(rgb_test_image)
+
+
+def test_build_transparency_mask_is_compact():
+    test_image = Image.open("sprites/mega_man_standing.png")
+    alpha_mask = build_transparency_mask(test_image)
+    assert isinstance(alpha_mask, bytes)
+    assert set(alpha_mask) <= {0, 1}
+
+
+def test_build_transparency_mask_with_threshold():
+    test_image = Image.new("RGBA", (4, 1))
+    for x, alpha in enumerate((0, 64, 128, 255)):
+        test_image.putpixel((x, 0), (255, 0, 0, alpha))
+
+    assert build_transparency_mask(test_image) == b"\x01\x00\x00\x00"
+    assert build_transparency_mask(test_image, 64) == b"\x01\x01\x00\x00"
+    assert build_transparency_mask(test_image, 254) == b"\x01\x01\x01\x00"
+
+    with pytest.raises(ValueError):
+        build_transparency_mask(test_image, alpha_threshold=256)
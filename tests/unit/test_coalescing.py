@@ -0,0 +1,84 @@
+from PIL import Image
+
+from coalescing import (
+    Rect,
+    coalesce_squares,
+    greedy_rectangles,
+    greedy_squares,
+    split_into_squares,
+)
+from mapping import build_transparency_mask, count_tiles, sprite_data_to_table
+from model import NMSObject
+from palette import load_palette
+
+anchor = NMSObject({"Position": [0, 0, 0], "Up": [0, 1, 0], "At": [0, 0, 1]})
+
+
+def covered_pixels(rects, width):
+    return sorted(
+        (rect.y + dy) * width + rect.x + dx
+        for rect in rects
+        for dy in range(rect.height)
+        for dx in range(rect.width)
+    )
+
+
+def test_greedy_rectangles():
+    plane = bytes([1, 1, 2, 1, 1, 2, 3, 3, 3])
+    assert greedy_rectangles(plane, b"\x01" * 9, 3) == [
+        Rect(0, 0, 2, 2, 1),
+        Rect(2, 0, 1, 2, 2),
+        Rect(0, 2, 3, 1, 3),
+    ]
+    # Masked pixels are never covered
+    keep = bytes([1, 1, 1, 1, 0, 1, 1, 1, 1])
+    rects = greedy_rectangles(plane, keep, 3)
+    assert covered_pixels(rects, 3) == [0, 1, 2, 3, 5, 6, 7, 8]
+
+
+def test_split_into_squares():
+    squares = list(split_into_squares(Rect(0, 0, 5, 2, 1)))
+    assert squares == [
+        Rect(0, 0, 2, 2, 1),
+        Rect(2, 0, 2, 2, 1),
+        Rect(4, 0, 1, 1, 1),
+        Rect(4, 1, 1, 1, 1),
+    ]
+
+
+def test_coalesced_sprite_covers_every_tile():
+    image = Image.open("sprites/mega_man_standing.png")
+    alpha_mask = build_transparency_mask(image)
+    quantized = load_palette().quantize(image)
+    keep = bytes(1 - masked for masked in alpha_mask)
+    squares = coalesce_squares(quantized.tobytes(), keep, image.width)
+    assert covered_pixels(squares, image.width) == [
+        i for i, kept in enumerate(keep) if kept
+    ]
+
+    table = sprite_data_to_table(
+        quantized, anchor, transparency_mask=alpha_mask, coalesce=True
+    )
+    assert len(table) == len(squares)
+    assert len(table) < count_tiles(quantized, transparency_mask=alpha_mask)
+
+
+def test_coalesced_square_is_scaled():
+    image = Image.new("P", (4, 4))
+    table = sprite_data_to_table(image, anchor, tile_spacing=5, coalesce=True)
+    assert len(table) == 1
+    assert table[0].position == [7.5, 0.0, 7.5]
+    assert table[0].up == [0.0, 4.0, 0.0]
+    assert table[0].at == [0.0, 0.0, 4.0]
+
+
+def test_greedy_squares():
+    plane = bytes([1, 1, 1, 1, 1, 1, 1, 1, 2])
+    assert greedy_squares(plane, b"\x01" * 9, 3) == [
+        Rect(0, 0, 2, 2, 1),
+        Rect(2, 0, 1, 1, 1),
+        Rect(2, 1, 1, 1, 1),
+        Rect(0, 2, 1, 1, 1),
+        Rect(1, 2, 1, 1, 1),
+        Rect(2, 2, 1, 1, 2),
+    ]
@@ -0,0 +1,173 @@
+import dataclasses
+import json
+import itertools
+
+import pytest
+from PIL import Image
+
+from composition import compose, pack_boxes, plan_composition
+from object_index import generated_tag
+from pipeline import GenerationJob, run_job
+from sharding import manifest_path
+from tests.helpers import base_computer
+
+
+def overlaps(a: tuple, b: tuple) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def test_pack_boxes():
+    sizes = [(16, 16), (23, 26), (8, 40), (54, 54), (1, 1)]
+    corners, (width, height) = pack_boxes(sizes, spacing=2)
+    # Boxes grown by the spacing never overlap, and all fit in the layout
+    boxes = [
+        (left, upper, left + w + 2, upper + h + 2)
+        for (left, upper), (w, h) in zip(corners, sizes)
+    ]
+    for a, b in itertools.combinations(boxes, 2):
+        assert not overlaps(a, b)
+    assert max(box[2] - 2 for box in boxes) == width
+    assert max(box[3] - 2 for box in boxes) == height
+    # The tallest box starts the first shelf
+    assert corners[3] == (0, 0)
+
+    assert pack_boxes([]) == ([], (0, 0))
+
+
+def test_plan_composition(tmp_path):
+    sprite_files = []
+    for i, size in enumerate([4, 10, 3]):
+        sprite_file = tmp_path / f"sprite{i}.png"
+        image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+        image.paste((0, 0, 0, 255), (0, 0, size, 2))
+        image.save(sprite_file)
+        sprite_files.append(str(sprite_file))
+
+    # Only the opaque rows count: 8, 20 and 6 pixels
+    slots, skipped = plan_composition(sprite_files, budget=15, spacing=1)
+    assert [slot.sprite_file for slot in slots] == [sprite_files[0], sprite_files[2]]
+    assert [slot.opaque for slot in slots] == [8, 6]
+    assert skipped == [sprite_files[1]]
+    # Stacked on two shelves of a 4 x 8 layout centred on the anchor
+    assert [(slot.left, slot.upper) for slot in slots] == [(-2, -4), (-2, 1)]
+
+
+def test_compose(tmp_path):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps({"Objects": [base_computer]}))
+    sprite_files = ["sprites/MarioSmallFrame1.png", "sprites/link_sprite.png"]
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file=sprite_files[0],
+        z_up=0.0,
+        output_file=str(tmp_path / "gallery.json"),
+        cache=False,
+    )
+    manifest = compose(job, sprite_files, spacing=2, max_workers=2)
+    assert manifest == json.loads(manifest_path(job.output_file).read_text())
+    assert manifest["skipped"] == []
+
+    objects = json.loads((tmp_path / "gallery.json").read_text())["Objects"]
+    assert len(objects) == 1 + sum(sprite["objects"] for sprite in manifest["sprites"])
+
+    for sprite in manifest["sprites"]:
+        left, upper, right, lower = sprite["box"]
+        # Each sprite places as many objects as a single run, all inside its box
+        single = run_job(
+            GenerationJob(
+                base_json=str(base_file),
+                sprite_file=sprite["sprite_file"],
+                z_up=0.0,
+                output_file=str(tmp_path / "single.json"),
+                cache=False,
+            )
+        )
+        tagged = [obj for obj in objects if obj["Message"] == sprite["tag"]]
+        assert len(tagged) == single.objects == sprite["objects"]
+        assert min(obj["Position"][0] for obj in tagged) >= 5 * left
+        assert max(obj["Position"][0] for obj in tagged) < 5 * right
+        assert min(obj["Position"][2] for obj in tagged) >= 5 * upper
+        assert max(obj["Position"][2] for obj in tagged) < 5 * lower
+    assert manifest["sprites"][1]["tag"] == generated_tag("link_sprite")
+
+    # Composing the same sprites again with replace leaves the base as it is
+    again = compose(
+        GenerationJob(
+            base_json=job.output_file,
+            sprite_file=sprite_files[0],
+            z_up=0.0,
+            output_file=str(tmp_path / "again.json"),
+            cache=False,
+            replace=True,
+        ),
+        sprite_files,
+        max_workers=2,
+    )
+    assert again["removed"] == 0
+    assert (tmp_path / "again.json").read_text() == (
+        tmp_path / "gallery.json"
+    ).read_text()
+
+
+def test_compose_budgets_large_sparse_sprites(tmp_path):
+    # 60 x 60 is over the object limit, but only its 100 opaque pixels are placed
+    sprite_file = tmp_path / "sparse.png"
+    image = Image.new("RGBA", (60, 60), (0, 0, 0, 0))
+    image.paste((252, 252, 252, 255), (0, 0, 10, 10))
+    image.save(sprite_file)
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps({"Objects": [base_computer]}))
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file=str(sprite_file),
+        z_up=0.0,
+        output_file=str(tmp_path / "out.json"),
+        cache=False,
+    )
+    manifest = compose(job, [str(sprite_file)], max_workers=1)
+    assert manifest["skipped"] == []
+    assert manifest["sprites"][0]["objects"] == 100
+
+
+def test_compose_repeated_sprites(tmp_path):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps({"Objects": [base_computer]}))
+    sprite_file = "sprites/MarioSmallFrame1.png"
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file=sprite_file,
+        z_up=0.0,
+        output_file=str(tmp_path / "twice.json"),
+        cache=False,
+        preview=str(tmp_path / "twice.png"),
+    )
+    manifest = compose(job, [sprite_file, sprite_file], spacing=2, max_workers=2)
+    # Each copy gets its own slot and objects
+    first, second = manifest["sprites"]
+    assert first["box"] != second["box"]
+    objects = json.loads((tmp_path / "twice.json").read_text())["Objects"]
+    assert len(objects) == 1 + first["objects"] + second["objects"]
+    # The preview shows the whole composition, both copies and the spacing between
+    with Image.open(tmp_path / "twice.png") as preview:
+        assert preview.height > 2 * (first["box"][3] - first["box"][1])
+
+    # Both copies share a tag, and are replaced together
+    again = compose(
+        dataclasses.replace(
+            job,
+            base_json=job.output_file,
+            output_file=str(tmp_path / "again.json"),
+            replace=True,
+            preview=None,
+        ),
+        [sprite_file, sprite_file],
+        spacing=2,
+        max_workers=2,
+    )
+    assert again["removed"] == 0
+    assert (tmp_path / "again.json").read_text() == (
+        tmp_path / "twice.json"
+    ).read_text()
+
+    with pytest.raises(ValueError):
+        compose(dataclasses.replace(job, on_conflict="shift"), [sprite_file])
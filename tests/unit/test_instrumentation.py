@@ -0,0 +1,79 @@
+import json
+import tracemalloc
+
+from cli import run_generate_command
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from pipeline import GenerationJob, run_job
+from tests.helpers import base_computer
+
+base_data = {"Objects": [base_computer]}
+
+
+def test_stages_and_counters():
+    instrumentation = Instrumentation(track_memory=True)
+    for _ in range(2):
+        with instrumentation.stage("map"):
+            data = [0] * 10000
+    instrumentation.count("pixels", 100)
+    instrumentation.count("pixels", 50)
+    instrumentation.stop()
+    del data
+
+    assert list(instrumentation.stages) == ["map"]
+    assert instrumentation.stages["map"]["peak_bytes"] >= 80000
+    assert instrumentation.counters == {"pixels": 150}
+    assert instrumentation.as_dict()["pixels_per_second"] > 0
+    assert "map" in instrumentation.summary()
+
+
+def test_null_instrumentation():
+    with NULL_INSTRUMENTATION.stage("map"):
+        NULL_INSTRUMENTATION.count("pixels", 1)
+
+
+def test_run_job_trace(tmp_path):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps(base_data))
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file="sprites/mega_man_standing.png",
+        z_up=40.0,
+        output_file=str(tmp_path / "out.json"),
+        cache=False,
+    )
+    instrumentation = Instrumentation()
+    result = run_job(job, instrumentation)
+    instrumentation.write_trace(tmp_path / "trace.json")
+
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert list(trace["stages"]) == [
+        "load base",
+        "validate",
+        "decode",
+        "mask",
+        "quantize",
+        "map",
+        "write",
+    ]
+    assert trace["counters"]["objects"] == result.objects
+    assert trace["counters"]["pixels"] == 23 * 26
+
+
+def test_generate_command_stops_memory_tracing(tmp_path):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps(base_data))
+    argv = [
+        str(base_file),
+        "sprites/mega_man_standing.png",
+        "40",
+        "--o",
+        str(tmp_path / "out.json"),
+        "--trace",
+        str(tmp_path / "trace.json"),
+    ]
+    assert run_generate_command(argv) == 0
+    assert not tracemalloc.is_tracing()
+    # Also when the job fails, here on a base without a base computer
+    base_file.write_text(json.dumps({"Objects": []}))
+    assert run_generate_command(argv) == 1
+    assert not tracemalloc.is_tracing()
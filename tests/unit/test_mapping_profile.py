@@ -0,0 +1,77 @@
+import json
+
+import pytest
+from PIL import Image
+
+import mapping
+from mapping import (
+    color_index_map,
+    compile_color_index_map,
+    load_mapping_profile,
+    sprite_data_to_table,
+)
+from model import NMSObject
+from validation import InvalidMappingProfileError
+
+anchor = NMSObject({"Position": [0, 0, 0], "Up": [0, 1, 0], "At": [0, 0, 1]})
+
+
+def test_default_profile_matches_color_index_map():
+    assert load_mapping_profile() == compile_color_index_map(color_index_map)
+
+
+def test_profile_is_cached():
+    assert load_mapping_profile() is load_mapping_profile()
+
+
+def test_compiled_profile_is_stored(tmp_path, monkeypatch):
+    monkeypatch.setenv("NMS_GEN_CACHE_DIR", str(tmp_path / "cache"))
+    profile_path = tmp_path / "profile.toml"
+    profile_path.write_text('[colors]\n3 = { object_id = "^S_FLOOR", userdata = 9 }\n')
+    tables = load_mapping_profile(profile_path)
+    (compiled_path,) = (tmp_path / "cache").glob("profile-*.map")
+
+    # A new process reads the stored tables instead of parsing the profile
+    mapping._compile_profile.cache_clear()
+    with monkeypatch.context() as patch:
+        patch.setattr(mapping.tomllib, "loads", None)
+        assert load_mapping_profile(profile_path) == tables
+
+    # A damaged file is compiled again
+    compiled_path.write_bytes(compiled_path.read_bytes()[:-1])
+    mapping._compile_profile.cache_clear()
+    assert load_mapping_profile(profile_path) == tables
+    assert load_mapping_profile(profile_path).userdata_lut[3] == 9
+
+
+def test_json_profile(tmp_path):
+    profile_path = tmp_path / "profile.json"
+    profile = {"colors": {"0": {"object_id": "^CUBESOLID", "userdata": 7}}}
+    profile_path.write_text(json.dumps(profile))
+    tables = load_mapping_profile(profile_path)
+
+    # Index 0 maps to a cube, index 1 is not in the profile and produces no object
+    image = Image.new("P", (2, 1))
+    image.putpixel((1, 0), 1)
+    table = sprite_data_to_table(image, anchor, tables=tables)
+    assert len(table) == 1
+    assert table[0].object_id == "^CUBESOLID"
+    assert table[0].userdata == 7
+
+
+@pytest.mark.parametrize(
+    "colors",
+    [
+        "",
+        '256 = { object_id = "^S_FLOOR" }',
+        'x = { object_id = "^S_FLOOR" }',
+        '0 = { object_id = "S_FLOOR" }',
+        '0 = { object_id = "^S_FLOOR", userdata = -1 }',
+        '0 = "^S_FLOOR"',
+    ],
+)
+def test_invalid_profile(tmp_path, colors):
+    profile_path = tmp_path / "profile.toml"
+    profile_path.write_text(f"[colors]\n{colors}\n")
+    with pytest.raises(InvalidMappingProfileError):
+        load_mapping_profile(profile_path)
@@ -0,0 +1,173 @@
+import dataclasses
+import json
+import itertools
+from array import array
+
+import random
+
+import pytest
+
+from model import ObjectTable
+from object_index import (
+    ObjectIndex,
+    SpatialHash,
+    generated_tag,
+    plan_replacement,
+    resolve_conflicts,
+)
+from pipeline import GenerationJob, run_job
+from validation import PlacementConflictError
+
+tag = generated_tag("link_sprite")
+
+
+def floor(x: float, z: float, message="", object_id="^F_FLOOR") -> dict:
+    return {
+        "ObjectID": object_id,
+        "Position": [x, 2.0, z],
+        "Up": [0.0, 1.0, 0.0],
+        "At": [0.0, 0.0, 1.0],
+        "Timestamp": 1755537617,
+        "UserData": 0,
+        "Message": message,
+    }
+
+
+existing = ObjectTable.from_dicts(
+    [
+        floor(0.0, 0.0, object_id="^BASE_FLAG"),
+        floor(5.0, 0.0, tag),
+        floor(10.0, 0.0, tag),
+        floor(10.0, 0.0, "a sign"),
+        floor(15.0, 0.0, generated_tag("picard")),
+    ]
+)
+
+
+def test_object_index():
+    index = ObjectIndex(existing)
+    assert set(index.tags) == {tag, generated_tag("picard")}
+    assert index.with_tag(tag) == array("q", [1, 2])
+    assert index.with_tag(generated_tag("hank")) == array("q")
+    assert index.with_object_id("^F_FLOOR") == array("q", [1, 2, 3, 4])
+    assert index.in_cell([11.0, 3.0, 4.9]) == array("q", [2, 3])
+    assert index.in_cell([-1.0, 0.0, 0.0]) == array("q")
+
+
+def test_spatial_hash_matches_brute_force():
+    rng = random.Random(3)
+    positions = array("d", (rng.uniform(-60.0, 60.0) for _ in range(3 * 500)))
+    spatial = SpatialHash(positions)
+    points = [[rng.uniform(-65.0, 65.0) for _ in range(3)] for _ in range(200)]
+    existing = list(zip(*(positions[axis::3] for axis in range(3))))
+    for point in points:
+        expected = [
+            row
+            for row, position in enumerate(existing)
+            if all(abs(a - b) < 4.0 for a, b in zip(position, point))
+        ]
+        assert sorted(spatial.near(point, 4.0)) == expected
+
+    flat = array("d", itertools.chain.from_iterable(points))
+    mask = spatial.conflicts(flat, 4.0)
+    assert list(mask) == [int(bool(spatial.near(point, 4.0))) for point in points]
+
+
+def test_resolve_conflicts():
+    index = ObjectIndex(existing)
+
+    def generated():
+        return ObjectTable.from_dicts([floor(10.0, 0.0), floor(20.0, 0.0)])
+
+    objects, conflicts = resolve_conflicts(index, generated(), "report")
+    assert (len(objects), conflicts) == (2, 1)
+    objects, conflicts = resolve_conflicts(index, generated(), "skip")
+    assert [obj.position[0] for obj in objects] == [20.0]
+    objects, conflicts = resolve_conflicts(index, generated(), "shift")
+    assert [obj.position for obj in objects] == [[10.0, 2.0, -5.0], [20.0, 2.0, -5.0]]
+    assert not any(index.spatial.conflicts(objects.positions, 2.5))
+    # The objects a replacement removes do not get in the way
+    objects, conflicts = resolve_conflicts(index, generated(), "skip", ignore_tag=tag)
+    assert conflicts == 1
+
+    crowded = ObjectIndex(
+        ObjectTable.from_dicts(
+            [floor(5.0 * x, 5.0 * z) for x in range(-20, 21) for z in range(-20, 21)]
+        )
+    )
+    with pytest.raises(PlacementConflictError):
+        resolve_conflicts(crowded, generated(), "shift")
+
+
+def test_plan_replacement():
+    generated = ObjectTable.from_dicts(
+        [floor(10.0, 0.0, tag), floor(20.0, 0.0, tag), floor(25.0, 0.0, tag)]
+    )
+    plan = plan_replacement(ObjectIndex(existing), tag, generated)
+    # The object at x=10 is unchanged, x=5 is gone and the other two are new
+    assert plan.kept == 1
+    assert plan.removed == array("q", [1])
+    assert [obj.position[0] for obj in plan.added] == [20.0, 25.0]
+
+    plan = plan_replacement(ObjectIndex(existing), generated_tag("hank"), generated)
+    assert (plan.kept, len(plan.removed), len(plan.added)) == (0, 0, 3)
+
+
+def test_run_job_replace_is_idempotent(tmp_path):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps({"Objects": existing.to_dicts()[:1]}))
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file="sprites/link_sprite.png",
+        z_up=40.0,
+        output_file=str(tmp_path / "first.json"),
+        cache=False,
+    )
+    first = run_job(job)
+    second = run_job(
+        dataclasses.replace(
+            job,
+            base_json=job.output_file,
+            output_file=str(tmp_path / "second.json"),
+            replace=True,
+        )
+    )
+    assert (second.removed, second.kept) == (0, first.objects)
+    assert (tmp_path / "second.json").read_text() == (
+        tmp_path / "first.json"
+    ).read_text()
+
+
+def test_run_job_shifts_by_whole_tiles_of_the_sprite(tmp_path):
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps({"Objects": existing.to_dicts()[:1]}))
+    # A wall sprite at twice the scale: its tiles are 10 apart, in the x, y plane
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file="sprites/link_sprite.png",
+        z_up=0.0,
+        output_file=str(tmp_path / "clear.json"),
+        plane="wall",
+        scale=2.0,
+        cache=False,
+    )
+    run_job(job)
+    clear = json.loads((tmp_path / "clear.json").read_text())["Objects"][1:]
+
+    blocker = {**clear[0], "ObjectID": "^SIGN", "Message": "in the way"}
+    base_file.write_text(json.dumps({"Objects": existing.to_dicts()[:1] + [blocker]}))
+    result = run_job(
+        dataclasses.replace(
+            job, output_file=str(tmp_path / "shifted.json"), on_conflict="shift"
+        )
+    )
+    shifted = json.loads((tmp_path / "shifted.json").read_text())["Objects"][2:]
+    assert result.conflicts > 0
+    offsets = {
+        tuple(round(b - a, 6) for a, b in zip(before["Position"], after["Position"]))
+        for before, after in zip(clear, shifted)
+    }
+    assert len(offsets) == 1
+    offset = offsets.pop()
+    assert offset[2] == 0.0 and any(offset)
+    assert all(value % 10.0 == 0.0 for value in offset)
@@ -0,0 +1,115 @@
+import json
+from array import array
+
+import pytest
+
+from model import NMSObject, ObjectTable
+from tests.helpers import base_computer
+
+base_objects = [
+    {**base_computer, "Position": [1.5, 2.0, 3.0]},
+    {
+        "ObjectID": "^S_FLOOR",
+        "Position": [10.0, 2.0, 3.0],
+        "Up": [0.0, 1.0, 0.0],
+        "At": [1.0, 0.0, 0.0],
+        "Timestamp": 1755537618,
+        "UserData": 16777223,
+        "Message": "hello",
+    },
+    {
+        "ObjectID": "^S_FLOOR",
+        "Position": [15.0, 2.0, 3.0],
+        "Up": [0.0, 1.0, 0.0],
+        "At": [1.0, 0.0, 0.0],
+        "Timestamp": 1755537619,
+        "UserData": 4278190088,
+        "Message": "",
+        "Extra": {"kept": True},
+    },
+]
+
+
+def test_round_trip_json_objects():
+    table = ObjectTable.from_dicts(base_objects)
+    assert len(table) == 3
+    assert table.object_ids == ["^BASE_FLAG", "^S_FLOOR"]
+    assert json.dumps(table.to_dicts()) == json.dumps(base_objects)
+
+
+def test_round_trip_incomplete_objects():
+    # Keys an object lacks stay absent, rather than coming back as zeros
+    sparse = [
+        {"ObjectID": "^S_FLOOR", "Position": [1.0, 2.0, 3.0], "UserData": 7},
+        {"Message": "no id", "Extra": 1},
+    ]
+    table = ObjectTable.from_dicts([*base_objects, *sparse])
+    assert table.to_dicts() == [*base_objects, *sparse]
+    assert table[3:].to_dicts() == sparse
+    assert table.filter([0, 0, 0, 0, 1]).to_dicts() == sparse[1:]
+    assert table[4].as_dict()["Position"] == []
+
+    copied = ObjectTable.from_dicts(base_objects[:1])
+    copied.extend(table[3:])
+    assert copied.to_dicts() == [base_objects[0], *sparse]
+
+
+def test_non_integer_values_are_rejected():
+    with pytest.raises(ValueError, match="UserData"):
+        ObjectTable.from_dicts([{**base_computer, "UserData": 1.5}])
+    with pytest.raises(ValueError, match="Timestamp"):
+        ObjectTable.from_dicts([{**base_computer, "Timestamp": "1755537617"}])
+
+
+def test_row_view_and_slicing():
+    table = ObjectTable.from_dicts(base_objects)
+    assert isinstance(table[1], NMSObject)
+    assert table[1].object_id == "^S_FLOOR"
+    assert table[-1].userdata == 4278190088
+    assert table[1:].to_dicts() == base_objects[1:]
+    assert table[::2].to_dicts() == base_objects[::2]
+
+
+def test_filter_and_extend():
+    table = ObjectTable.from_dicts(base_objects)
+    floors = table.filter(table.object_id_mask("^S_FLOOR"))
+    assert floors.to_dicts() == base_objects[1:]
+
+    other = ObjectTable.from_dicts([{**base_objects[0], "ObjectID": "^T_FLOOR"}])
+    floors.extend(other)
+    assert len(floors) == 3
+    assert floors[2].object_id == "^T_FLOOR"
+    assert floors.to_dicts()[:2] == base_objects[1:]
+
+
+def test_compact_storage():
+    table = ObjectTable.from_dicts(base_objects[:2] * 1500)
+    assert len(table) == 3000
+    assert table.nbytes / len(table) < 100
+
+
+def test_translate():
+    table = ObjectTable.from_dicts(base_objects)
+    table.translate([1.0, 0.0, -3.0])
+    assert [obj.position for obj in table] == [
+        [2.5, 2.0, 0.0],
+        [11.0, 2.0, 0.0],
+        [16.0, 2.0, 0.0],
+    ]
+
+
+def test_mismatched_columns():
+    reference = NMSObject({"ObjectID": "^BASE_FLAG", "Position": [0.0, 0.0, 0.0]})
+    table = ObjectTable.from_tiles(
+        reference,
+        ["^S_FLOOR"],
+        array("H", [0, 0]),
+        array("d", range(6)),
+        array("q", [0, 0]),
+    )
+    assert [row["Up"] for row in table.iter_dicts()] == [[0.0, 0.0, 0.0]] * 2
+
+    # A short column raises rather than silently dropping rows
+    table.at = array("d")
+    with pytest.raises(ValueError):
+        list(table.iter_dicts())
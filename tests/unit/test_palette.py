@@ -1,6 +1,91 @@
-from palette import load_color_palette
+from PIL import Image
+from PIL.Image import Dither
+
+from mapping import load_mapping_profile
+from palette import (
+    NO_TARGET,
+    _lab_as_rgb,
+    load_color_palette,
+    load_nes_palette,
+    load_palette,
+    load_perceptual_lut,
+)
+from pipeline import GenerationJob, SpriteImage, color_matcher
 
 
 def test_full_palette():
     palette = load_color_palette()
     assert len(palette.palette.colors) == 256
+
+
+def test_palette_matches_pillow_quantize():
+    palette = load_palette()
+    for sprite in ("samus_standing", "mega_man_standing", "picard", "link_sprite"):
+        image = Image.open(f"sprites/{sprite}.png")
+        expected = image.convert("RGB").quantize(
+            palette=load_nes_palette(), dither=Dither.NONE
+        )
+        quantized = palette.quantize(image)
+        assert quantized.mode == "P"
+        assert quantized.tobytes() == expected.tobytes()
+        assert quantized.getpalette() == expected.getpalette()
+        assert palette.index_plane(image.convert("RGBA")) == expected.tobytes()
+
+
+def test_perceptual_lut_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("NMS_GEN_CACHE_DIR", str(tmp_path))
+    targets = load_mapping_profile().match_targets
+    load_perceptual_lut.cache_clear()
+    try:
+        first = load_perceptual_lut(targets)
+        (lut_file,) = tmp_path.glob("perceptual-*.lut")
+        modified = lut_file.stat().st_mtime_ns
+        load_perceptual_lut.cache_clear()
+        second = load_perceptual_lut(targets)
+        assert lut_file.stat().st_mtime_ns == modified
+        assert first.palette == second.palette
+    finally:
+        load_perceptual_lut.cache_clear()
+
+
+def test_perceptual_lut_matches_nearest_lab_color():
+    tables = load_mapping_profile()
+    targets = tables.match_targets
+    lut = load_perceptual_lut(targets)
+    palette = load_palette().palette
+    candidates = [i for i, target in enumerate(targets) if target != NO_TARGET]
+
+    def lab(colors):
+        image = Image.new("RGB", (len(colors), 1))
+        image.putdata(colors)
+        flat = iter(_lab_as_rgb(image).tobytes())
+        return list(zip(flat, flat, flat))
+
+    candidate_labs = lab([tuple(palette[3 * i : 3 * i + 3]) for i in candidates])
+    colors = [((i * 37) % 256, (i * 91) % 256, (i * 53) % 256) for i in range(4096)]
+    image = Image.new("RGB", (len(colors), 1))
+    image.putdata(colors)
+    matched = lut.index_plane(image)
+    for color_lab, target in zip(lab(colors), matched):
+        distances = [
+            sum((a - b) ** 2 for a, b in zip(color_lab, candidate_lab))
+            for candidate_lab in candidate_labs
+        ]
+        best = min(distances)
+        # Ties may go either way, but the match is always one of the nearest parts
+        assert target in {
+            targets[i] for i, d in zip(candidates, distances) if d == best
+        }
+
+
+def test_lab_matcher_maps_every_pixel_to_a_part():
+    tables = load_mapping_profile()
+    job = GenerationJob(
+        "base.json", "sprites/picard.png", 0.0, "out.json", matcher="lab"
+    )
+    quantized = SpriteImage.open(job.sprite_file).quantize(color_matcher(job, tables))
+    assert quantized.getpalette() == load_nes_palette().getpalette()
+    pixels = quantized.tobytes()
+    # Every pixel produces an object, and holds the first palette index of its part
+    assert pixels.translate(tables.present_lut) == b"\x01" * len(pixels)
+    assert pixels.translate(tables.part_lut) == pixels
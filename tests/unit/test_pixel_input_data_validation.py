@@ -1,6 +1,24 @@
+import pytest
+from PIL import Image
+
+from validation import (
+    ImageTooBigError,
+    IncompatibleImageError,
+    validate_pixel_input_data,
+)
+
+
 def test_invalid_input_fails():
-    pass
+    with pytest.raises(ImageTooBigError):
+        validate_pixel_input_data(Image.new("RGBA", (60, 51)))
+    with pytest.raises(IncompatibleImageError):
+        validate_pixel_input_data(Image.new("F", (16, 16)))
+    with pytest.raises(IncompatibleImageError):
+        validate_pixel_input_data(Image.new("RGBA", (0, 16)))
 
 
 def test_valid_input_succeeds():
-    pass
+    validate_pixel_input_data(Image.new("RGBA", (60, 50)))
+    validate_pixel_input_data(Image.new("RGBA", (60, 51)), check_size=False)
+    with Image.open("sprites/picard.png") as image:
+        validate_pixel_input_data(image)
@@ -0,0 +1,105 @@
+import math
+
+import pytest
+from PIL import Image
+
+from mapping import sprite_data_to_table
+from model import NMSObject
+from placement import Placement, anchor_axes, lift
+from palette import load_palette
+from pipeline import GenerationJob
+from tests.helpers import base_computer
+
+flat_anchor = NMSObject({**base_computer, "Position": [1.5, 2.0, 3.0]})
+# Up tilted 30 degrees towards x, At not quite perpendicular to it
+tilted_anchor = NMSObject(
+    {
+        **flat_anchor.as_dict(),
+        "Up": [math.sin(math.pi / 6), math.cos(math.pi / 6), 0.0],
+        "At": [0.1, 0.0, 1.0],
+    }
+)
+
+
+def sprite():
+    with Image.open("sprites/link_sprite.png") as image:
+        return load_palette().quantize(image)
+
+
+def dot(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_anchor_axes_are_orthonormal():
+    assert anchor_axes(flat_anchor) == (
+        (1.0, 0.0, 0.0),
+        (0.0, -0.0, 1.0),
+        (0.0, 1.0, 0.0),
+    )
+    right, forward, up = anchor_axes(tilted_anchor)
+    for a, b in ((right, forward), (forward, up), (up, right)):
+        assert dot(a, b) == pytest.approx(0.0, abs=1e-12)
+    for axis in (right, forward, up):
+        assert dot(axis, axis) == pytest.approx(1.0)
+
+
+def test_flat_floor_placement_matches_world_grid():
+    image = sprite()
+    table = sprite_data_to_table(image, flat_anchor, z_up=40.0)
+    cells = set()
+    for obj in table:
+        assert obj.position[1] == 42.0
+        x = (obj.position[0] - 1.5) / 5
+        y = (obj.position[2] - 3.0) / 5
+        assert x == int(x) and y == int(y)
+        cells.add((x, y))
+        assert obj.up == [0.0, 1.0, 0.0] and obj.at == [0.0, 0.0, 1.0]
+    assert len(cells) == len(table)
+
+
+def test_tilted_placement_stays_in_the_anchor_plane():
+    image = sprite()
+    table = sprite_data_to_table(image, tilted_anchor, z_up=10.0)
+    right, forward, up = anchor_axes(tilted_anchor)
+    for obj in table:
+        offset = [p - a for p, a in zip(obj.position, tilted_anchor.position)]
+        assert dot(offset, up) == pytest.approx(10.0)
+        assert dot(offset, right) / 5 == pytest.approx(round(dot(offset, right) / 5))
+    assert table[0].up == tilted_anchor.up
+
+
+def test_rotation_wall_and_scale():
+    image = sprite()
+    flat = sprite_data_to_table(image, flat_anchor)
+    rotated = sprite_data_to_table(image, flat_anchor, placement=Placement(rotation=90))
+    # A quarter turn maps sprite x onto the At axis and sprite y onto -x
+    for a, b in zip(flat, rotated):
+        ax, az = a.position[0] - 1.5, a.position[2] - 3.0
+        assert b.position[0] - 1.5 == pytest.approx(-az)
+        assert b.position[2] - 3.0 == pytest.approx(ax)
+    assert rotated[0].at == pytest.approx([-1.0, 0.0, 0.0])
+
+    wall = sprite_data_to_table(image, flat_anchor, placement=Placement("wall"))
+    heights = [obj.position[1] - 2.0 for obj in wall]
+    assert min(heights) == 0.0 and max(heights) == 5.0 * (image.height - 1)
+    assert {obj.position[2] for obj in wall} == {3.0}
+    assert wall[0].up == [0.0, 0.0, 1.0] and wall[0].at == [0.0, 1.0, 0.0]
+
+    scaled = sprite_data_to_table(image, flat_anchor, placement=Placement(scale=2))
+    assert scaled[-1].position[0] - 1.5 == 2 * (flat[-1].position[0] - 1.5)
+    assert scaled[0].up == [0.0, 2.0, 0.0]
+
+    with pytest.raises(ValueError):
+        Placement("ceiling")
+    # Jobs check their placement up front, before any worker builds it
+    with pytest.raises(ValueError):
+        GenerationJob("base.json", "sprite.png", 0.0, "out.json", scale=0)
+
+
+def test_lift_is_exact_for_cached_tables():
+    image = sprite()
+    for placement in (Placement(), Placement("wall", 30.0, 1.5)):
+        lifted = sprite_data_to_table(image, tilted_anchor, 12.5, placement=placement)
+        table = sprite_data_to_table(image, tilted_anchor, placement=placement)
+        table.translate(lift(tilted_anchor, 12.5))
+        assert table.positions == lifted.positions
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+from PIL import Image
+
+from mapping import NO_OBJECT, load_mapping_profile, sprite_data_to_table
+from model import NMSObject, ObjectTable
+from object_index import generated_tag
+from pipeline import GenerationJob, SpriteImage, run_job
+from placement import Placement
+from preview import (
+    BACKGROUND,
+    UNMAPPED,
+    generated_objects,
+    rasterize,
+    render_base,
+    swatches,
+)
+from tests import helpers
+
+base_computer = {**helpers.base_computer, "Position": [10.0, 2.0, -5.0]}
+anchor = NMSObject(base_computer)
+tables = load_mapping_profile()
+
+
+def expected_preview(sprite_file) -> bytes:
+    """The sprite's palette indexes as drawn by the preview: each part in the color of
+    the first palette index mapped to it, and the background where nothing is placed."""
+    sprite = SpriteImage.open(sprite_file)
+    mask = sprite.transparency_mask() or bytes(sprite.size[0] * sprite.size[1])
+    pixels = sprite.quantize().tobytes()
+    drawn = bytes(
+        BACKGROUND if masked or tables.object_id_lut[pixel] == NO_OBJECT else part
+        for pixel, part, masked in zip(pixels, pixels.translate(tables.part_lut), mask)
+    )
+    image = Image.frombytes("L", sprite.size, drawn)
+    return image.crop(image.point(lambda v: v != BACKGROUND).getbbox()).tobytes()
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+@pytest.mark.parametrize(
+    "placement", [Placement(), Placement("wall"), Placement(rotation=90, scale=2)]
+)
+def test_rasterize_round_trips_the_sprite(coalesce, placement):
+    sprite = SpriteImage.open("sprites/samus_standing.png")
+    table = sprite_data_to_table(
+        sprite.quantize(),
+        anchor,
+        z_up=7.0,
+        transparency_mask=sprite.transparency_mask(),
+        tables=tables,
+        coalesce=coalesce,
+        placement=placement,
+    )
+    image = rasterize(table, anchor, tables, placement)
+    assert image.mode == "P"
+    assert image.info["transparency"] == BACKGROUND
+    assert image.tobytes() == expected_preview("sprites/samus_standing.png")
+
+
+def test_rasterize_unknown_parts():
+    table = ObjectTable.from_dicts(
+        [
+            {**base_computer, "ObjectID": "^NOT_A_PART", "Position": [10.0, 2.0, -5.0]},
+            {**base_computer, "ObjectID": "^NOT_A_PART", "Position": [20.0, 2.0, 5.0]},
+        ]
+    )
+    image = rasterize(table, anchor, tables)
+    assert image.size == (3, 3)
+    assert image.tobytes() == bytes(
+        [UNMAPPED, BACKGROUND, BACKGROUND]
+        + [BACKGROUND] * 3
+        + [BACKGROUND, BACKGROUND, UNMAPPED]
+    )
+
+    with pytest.raises(ValueError):
+        rasterize(ObjectTable(), anchor, tables)
+
+
+def test_swatches():
+    parts = swatches(tables)
+    for color_index, part in enumerate(tables.part_lut):
+        object_id = tables.object_id_lut[color_index]
+        if object_id != NO_OBJECT:
+            key = (tables.object_ids[object_id], tables.userdata_lut[color_index])
+            assert parts[key] == part
+
+
+def test_render_base(tmp_path):
+    base_file = tmp_path / "base.json"
+    sign = {**base_computer, "ObjectID": "^SIGN", "Message": "hello"}
+    base_file.write_text(json.dumps({"Objects": [base_computer, sign]}))
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file="sprites/link_sprite.png",
+        z_up=3.0,
+        output_file=str(tmp_path / "out.json"),
+        cache=False,
+        preview=str(tmp_path / "out.png"),
+    )
+    run_job(job)
+    expected = expected_preview(job.sprite_file)
+    with Image.open(job.preview) as image:
+        assert image.tobytes() == expected
+
+    table = ObjectTable.from_dicts(
+        json.loads((tmp_path / "out.json").read_text())["Objects"]
+    )
+    assert len(generated_objects(table)) == len(table) - 2
+    assert len(generated_objects(table, generated_tag("hank"))) == 0
+
+    image = render_base(job.output_file, tag=generated_tag("link_sprite"))
+    assert image.tobytes() == expected
@@ -0,0 +1,125 @@
+import io
+import json
+
+import pytest
+
+from serialization import parse_base_document, write_base_document
+from validation import InvalidBaseDataError, validate_base_document
+
+floor = {
+    "ObjectID": "^S_FLOOR",
+    "Position": [10.0, 2.0, 3.0],
+    "Up": [0.0, 1.0, 0.0],
+    "At": [0.0, 0.0, 1.0],
+    "Timestamp": 1755537618,
+    "UserData": 0,
+    "Message": "",
+}
+base_computer = {**floor, "ObjectID": "^BASE_FLAG", "Position": [0.0, 0.0, 0.0]}
+base_data = {
+    "Name": "Test [Base] {1}",
+    "Position": [1.0, -2.5, 3.0],
+    "Objects": [floor, base_computer, floor],
+    "Owner": {"UID": "0"},
+}
+generated = [{**floor, "ObjectID": "^T_FLOOR"}, {**floor, "ObjectID": "^W_FLOOR"}]
+
+
+def write_to_string(document, *args, **kwargs) -> str:
+    outfile = io.StringIO()
+    write_base_document(outfile, document, *args, **kwargs)
+    return outfile.getvalue()
+
+
+def test_parse_base_document():
+    document = parse_base_document(json.dumps(base_data, indent=4))
+    assert document.object_count == 3
+    assert document.base_computer == base_computer
+    assert document.base_computer_index == 1
+    assert list(document.iter_objects()) == base_data["Objects"]
+    validate_base_document(document)
+
+
+def test_write_base_document_passes_through():
+    for text in (
+        json.dumps(base_data, indent=4),
+        json.dumps(base_data, separators=(",", ":")),
+        json.dumps(base_data, indent="\t"),
+    ):
+        assert write_to_string(parse_base_document(text)) == text
+
+
+def test_write_base_document_appends_generated():
+    expected = {**base_data, "Objects": base_data["Objects"] + generated}
+
+    document = parse_base_document(json.dumps(base_data, indent=4))
+    text = write_to_string(document, iter(generated))
+    assert text == json.dumps(expected, indent=4)
+
+    document = parse_base_document(json.dumps(base_data, separators=(",", ":")))
+    text = write_to_string(document, generated, indent=None)
+    assert text == json.dumps(expected, separators=(",", ":"))
+
+
+def test_write_base_document_empty_objects():
+    empty_base = {"Objects": [], "Name": ""}
+    document = parse_base_document(json.dumps(empty_base, indent=4))
+    text = write_to_string(document, generated)
+    assert text == json.dumps({**empty_base, "Objects": generated}, indent=4)
+
+
+def test_write_base_document_removes_elements():
+    objects = base_data["Objects"]
+    for indent, separators in ((4, None), (None, (",", ":"))):
+        document = parse_base_document(
+            json.dumps(base_data, indent=indent, separators=separators)
+        )
+        for removed, added in (([0, 2], generated), ([2], []), ([0, 1, 2], [])):
+            kept = [obj for row, obj in enumerate(objects) if row not in removed]
+            expected = {**base_data, "Objects": kept + added}
+            text = write_to_string(document, added, indent=indent, removed=removed)
+            assert text == json.dumps(expected, indent=indent, separators=separators)
+
+    document = parse_base_document(json.dumps(base_data, indent=4))
+    text = write_to_string(document, generated, removed=[0, 1, 2])
+    assert text == json.dumps({**base_data, "Objects": generated}, indent=4)
+
+
+def test_write_base_document_compacts_copied_text():
+    # Whitespace inside strings, escaped quotes included, is kept as it is
+    sign = {**floor, "ObjectID": "^SIGN", "Message": 'say "hi" ,\t there'}
+    data = {**base_data, "Objects": [floor, base_computer, sign]}
+    objects = data["Objects"]
+    for indent in (4, "\t"):
+        document = parse_base_document(json.dumps(data, indent=indent))
+        for removed, added in (
+            ([], generated),
+            ([], []),
+            ([0], generated),
+            ([0, 1, 2], []),
+            ([0, 1, 2], generated),
+        ):
+            kept = [obj for row, obj in enumerate(objects) if row not in removed]
+            expected = {**data, "Objects": kept + added}
+            text = write_to_string(document, added, indent=None, removed=removed)
+            assert text == json.dumps(expected, separators=(",", ":"))
+
+    empty_base = {"Objects": [], "Name": "An empty base"}
+    document = parse_base_document(json.dumps(empty_base, indent=4))
+    text = write_to_string(document, generated, indent=None)
+    assert text == json.dumps(
+        {**empty_base, "Objects": generated}, separators=(",", ":")
+    )
+
+
+def test_validate_base_document():
+    document = parse_base_document(json.dumps({"Objects": [floor]}))
+    with pytest.raises(InvalidBaseDataError):
+        validate_base_document(document)
+
+    document = parse_base_document(json.dumps({"Name": "No objects"}))
+    with pytest.raises(InvalidBaseDataError):
+        validate_base_document(document)
+
+    with pytest.raises(ValueError):
+        parse_base_document('{"Objects": [1, 2')
@@ -0,0 +1,112 @@
+import dataclasses
+import json
+
+import pytest
+from PIL import Image
+
+from instrumentation import Instrumentation
+from model import ObjectTable
+from pipeline import GenerationJob, run_job
+from result_cache import CachedObjects, CachedPlanes, ResultCache
+from tests.helpers import base_computer
+from validation import ImageTooBigError
+
+base_data = {"Objects": [{**base_computer, "Position": [1.5, 2.0, 3.0]}]}
+
+
+def test_planes_round_trip(tmp_path):
+    cache = ResultCache(tmp_path)
+    key = cache.planes_key(b"sprite", None, b"palette")
+    assert key != cache.planes_key(b"sprite", (0, 0, 1, 1), b"palette")
+    assert key != cache.planes_key(b"sprite", None, b"palette", check_size=False)
+    assert cache.load_planes(key) is None
+    cache.store_planes(key, CachedPlanes((3, 2), bytes(range(6)), b"\x01\x00" * 3))
+    cache.store_planes("nomask", CachedPlanes((2, 1), b"\x05\x06", None))
+    assert cache.load_planes(key) == ((3, 2), bytes(range(6)), b"\x01\x00" * 3)
+    assert cache.load_planes("nomask") == ((2, 1), b"\x05\x06", None)
+
+
+def test_objects_round_trip(tmp_path):
+    cache = ResultCache(tmp_path)
+    objects = ObjectTable.from_dicts(
+        [
+            base_computer,
+            {**base_computer, "ObjectID": "^U_PIPE", "Message": "tag", "Extra": [1]},
+            {"ObjectID": "^U_PIPE", "UserData": 3},
+        ]
+    )
+    cache.store_objects("key", CachedObjects(12, 3, objects))
+    pixels, tiles, loaded = cache.load_objects("key")
+    assert (pixels, tiles) == (12, 3)
+    assert loaded.to_dicts() == objects.to_dicts()
+
+    # Entries are plain columns, anything malformed is a cache miss
+    path = tmp_path / "objects-key.bin"
+    path.write_bytes(path.read_bytes()[:-1])
+    assert cache.load_objects("key") is None
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=110)
+    for key in "abc":
+        cache.store_planes(key, CachedPlanes((40, 1), bytes(40), None))
+        # Reading an entry marks it as recently used
+        assert cache.load_planes("a") is not None
+    assert cache.load_planes("a") is not None
+    assert cache.load_planes("b") is None
+    assert cache.load_planes("c") is not None
+
+
+def test_run_job_reuses_cached_results(tmp_path, monkeypatch):
+    monkeypatch.setenv("NMS_GEN_CACHE_DIR", str(tmp_path / "cache"))
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps(base_data))
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file="sprites/mega_man_standing.png",
+        z_up=40.0,
+        output_file=str(tmp_path / "uncached.json"),
+        cache=False,
+    )
+    run_job(job)
+    expected = (tmp_path / "uncached.json").read_text()
+
+    for output_file in ("first.json", "second.json"):
+        instrumentation = Instrumentation()
+        cached_job = dataclasses.replace(
+            job, output_file=str(tmp_path / output_file), cache=True
+        )
+        run_job(cached_job, instrumentation)
+        assert (tmp_path / output_file).read_text() == expected
+    # The second run maps nothing, it only reads the cached table
+    assert "decode" not in instrumentation.stages
+    assert "map" not in instrumentation.stages
+    assert instrumentation.counters["objects"] == 327
+
+    # Only z_up changed, so the cached table is shifted instead of mapped again
+    instrumentation = Instrumentation()
+    run_job(dataclasses.replace(cached_job, z_up=12.0), instrumentation)
+    run_job(dataclasses.replace(job, z_up=12.0))
+    assert "map" not in instrumentation.stages
+    assert (tmp_path / "second.json").read_text() == (
+        tmp_path / "uncached.json"
+    ).read_text()
+
+
+def test_cache_hits_keep_the_size_check(tmp_path, monkeypatch):
+    monkeypatch.setenv("NMS_GEN_CACHE_DIR", str(tmp_path / "cache"))
+    base_file = tmp_path / "base.json"
+    base_file.write_text(json.dumps(base_data))
+    sprite_file = tmp_path / "large.png"
+    Image.new("RGBA", (60, 51), (255, 0, 0, 255)).save(sprite_file)
+    job = GenerationJob(
+        base_json=str(base_file),
+        sprite_file=str(sprite_file),
+        z_up=0.0,
+        output_file=str(tmp_path / "out.json"),
+        budgeted=True,
+    )
+    # Budgeted jobs skip the size check, their cached results must not let others
+    run_job(job)
+    with pytest.raises(ImageTooBigError):
+        run_job(dataclasses.replace(job, budgeted=False))
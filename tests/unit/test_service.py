@@ -0,0 +1,90 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from service import cached_base, parse_job_request, start_server
+from tests.helpers import base_computer
+from validation import InvalidServiceRequestError
+
+base_data = {"Objects": [base_computer]}
+sprite_data = Path("sprites/link_sprite.png").read_bytes()
+
+
+def test_parse_job_request():
+    request = parse_job_request("base_json=base.json&z_up=40&coalesce=1&output=objects")
+    assert request["z_up"] == 40.0
+    assert request["tag"] == "sprite"
+    assert request["coalesce"] and not request["compact"]
+    assert request["output"] == "objects"
+    for query in (
+        "z_up=40",
+        "base_json=b.json&z_up=up",
+        "base_json=b&z_up=1&x=1",
+        "base_json=b&z_up=1&plane=roof",
+    ):
+        with pytest.raises(InvalidServiceRequestError):
+            parse_job_request(query)
+
+
+def test_cached_base_reloads_changed_file(tmp_path):
+    base_json = tmp_path / "base.json"
+    base_json.write_text(json.dumps(base_data))
+    assert cached_base(str(base_json)) is cached_base(str(base_json))
+    base_data_copy = {"Objects": base_data["Objects"] * 2}
+    base_json.write_text(json.dumps(base_data_copy))
+    assert cached_base(str(base_json)).object_count == 2
+
+
+async def post(socket_path, target: str, body: bytes) -> tuple:
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(
+        f"POST {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+    )
+    writer.write(body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def test_service_generates_concurrent_requests(tmp_path):
+    base_json = tmp_path / "base.json"
+    base_json.write_text(json.dumps(base_data))
+    socket_path = str(tmp_path / "nms-gen.sock")
+
+    async def run():
+        with ThreadPoolExecutor(2) as executor:
+            server = await start_server(executor, socket_path)
+            async with server:
+                return await asyncio.gather(
+                    post(
+                        socket_path,
+                        f"/generate?base_json={base_json}&z_up=40",
+                        sprite_data,
+                    ),
+                    post(
+                        socket_path,
+                        f"/generate?base_json={base_json}&z_up=40&output=objects"
+                        "&tag=link",
+                        sprite_data,
+                    ),
+                    post(
+                        socket_path, f"/generate?base_json={base_json}&z_up=40", b"png"
+                    ),
+                    post(socket_path, "/missing", b""),
+                )
+
+    base, objects, bad_sprite, missing = asyncio.run(run())
+    assert base[0] == 200 and objects[0] == 200
+    assert len(objects[1]) > 0
+    # Tagged like the command line tags them, with the request's tag or the default
+    assert {obj["Message"] for obj in base[1]["Objects"][1:]} == {"nms-gen:sprite"}
+    assert {obj["Message"] for obj in objects[1]} == {"nms-gen:link"}
+    untagged = [{**obj, "Message": ""} for obj in objects[1]]
+    assert [{**obj, "Message": ""} for obj in base[1]["Objects"][1:]] == untagged
+    assert bad_sprite[0] == 400 and "error" in bad_sprite[1]
+    assert missing[0] == 404
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from PIL import Image
+
+from pipeline import GenerationJob
+from sharding import generate_shards, manifest_path, plan_shards, shard_output_path
+from tests.helpers import base_computer
+from validation import ImageTooBigError
+
+
+def test_plan_shards():
+    # 4 rows of 3 pixels, 3, 2, 0 and 3 tiles per row
+    tiles = bytes([1, 1, 1, 1, 0, 1, 0, 0, 0, 1, 1, 1])
+    assert plan_shards(tiles, 3, [5, 5]) == [(0, 0, 3, 3), (0, 3, 3, 4)]
+    assert plan_shards(tiles, 3, [3, 5, 5]) == [(0, 0, 3, 1), (0, 1, 3, 4)]
+    assert plan_shards(tiles, 3, [8]) == [(0, 0, 3, 4)]
+
+    with pytest.raises(ImageTooBigError):
+        plan_shards(tiles, 3, [2, 8])
+    with pytest.raises(ImageTooBigError):
+        plan_shards(tiles, 3, [4, 4])
+
+
+def test_shard_output_path():
+    assert str(shard_output_path("out/base.json", 2)) == "out/base.shard2.json"
+    assert str(shard_output_path("base.json.gz", 0)) == "base.shard0.json.gz"
+    assert str(manifest_path("out/base.json")) == "out/base.manifest.json"
+    assert str(manifest_path("base.json.gz")) == "base.manifest.json"
+
+
+def test_generate_shards(tmp_path):
+    base_files = []
+    for i in range(3):
+        base_file = tmp_path / f"base{i}.json"
+        base_computer_at = {**base_computer, "Position": [100.0 * i, 0.0, 0.0]}
+        base_file.write_text(json.dumps({"Objects": [base_computer_at]}))
+        base_files.append(str(base_file))
+
+    # 80 x 80 opaque pixels is more than twice the object limit
+    sprite_file = tmp_path / "mural.png"
+    Image.new("RGBA", (80, 80), (0, 0, 0, 255)).save(sprite_file)
+
+    job = GenerationJob(
+        base_json=base_files[0],
+        sprite_file=str(sprite_file),
+        z_up=10.0,
+        output_file=str(tmp_path / "mural.json"),
+    )
+    manifest = generate_shards(job, base_files, max_workers=2)
+    assert len(manifest["shards"]) == 3
+    assert sum(shard["objects"] for shard in manifest["shards"]) == 80 * 80
+    assert json.loads(manifest_path(job.output_file).read_text()) == manifest
+
+    for i, shard in enumerate(manifest["shards"]):
+        with open(shard["output_file"]) as output:
+            objects = json.load(output)["Objects"]
+        assert len(objects) == shard["objects"] + 1 <= 3000
+        # Each shard starts at the base computer of its own base
+        assert objects[1]["Position"] == [100.0 * i, 10.0, 0.0]
@@ -1,9 +1,13 @@
 from PIL import Image
 import pytest
 from PIL.Image import Dither
-from mapping import sprite_data_to_objects, build_transparency_mask
+from mapping import (
+    build_transparency_mask,
+    sprite_data_to_objects,
+    sprite_data_to_table,
+)
 from model import NMSObject
-from palette import load_nes_palette
+from palette import load_palette
 from validation import InvalidImageType
 
 default_anchor = NMSObject(
@@ -33,9 +37,7 @@ def test_sprite_data_to_objects_without_nes_palette():
 def test_mario_to_objects():
     test_image = Image.open("sprites/MarioSmallFrame1.png")
 
-    test_image = test_image.convert("RGB").quantize(
-        colors=64, palette=load_nes_palette()
-    )
+    test_image = load_palette().quantize(test_image)
     nms_objects = sprite_data_to_objects(test_image, anchor_object=default_anchor)
     assert len(nms_objects) == 16 * 16
 
@@ -43,10 +45,54 @@ def test_mario_to_objects():
 def test_sprite_data_to_objects_with_transparency():
     test_image = Image.open("sprites/mega_man_standing.png")
     alpha_mask = build_transparency_mask(test_image)
-    test_image = test_image.convert("RGB").quantize(
-        colors=64, dither=Dither.NONE, palette=load_nes_palette()
-    )
+    test_image = load_palette().quantize(test_image)
     nms_objects = sprite_data_to_objects(
         test_image, anchor_object=default_anchor, transparency_mask=alpha_mask
     )
     assert len(nms_objects) < test_image.size[0] * test_image.size[1]
+
+
+def test_sprite_data_to_table_matches_objects():
+    test_image = Image.open("sprites/mega_man_standing.png")
+    alpha_mask = build_transparency_mask(test_image)
+    test_image = load_palette().quantize(test_image)
+    table = sprite_data_to_table(
+        test_image, anchor_object=default_anchor, transparency_mask=alpha_mask
+    )
+    nms_objects = sprite_data_to_objects(
+        test_image, anchor_object=default_anchor, transparency_mask=alpha_mask
+    )
+    assert len(table) == len(nms_objects) == sum(not masked for masked in alpha_mask)
+    assert list(table.iter_dicts()) == [obj.as_dict() for obj in nms_objects]
+
+
+def test_sprite_data_to_table_offsets_from_anchor():
+    anchor = NMSObject({"Position": [100.0, 20.0, -50.0], "Up": [0, 1, 0]})
+    test_image = Image.new("P", (2, 2))
+    table = sprite_data_to_table(test_image, anchor, z_up=40.0, tile_spacing=5)
+    positions = [obj.position for obj in table]
+    assert positions == [
+        [100.0, 60.0, -50.0],
+        [105.0, 60.0, -50.0],
+        [100.0, 60.0, -45.0],
+        [105.0, 60.0, -45.0],
+    ]
+    assert all(obj.up == [0, 1, 0] for obj in table)
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_sprite_data_to_table_anchor_without_orientation(coalesce):
+    # A flag without Up and At still places every tile, facing the world axes
+    anchor = NMSObject({"ObjectID": "^BASE_FLAG", "Position": [0.0, 0.0, 0.0]})
+    test_image = Image.open("sprites/mega_man_standing.png")
+    alpha_mask = build_transparency_mask(test_image)
+    test_image = load_palette().quantize(test_image)
+    table = sprite_data_to_table(
+        test_image, anchor, transparency_mask=alpha_mask, coalesce=coalesce
+    )
+    objects = list(table.iter_dicts())
+    assert len(objects) == len(table) > 0
+    if not coalesce:
+        assert len(table) == sum(not masked for masked in alpha_mask)
+        assert all(obj["Up"] == [0.0, 1.0, 0.0] for obj in objects)
+        assert all(obj["At"] == [0.0, 0.0, 1.0] for obj in objects)
@@ -0,0 +1,30 @@
+from PIL import Image
+
+from mapping import build_transparency_mask
+from palette import load_palette
+from pipeline import SpriteImage
+
+
+def test_sprite_image_planes_match_separate_passes():
+    for sprite in ("mega_man_standing", "samus_standing", "picard"):
+        sprite_file = f"sprites/{sprite}.png"
+        sprite_image = SpriteImage.open(sprite_file)
+        with Image.open(sprite_file) as image:
+            assert sprite_image.transparency_mask() == build_transparency_mask(image)
+            assert sprite_image.transparency_mask(128) == build_transparency_mask(
+                image, 128
+            )
+            expected = load_palette().quantize(image)
+        assert sprite_image.quantize().tobytes() == expected.tobytes()
+
+
+def test_sprite_image_without_alpha():
+    sprite_image = SpriteImage.open("sprites/test_image_nes.png")
+    assert sprite_image.transparency_mask() is None
+    assert sprite_image.quantize().size == (8, 8)
+
+
+def test_sprite_image_crop():
+    sprite_image = SpriteImage.open("sprites/picard.png", crop=(0, 10, 54, 20))
+    assert sprite_image.size == (54, 10)
+    assert len(sprite_image.transparency_mask()) == 540
@@ -0,0 +1,91 @@
+import itertools
+import random
+
+import pytest
+
+from constants import CUBE_SOLID
+from mapping import default_mapping_tables
+from model import NMSObject
+from pipeline import GenerationJob, map_volume
+from tests.helpers import base_computer
+from validation import IncompatibleImageError
+from voxels import EMPTY, VoxelVolume, height_lut, layer_keys
+
+anchor = NMSObject({**base_computer, "Position": [1.5, 2.0, 3.0]})
+neighbours = ((1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1))
+
+
+def visible_per_voxel(volume: VoxelVolume) -> bytes:
+    occupancy = volume.occupancy()
+    width, height, depth = volume.width, volume.height, volume.depth
+
+    def filled(x, y, z):
+        return (
+            0 <= x < width
+            and 0 <= y < height
+            and 0 <= z < depth
+            and occupancy[(z * height + y) * width + x]
+        )
+
+    return bytes(
+        int(
+            filled(x, y, z)
+            and not all(filled(x + dx, y + dy, z + dz) for dx, dy, dz in neighbours)
+        )
+        for z, y, x in itertools.product(range(depth), range(height), range(width))
+    )
+
+
+def test_layer_keys():
+    assert layer_keys(b"\x01\x02\x03", b"\x01\x00\x01") == bytes([1, EMPTY, 3])
+
+
+def test_solid_cube_hides_its_inside():
+    volume = VoxelVolume(4, 4, 4, bytes([3]) * 64)
+    visible = volume.visible()
+    assert visible.count(1) == 64 - 8
+    assert not visible[(1 * 4 + 1) * 4 + 1]
+
+
+def test_visible_matches_per_voxel_check():
+    rng = random.Random(7)
+    for _ in range(40):
+        width, height, depth = (rng.randint(1, 6) for _ in range(3))
+        keys = bytes(
+            EMPTY if rng.random() < 0.25 else rng.randrange(64)
+            for _ in range(width * height * depth)
+        )
+        volume = VoxelVolume(width, height, depth, keys)
+        assert volume.visible() == visible_per_voxel(volume)
+
+
+def test_heightmap_extrusion():
+    keys = bytes([5, 6, EMPTY, 7])
+    heights = bytes([0, 255, 255, 128]).translate(height_lut(4))
+    assert heights == bytes([1, 4, 4, 2])
+    volume = VoxelVolume.from_heightmap(2, 2, keys, heights)
+    assert volume.depth == 4
+    assert volume.occupancy().count(1) == 1 + 4 + 2
+
+    table = volume.to_table(anchor, default_mapping_tables(), z_up=10.0)
+    assert len(table) == 7
+    assert set(table.object_ids) == {CUBE_SOLID}
+    # Layers stack along Up, one tile spacing apart
+    column = sorted(obj.position[1] for obj in table if obj.position[::2] == [6.5, 3.0])
+    assert column == [12.0, 17.0, 22.0, 27.0]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"heightmap": "sprites/picard.png"}, {"layers": ("sprites/picard.png",)}],
+)
+def test_mismatched_volume_names_the_file(options):
+    job = GenerationJob(
+        base_json="base.json",
+        sprite_file="sprites/mega_man_standing.png",
+        z_up=0.0,
+        output_file="out.json",
+        **options,
+    )
+    with pytest.raises(IncompatibleImageError, match="picard.png is 54x54"):
+        map_volume(job, anchor, default_mapping_tables())
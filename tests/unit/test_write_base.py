@@ -0,0 +1,51 @@
+import gzip
+import io
+import json
+
+from model import ObjectTable
+from serialization import open_output, write_base
+from tests.helpers import base_computer
+
+base_data = {
+    "Name": "Test Base",
+    "Position": [1.0, -2.5, 3.0],
+    "Objects": [base_computer],
+    "Owner": {"UID": "0", "Name": "é\n"},
+    "Empty": [],
+}
+generated = [
+    {**base_data["Objects"][0], "ObjectID": "^S_FLOOR", "Position": [5.0, 40.0, 0.0]},
+    {**base_data["Objects"][0], "ObjectID": "^T_FLOOR", "Position": [10.0, 40.0, 0.0]},
+]
+expected_data = {**base_data, "Objects": base_data["Objects"] + generated}
+
+
+def write_to_string(*args, **kwargs) -> str:
+    outfile = io.StringIO()
+    write_base(outfile, *args, **kwargs)
+    return outfile.getvalue()
+
+
+def test_write_base_matches_json_dump():
+    generated_table = ObjectTable.from_dicts(generated)
+    text = write_to_string(base_data, generated_table.iter_dicts())
+    assert text == json.dumps(expected_data, indent=4)
+
+
+def test_write_base_compact():
+    text = write_to_string(base_data, iter(generated), indent=None)
+    assert text == json.dumps(expected_data, separators=(",", ":"))
+
+
+def test_write_base_without_generated_objects():
+    assert write_to_string(base_data) == json.dumps(base_data, indent=4)
+    empty_objects = {"Objects": []}
+    assert write_to_string(empty_objects) == json.dumps(empty_objects, indent=4)
+
+
+def test_write_base_gzip(tmp_path):
+    output_file = tmp_path / "base.json.gz"
+    with open_output(output_file) as outfile:
+        write_base(outfile, base_data, generated, indent=None)
+    with gzip.open(output_file, "rt", encoding="utf-8") as infile:
+        assert json.load(infile) == expected_data
@@ -5,23 +5,31 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-class IncompatibleImageError:
+# Image modes that convert losslessly to RGBA for quantization
+SUPPORTED_IMAGE_MODES = ("1", "L", "LA", "La", "P", "PA", "RGB", "RGBA", "RGBa", "RGBX")
+
+
+class IncompatibleImageError(Exception):
     pass
 
 
-def validate_pixel_input_data(pixel_input_data):
-    """Confirm that the pixel data adheres to the limitations we impose"""
+def validate_pixel_input_data(pixel_input_data, check_size=True):
+    """Confirm that the pixel data adheres to the limitations we impose. Only the image
+    header (size and mode) is inspected, so this does not decode the pixel data. The size
+    check can be skipped when the caller budgets objects itself (see sharding)."""
 
     # Limit of 3000 pixels
     width, height = pixel_input_data.size
-    if width * height > MAX_BASE_OBJS:
+    if check_size and width * height > MAX_BASE_OBJS:
         raise ImageTooBigError
 
-    # Confirm quantization compat the laziest way ever
-    try:
-        pixel_input_data.quantize(colors=256)
-    except ValueError:
-        raise IncompatibleImageError
+    if width == 0 or height == 0:
+        raise IncompatibleImageError("The image is empty")
+
+    # Confirm the pixel data can be converted to RGB(A) and quantized
+    if pixel_input_data.mode not in SUPPORTED_IMAGE_MODES:
+        logger.error(f"Unsupported image mode {pixel_input_data.mode}")
+        raise IncompatibleImageError(f"Unsupported image mode {pixel_input_data.mode}")
 
 
 def validate_base_input_data(base_input_data: dict):
@@ -40,6 +48,18 @@ def validate_base_input_data(base_input_data: dict):
     # TODO: Once we've made the logic more flexible, just check that a base computer is found
 
 
+def validate_base_document(base_document):
+    """Checks a scanned BaseDocument (see serialization) for an Objects array and a base
+    computer. Unlike validate_base_input_data, the base computer may be anywhere in Objects."""
+    if base_document.objects_end is None:
+        logger.error("Objects array in base data was not found")
+        raise InvalidBaseDataError
+
+    if base_document.base_computer is None:
+        logger.error("No base computer was found in the Objects array")
+        raise InvalidBaseDataError
+
+
 class InvalidBaseDataError(Exception):
     pass
 
@@ -56,3 +76,27 @@ class InvalidImageType(Exception):
     """Raises when the image to be converted has not been quantized to 64-color format before conversion"""
 
     pass
+
+
+class InvalidMappingProfileError(Exception):
+    """Raised when a mapping profile file is malformed or maps to invalid values"""
+
+    pass
+
+
+class InvalidBatchManifestError(Exception):
+    """Raised when a batch manifest cannot be turned into generation jobs"""
+
+    pass
+
+
+class InvalidServiceRequestError(Exception):
+    """Raised when a request to the generation service is malformed"""
+
+    pass
+
+
+class PlacementConflictError(Exception):
+    """Raised when generated objects cannot be moved clear of a base's existing objects"""
+
+    pass
@@ -0,0 +1,146 @@
+from array import array
+from itertools import compress
+from typing import List
+
+from constants import CUBE_SOLID
+from mapping import MappingTables
+from model import NMSObject, ObjectTable
+from placement import DEFAULT_PLACEMENT, Placement, lift, place_grid, placement_frame
+
+# Key of an empty voxel; palette indexes stop well before it
+EMPTY = 255
+
+# Widens a 0/1 plane to 0x00/0xFF bytes, for masking whole bytes with integer operations
+_BYTE_MASK = bytes([0, 255]) + bytes(254)
+
+
+def layer_keys(pixels: bytes, keep: bytes) -> bytes:
+    """The palette index of every kept pixel and EMPTY elsewhere, computed with a few
+    big integer operations over the whole plane rather than per pixel."""
+    size = len(pixels)
+    kept = int.from_bytes(keep.translate(_BYTE_MASK), "little")
+    everything = (1 << (8 * size)) - 1
+    keys = int.from_bytes(pixels, "little") & kept | (everything & ~kept)
+    return keys.to_bytes(size, "little")
+
+
+def height_lut(max_height: int) -> bytes:
+    """Maps a heightmap value (0 to 255) to a column height from 1 to max_height."""
+    return bytes(1 + value * (max_height - 1) // 255 for value in range(256))
+
+
+class VoxelVolume(object):
+    """A width x height x depth grid of palette indexes, one byte per voxel, stored
+    layer by layer with rows in sprite order; EMPTY marks empty voxels. Layer 0 is the
+    bottom of the volume."""
+
+    def __init__(self, width: int, height: int, depth: int, keys: bytes):
+        if len(keys) != width * height * depth:
+            raise ValueError("The voxel data does not match the volume size")
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.keys = bytes(keys)
+
+    @classmethod
+    def from_layers(cls, width: int, height: int, layers: List[bytes]):
+        """Stacks per-layer key planes (see layer_keys), bottom layer first."""
+        return cls(width, height, len(layers), b"".join(layers))
+
+    @classmethod
+    def from_heightmap(cls, width: int, height: int, keys: bytes, heights: bytes):
+        """Extrudes a key plane into columns; heights holds the number of voxels in each
+        column. Each layer is selected from the whole height plane with one translate."""
+        depth = max(heights, default=0)
+        layers = []
+        for layer in range(depth):
+            in_column = heights.translate(bytes(int(h > layer) for h in range(256)))
+            layers.append(layer_keys(keys, in_column))
+        return cls(width, height, depth, b"".join(layers))
+
+    def __len__(self):
+        return self.width * self.height * self.depth
+
+    def occupancy(self) -> bytes:
+        """1 for every filled voxel, 0 for empty ones."""
+        return self.keys.translate(b"\x01" * EMPTY + b"\x00")
+
+    def visible(self) -> bytes:
+        """1 for every filled voxel with at least one face that is not covered by a
+        neighbour. The volume is padded with a layer of empty voxels on every side, so
+        each of the six neighbours is a fixed offset in the flat array, and the check
+        for all voxels at once is an AND of shifted copies of the occupancy as one big
+        integer (one byte per voxel)."""
+        width, height, depth = self.width + 2, self.height + 2, self.depth + 2
+        occupancy = self.occupancy()
+        padded = bytearray(width * height * depth)
+        for layer in range(self.depth):
+            for row in range(self.height):
+                source = (layer * self.height + row) * self.width
+                target = ((layer + 1) * height + row + 1) * width + 1
+                padded[target : target + self.width] = occupancy[
+                    source : source + self.width
+                ]
+
+        filled = int.from_bytes(padded, "little")
+        enclosed = filled
+        for offset in (1, width, width * height):
+            enclosed &= (filled >> (8 * offset)) & (filled << (8 * offset))
+        exposed = (filled & ~enclosed).to_bytes(len(padded), "little")
+
+        visible = bytearray(len(self))
+        for layer in range(self.depth):
+            for row in range(self.height):
+                source = ((layer + 1) * height + row + 1) * width + 1
+                target = (layer * self.height + row) * self.width
+                visible[target : target + self.width] = exposed[
+                    source : source + self.width
+                ]
+        return bytes(visible)
+
+    def to_table(
+        self,
+        anchor_object: NMSObject,
+        tables: MappingTables,
+        z_up=0.0,
+        tile_spacing=5,
+        placement: Placement = DEFAULT_PLACEMENT,
+        object_id: str = CUBE_SOLID,
+        cull=True,
+    ) -> ObjectTable:
+        """One object_id part per voxel, colored through the mapping profile's userdata.
+        Layers are stacked along the plane's normal, one tile spacing apart. With cull,
+        voxels that cannot be seen from anywhere are left out."""
+        keep = self.visible() if cull else self.occupancy()
+        frame = placement_frame(anchor_object, placement, tile_spacing, self.height)
+        base_offset = lift(anchor_object, z_up)
+        spacing = tile_spacing * placement.scale
+        layer_size = self.width * self.height
+
+        positions = array("d")
+        kept_keys = []
+        for layer in range(self.depth):
+            layer_keep = keep[layer * layer_size : (layer + 1) * layer_size]
+            if not layer_keep.count(1):
+                continue
+            offset = [
+                value + layer * spacing * normal
+                for value, normal in zip(base_offset, frame.normal)
+            ]
+            positions.extend(
+                place_grid(frame, self.width, self.height, layer_keep, offset)
+            )
+            layer_pixels = self.keys[layer * layer_size : (layer + 1) * layer_size]
+            kept_keys.append(bytes(compress(layer_pixels, layer_keep)))
+        keys = b"".join(kept_keys)
+
+        table = ObjectTable.from_tiles(
+            anchor_object,
+            [object_id],
+            array("H", bytes(2 * len(keys))),
+            positions,
+            array("q", map(tables.userdata_lut.__getitem__, keys)),
+        )
+        table.up = array("d", frame.part_up) * len(table)
+        table.at = array("d", frame.part_at) * len(table)
+        return table